@@ -0,0 +1,57 @@
+"""
+Measure the time to compile the derivative, auxiliary and Jacobian functions
+of a model without the code cache, with a cold cache and with a warm cache.
+
+Each measurement uses a fresh compiler, as a new process would.
+
+Usage:
+    python benchmarks/bench_cache.py
+"""
+import tempfile
+import time
+
+from toy.compiler import Compiler
+from toy.compiler.cache import CodeCache
+from toy.examples.dice import DICE, Carbon
+from toy.examples.lorenz import Lorenz
+
+MODELS = [Lorenz, Carbon, DICE]
+KINDS = ['diff', 'aux', 'jacobian']
+REPEAT = 10
+
+
+def compile_time(model, cache, clear=False, repeat=REPEAT):
+    """
+    Best time to compile all functions of model in milliseconds.
+    """
+    template = model._template
+    best = float('inf')
+    for _ in range(repeat):
+        if clear:
+            cache.clear()
+        start = time.perf_counter()
+        compiler = Compiler(template.vars, template.aux, template.equations,
+                            dtype=template.dtype, params=template.params,
+                            cache=cache)
+        for kind in KINDS:
+            compiler.function(kind)
+        best = min(best, time.perf_counter() - start)
+    return 1e3 * best
+
+
+def main():
+    print(f'{"model":>8}{"no cache (ms)":>15}{"cold (ms)":>11}{"warm (ms)":>11}'
+          f'{"speedup":>9}')
+    with tempfile.TemporaryDirectory() as path:
+        cache = CodeCache(path)
+        for cls in MODELS:
+            model = cls()
+            none = compile_time(model, False)
+            cold = compile_time(model, cache, clear=True)
+            warm = compile_time(model, cache)
+            print(f'{cls.__name__:>8}{none:>15.1f}{cold:>11.1f}{warm:>11.1f}'
+                  f'{none / warm:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare the throughput of integrating an ensemble of parameter samples at
+once against running each sample separately.
+
+Usage:
+    python benchmarks/bench_ensemble.py
+"""
+import time
+
+import numpy as np
+
+from toy.examples.dice import Carbon
+
+MEMBERS = [10, 100, 1000, 10_000]
+STEPS = 100
+
+
+def samples(n, seed=0):
+    """
+    Random samples of the carbon cycle transfer coefficients.
+    """
+    rng = np.random.RandomState(seed)
+    return {'f_AO': rng.uniform(0.02, 0.03, n), 'f_OA': rng.uniform(0.03, 0.05, n)}
+
+
+def bench_ensemble(model, params):
+    start = time.perf_counter()
+    model.run_ensemble(0, 100, STEPS, **params)
+    return time.perf_counter() - start
+
+
+def bench_loop(model, params):
+    start = time.perf_counter()
+    for f_AO, f_OA in zip(params['f_AO'], params['f_OA']):
+        model.with_params(f_AO=f_AO, f_OA=f_OA).run(0, 100, STEPS)
+    return time.perf_counter() - start
+
+
+def main():
+    model = Carbon()
+    model.run_ensemble(0, 100, STEPS)
+    print(f'{"members":>10}{"ensemble (s)":>14}{"loop (s)":>12}{"speedup":>10}')
+    for n in MEMBERS:
+        params = samples(n)
+        ensemble = bench_ensemble(model, params)
+        if n > 1000:
+            print(f'{n:>10}{ensemble:>14.4f}{"-":>12}{"-":>10}')
+            continue
+        loop = bench_loop(model, params)
+        print(f'{n:>10}{ensemble:>14.4f}{loop:>12.4f}{loop / ensemble:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
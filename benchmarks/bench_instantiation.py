@@ -0,0 +1,46 @@
+"""
+Measure the cost of creating model instances that override initial conditions
+or parameters, comparing instances created from the compiled class template
+against instances created from declarations.
+
+Usage:
+    python benchmarks/bench_instantiation.py
+"""
+import time
+
+from toy.examples.dice import Carbon, Temperature, Production, Population
+from toy.examples.lorenz import Lorenz
+
+MODELS = [Lorenz, Carbon, Temperature, Production, Population]
+REPEAT = 200
+
+
+def bench(fn, repeat=REPEAT):
+    """
+    Mean time of fn() in microseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return 1e6 * (time.perf_counter() - start) / repeat
+
+
+def main():
+    print(f'{"model":>12}{"override":>16}{"declarations (us)":>19}'
+          f'{"template (us)":>15}{"speedup":>9}')
+    for cls in MODELS:
+        model = cls()
+        model.run(0, 1, 10)
+        var = next(iter(model.vars))
+        param = next(iter(model._template.free_params), var)
+        value = model.param_values().get(param) or model.var_values()[param]
+        for name in dict.fromkeys([var, param]):
+            ns = {name: 1.5 * value}
+            slow = bench(lambda: cls._from_declarations(ns), REPEAT // 10)
+            fast = bench(lambda: cls(**ns))
+            print(f'{cls.__name__:>12}{name:>16}{slow:>19.1f}{fast:>15.1f}'
+                  f'{slow / fast:>8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Compare the wall-clock time of a century-scale run of the temperature model
+integrated serially and with Parareal over a pool of worker processes.
+
+Usage:
+    python benchmarks/bench_parareal.py
+"""
+import os
+import time
+
+from toy.examples.dice import Temperature
+
+YEARS = 1000
+STEPS = 200_000
+
+
+def main():
+    model = Temperature()
+    model.run(0, 1, 10)
+
+    start = time.perf_counter()
+    serial = model.run(0, YEARS, STEPS)
+    serial_time = time.perf_counter() - start
+    print(f'cpus: {os.cpu_count()}, steps: {STEPS:,}, serial: {serial_time:.3f}s')
+
+    print(f'{"workers":>8}{"slices":>8}{"iters":>7}{"wall (s)":>10}'
+          f'{"speedup":>10}{"estimated":>11}{"max error":>11}')
+    for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        start = time.perf_counter()
+        run = model.run_parareal(0, YEARS, STEPS, workers=workers,
+                                 slices=max(workers, 2), coarse_steps=100)
+        wall = time.perf_counter() - start
+        stats = run.parareal
+        error = abs(run.values - serial.values).max()
+        print(f'{workers:>8}{stats.slices:>8}{stats.iterations:>7}{wall:>10.3f}'
+              f'{serial_time / wall:>9.2f}x{stats.speedup:>10.2f}x{error:>11.2e}')
+
+
+if __name__ == '__main__':
+    main()
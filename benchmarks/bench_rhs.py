@@ -0,0 +1,68 @@
+"""
+Compare the number of RHS calls per second for each compiler backend and
+the number of operations removed by common subexpression elimination.
+
+Usage:
+    python benchmarks/bench_rhs.py
+"""
+import timeit
+
+from toy.compiler import Compiler, jit
+from toy.examples.dice import Carbon, Temperature, Production, Emissions, Costs
+from toy.examples.lorenz import Lorenz
+
+MODELS = [Lorenz, Carbon, Temperature, Production, Emissions, Costs]
+CONFIGS = {
+    'lambdify': {'backend': 'lambdify'},
+    'python': {'backend': 'python'},
+    'python+cse': {'backend': 'python', 'cse': True},
+}
+if jit.is_available():
+    CONFIGS['numba'] = {'backend': 'numba'}
+
+
+def calls_per_second(fn, x, number=20_000):
+    """
+    Number of calls to fn(t, x) per second.
+    """
+    time = min(timeit.repeat(lambda: fn(0.0, x), number=number, repeat=3))
+    return number / time
+
+
+def bench_model(cls, configs=CONFIGS):
+    """
+    Return a dictionary mapping configurations to RHS calls per second.
+    """
+    model = cls()
+    x = model._meta.y0
+    result = {}
+    for name, options in configs.items():
+        compiler = Compiler(model.vars, model.aux, model.equations,
+                            dtype=model.dtype, **options)
+        result[name] = calls_per_second(compiler.compile_diff_fn(), x)
+    return result
+
+
+def ops_removed(cls):
+    """
+    Return the number of operations removed by CSE.
+    """
+    model = cls()
+    compiler = Compiler(model.vars, model.aux, model.equations, cse=True)
+    return compiler.cse_stats().removed
+
+
+def main():
+    names = list(CONFIGS)
+    header = ''.join(f'{name:>14}' for name in names)
+    print(f'{"model":<14}{header}{"speedup":>10}{"cse ops":>10}')
+    for cls in MODELS:
+        result = bench_model(cls)
+        speedup = max(result.values()) / result[names[0]]
+        cols = ''.join(f'{result[name]:>14,.0f}' for name in names)
+        removed = ops_removed(cls)
+        print(f'{cls.__name__:<14}{cols}{speedup:>9.1f}x{removed:>10}')
+
+
+if __name__ == '__main__':
+    main()
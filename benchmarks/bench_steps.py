@@ -0,0 +1,64 @@
+"""
+Compare the number of integration steps per second of the Lorenz model
+when states are recorded by a per-step callback and when the solver writes
+them directly into the output buffer.
+
+Usage:
+    python benchmarks/bench_steps.py
+"""
+import time
+
+import numpy as np
+
+from toy.compiler import jit
+from toy.examples.lorenz import Lorenz
+from toy.solvers import RK4
+
+STEPS = 100_000
+BACKENDS = ['python', 'numba'] if jit.is_available() else ['python']
+
+
+def bench_callback(fn, y0, dt):
+    """
+    Steps per second recording states with a callback, as Run used to do.
+    """
+    data = np.zeros((len(dt) + 1, len(y0)))
+    idx = [1]
+
+    def callback(t, y):
+        data[idx[0]] = y
+        idx[0] += 1
+
+    solver = RK4(fn, y0, callback=callback)
+    start = time.perf_counter()
+    solver.steps(dt)
+    return len(dt) / (time.perf_counter() - start)
+
+
+def bench_fast(fn, y0, dt):
+    """
+    Steps per second writing directly into the output buffer.
+    """
+    data = np.zeros((len(dt) + 1, len(y0)))
+    solver = RK4(fn, y0)
+    start = time.perf_counter()
+    solver.solve_into(dt, data)
+    return len(dt) / (time.perf_counter() - start)
+
+
+def main():
+    dt = np.full(STEPS, 0.001)
+    print(f'{"backend":<10}{"callback":>14}{"fast":>14}{"speedup":>10}')
+    for backend in BACKENDS:
+        model = Lorenz()
+        model.compile(backend=backend)
+        fn = model._meta.diff_fn
+        y0 = model._meta.y0
+        bench_fast(fn, y0, dt[:10])  # warm up jit
+        slow = bench_callback(fn, y0, dt)
+        fast = bench_fast(fn, y0, dt)
+        print(f'{backend:<10}{slow:>14,.0f}{fast:>14,.0f}{fast / slow:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Measure how the cost of recording results in a Run scales with the number of
+incremental steps, comparing geometric growth of buffers against the former
+strategy of concatenating new rows at each call.
+
+Usage:
+    python benchmarks/bench_storage.py
+"""
+import time
+
+import numpy as np
+
+from toy.examples.dice import Carbon
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+LEGACY_MAX = 100_000
+CHUNK = 1
+
+
+def bench_run(n, reserve=False):
+    """
+    Time to append n states to a run, CHUNK steps at a time.
+    """
+    run = Carbon().runner()
+    rows = np.ones((CHUNK, 3))
+    times = np.arange(1.0, CHUNK + 1)
+    start = time.perf_counter()
+    if reserve:
+        run.reserve(n)
+    for i in range(0, n, CHUNK):
+        run._append(times + i, rows)
+    return time.perf_counter() - start
+
+
+def bench_legacy(n):
+    """
+    Time to append n states growing buffers with vstack/concatenate.
+    """
+    values = np.zeros((1, 3))
+    times = np.zeros(1)
+    row = np.ones((CHUNK, 3))
+    idx = 1
+    start = time.perf_counter()
+    for i in range(0, n, CHUNK):
+        missing = CHUNK - (len(times) - idx)
+        if missing > 0:
+            values = np.vstack([values, np.zeros((missing, 3))])
+            times = np.concatenate([times, np.zeros(missing)])
+        values[idx:idx + CHUNK] = row
+        times[idx:idx + CHUNK] = i
+        idx += CHUNK
+    return time.perf_counter() - start
+
+
+def main():
+    print(f'{"steps":>10}{"legacy (s)":>12}{"growth (s)":>12}{"reserve (s)":>13}'
+          f'{"us/step":>9}')
+    for n in SIZES:
+        legacy = f'{bench_legacy(n):>12.3f}' if n <= LEGACY_MAX else f'{"-":>12}'
+        growth = bench_run(n)
+        reserve = bench_run(n, reserve=True)
+        print(f'{n:>10,}{legacy}{growth:>12.3f}{reserve:>13.3f}'
+              f'{1e6 * growth / n:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
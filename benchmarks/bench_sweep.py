@@ -0,0 +1,44 @@
+"""
+Compare a parameter sweep of the carbon model written as a loop of runs
+against Model.sweep() over a pool of worker processes, with full
+trajectories and reduced to summary statistics.
+
+Usage:
+    python benchmarks/bench_sweep.py
+"""
+import os
+import time
+
+from toy.core.sweep import latin_hypercube
+from toy.examples.dice import Carbon
+
+MEMBERS = 200
+STEPS = 1000
+
+
+def main():
+    model = Carbon()
+    model.run(0, 1, 10)
+    params = latin_hypercube(MEMBERS, seed=0, f_AO=(0.02, 0.03), f_OA=(0.03, 0.05))
+
+    start = time.perf_counter()
+    for f_AO, f_OA in zip(params['f_AO'], params['f_OA']):
+        model.with_params(f_AO=f_AO, f_OA=f_OA).run(0, 100, STEPS)
+    loop = time.perf_counter() - start
+    print(f'cpus: {os.cpu_count()}, members: {MEMBERS:,}, steps: {STEPS:,}, '
+          f'loop: {loop:.3f}s')
+
+    print(f'{"workers":>8}{"reduce":>14}{"wall (s)":>10}{"speedup":>10}{"result (MB)":>13}')
+    for workers in sorted({0, 1, 2, os.cpu_count() or 1}):
+        for reduce in [None, ('final', 'max')]:
+            start = time.perf_counter()
+            sweep = model.sweep(0, 100, STEPS, params=params, workers=workers,
+                                reduce=reduce)
+            wall = time.perf_counter() - start
+            label = ','.join(reduce) if reduce else '-'
+            print(f'{workers:>8}{label:>14}{wall:>10.3f}{loop / wall:>9.2f}x'
+                  f'{sweep.values.nbytes / 2 ** 20:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+import os
+
+import numpy as np
+import pytest
+from numpy.testing import assert_almost_equal, assert_equal
+from sympy import symbols, Min, Max
+
+from toy import Model, Value
+from toy.compiler import Compiler, base, jit
+from toy.compiler.cache import CodeCache, structural_hash
+from toy.examples.dice import Carbon, Temperature, Production, Emissions, Costs
+from toy.examples.lorenz import Lorenz
+from toy.examples.particle import Particle2D
+from toy.solvers import RK4
+
+MODELS = [Lorenz, Carbon, Temperature, Production, Emissions, Costs]
+
+
+def compiler(model, **kwargs):
+    kwargs.setdefault('dtype', model.dtype)
+    return Compiler(model.vars, model.aux, model.equations, **kwargs)
+
+
+class TestBackends:
+    @pytest.mark.parametrize('cls', MODELS)
+    def test_generated_code_agrees_with_lambdify(self, cls):
+        m = cls()
+        x = m._meta.y0
+        python = compiler(m, backend='python')
+        lambdify = compiler(m, backend='lambdify')
+        assert_almost_equal(python.compile_diff_fn()(1.0, x),
+                            lambdify.compile_diff_fn()(1.0, x))
+        assert_almost_equal(python.compile_aux_fn()(1.0, x),
+                            lambdify.compile_aux_fn()(1.0, x))
+
+    @pytest.mark.parametrize('backend', ['python', 'lambdify'])
+    def test_write_derivatives_into_out_array(self, backend):
+        m = Lorenz()
+        x = m._meta.y0
+        fn = compiler(m, backend=backend).compile_diff_fn()
+        out = np.zeros(3)
+        assert fn(0.0, x, out) is out
+        assert_almost_equal(out, fn(0.0, x))
+
+    def test_generated_source_is_a_single_function(self):
+        src = compiler(Lorenz()).diff_source()
+        assert src.count('def ') == 1
+        assert 'v_x = x[0]' in src
+
+    def test_lambdify_mixes_vars_and_aux(self):
+        class M(Model):
+            x = 2.0
+            a = 3 * x
+            D_x = a - x
+
+        m = M()
+        fn = compiler(m, backend='lambdify').compile_diff_fn()
+        assert_almost_equal(fn(0.0, np.array([2.0])), [4.0])
+
+    @pytest.mark.parametrize('backend', ['python', 'lambdify'])
+    def test_read_parameters_from_vector(self, backend):
+        m = Lorenz()
+        c = m._template.compiler(backend=backend)
+        fn = c.compile_diff_fn()
+        p = c.vectorize_params(m.param_values())
+        x = m._meta.y0
+        assert_almost_equal(fn(0.0, x, p=p), [-10, 28, 0])
+        p[c.param_map()['rho']] = 10
+        assert_almost_equal(fn(0.0, x, p=p), [-10, 10, 0])
+        if backend == 'python':
+            assert 'p_rho = p[' in c.diff_source()
+
+    def test_invalid_backend(self):
+        with pytest.raises(ValueError):
+            compiler(Lorenz(), backend='fortran')
+
+
+class TestBatch:
+    @pytest.mark.parametrize('cls', MODELS)
+    def test_batch_agrees_with_single_states(self, cls):
+        m = cls()
+        c = m._meta.compiler
+        x = m._meta.y0 * np.linspace(0.5, 1.5, 4)[:, None]
+        p = m._meta.p * np.linspace(0.9, 1.1, 4)[:, None]
+        for kind in ['diff', 'aux']:
+            batch = c.function(kind, batch=True)(1.0, x, p=p)
+            single = [c.function(kind)(1.0, xi, p=pi) for xi, pi in zip(x, p)]
+            assert_almost_equal(batch, single)
+
+    def test_share_parameter_vector(self):
+        m = Lorenz()
+        fn = m._meta.batch_diff_fn
+        x = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+        assert_almost_equal(fn(0.0, x, p=m._meta.p), [[-10, 28, 0], [10, -1, 0]])
+
+    def test_elementwise_min_max(self):
+        x, y = symbols('x y', real=True)
+        vars = {'x': Value('x', 1.0), 'y': Value('y', 1.0)}
+        eqs = {'x': Min(x, y, 0), 'y': Max(x, y)}
+        fn = Compiler(vars, {}, eqs).compile_diff_fn(batch=True)
+        states = np.array([[1.0, 2.0], [-1.0, -3.0]])
+        assert_almost_equal(fn(0.0, states), [[0, 2], [-3, -1]])
+
+
+class TestCommonSubexpressions:
+    def get_model(self):
+        class M(Model):
+            x = 1.0
+            y = 2.0
+            a = (x + y) ** 2
+            D_x = a + (x + y) ** 2
+            D_y = a * (x + y) ** 2
+
+        return M()
+
+    def test_cse_removes_operations(self):
+        stats = compiler(self.get_model(), cse=True).cse_stats()
+        assert stats.subexpressions >= 1
+        assert stats.removed > 0
+        assert stats.after == stats.before - stats.removed
+
+    def test_cse_agrees_with_plain_code(self):
+        m = self.get_model()
+        x = np.array([1.5, -0.5])
+        plain = compiler(m).compile_diff_fn()
+        reduced = compiler(m, cse=True).compile_diff_fn()
+        assert_almost_equal(reduced(0.0, x), plain(0.0, x))
+        assert 'c_0 = ' in compiler(m, cse=True).diff_source()
+
+    def test_compile_model_with_cse(self):
+        m = self.get_model()
+        assert m.compile(cse=True).cse
+        run = m.run(0, 0.1, 3)
+        assert_almost_equal(run.x_ts[0], 1.0)
+
+
+class TestAuxDependencies:
+    def test_aux_terms_are_evaluated_in_dependency_order(self):
+        x, a, b = symbols('x a b', real=True)
+        vars = {'x': Value('x', 1.0)}
+        aux = {'a': Value('a', 2 * b), 'b': Value('b', x + 1)}
+        for backend in ['python', 'lambdify']:
+            c = Compiler(vars, aux, {'x': a}, backend=backend)
+            assert c.aux_order == ['b', 'a']
+            assert_almost_equal(c.compile_aux_fn()(0.0, np.array([1.0])), [4, 2])
+            assert_almost_equal(c.compile_diff_fn()(0.0, np.array([1.0])), [4])
+
+    def test_detect_cycles_at_compile_time(self):
+        x, a, b = symbols('x a b', real=True)
+        vars = {'x': Value('x', 1.0)}
+        aux = {'a': Value('a', 2 * b + x), 'b': Value('b', a + 1)}
+        with pytest.raises(ValueError, match='a -> b -> a'):
+            Compiler(vars, aux, {'x': a})
+
+    def test_diff_skips_unused_aux_terms(self):
+        src = compiler(Production()).diff_source()
+        assert 'a_Q = ' in src
+        assert 'a_consumption_per_capta' not in src
+
+
+class TestCodeCache:
+    def test_load_generated_code_from_cache(self, tmp_path, monkeypatch):
+        cache = CodeCache(tmp_path)
+        compiler(Lorenz(), cache=cache).compile_diff_fn()
+        assert (cache.hits, cache.misses) == (0, 1)
+
+        def fail(*args, **kwargs):
+            raise AssertionError('should not generate code')
+
+        c = compiler(Lorenz(), cache=cache)
+        monkeypatch.setattr(c, 'diff_source', fail)
+        fn = c.compile_diff_fn()
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert_almost_equal(fn(0.0, np.array([1.0, 0.0, 0.0])), [-10, 28, 0])
+
+    def test_load_jacobian_and_sparsity_from_cache(self, tmp_path, monkeypatch):
+        cache = CodeCache(tmp_path)
+        expect = compiler(Lorenz(), cache=cache).compile_jacobian_fn()
+
+        def fail(*args, **kwargs):
+            raise AssertionError('should not differentiate equations')
+
+        c = compiler(Lorenz(), cache=cache)
+        monkeypatch.setattr(c, 'jacobian_exprs', fail)
+        jac = c.compile_jacobian_fn()
+        x = np.array([1.0, 2.0, 3.0])
+        assert_equal(jac.sparsity, expect.sparsity)
+        assert_almost_equal(jac(0.0, x), expect(0.0, x))
+
+    def test_hash_is_computed_once_per_compiler(self, tmp_path, monkeypatch):
+        calls = []
+        monkeypatch.setattr(base, 'structural_hash',
+                            lambda c: calls.append(c) or structural_hash(c))
+        c = compiler(Lorenz(), cache=CodeCache(tmp_path))
+        c.compile_diff_fn()
+        c.compile_aux_fn()
+        c.compile_jacobian_fn()
+        assert calls == [c]
+
+    def test_hash_depends_on_structure(self):
+        m = Lorenz()
+        key = structural_hash(compiler(m), 'diff')
+        assert key == structural_hash(compiler(Lorenz()), 'diff')
+        assert key != structural_hash(compiler(Lorenz(rho=10)), 'diff')
+        assert key != structural_hash(compiler(m, cse=True), 'diff')
+        assert key != structural_hash(compiler(m, dtype=np.float32), 'diff')
+        assert key != structural_hash(compiler(m), 'aux')
+
+    def test_evict_least_recently_used_entries(self, tmp_path):
+        cache = CodeCache(tmp_path, max_size=100)
+        cache.put('a', 'x' * 60)
+        os.utime(tmp_path / 'a.py', (0, 0))
+        cache.put('b', 'x' * 60)
+        assert cache.get('a') is None
+        assert cache.get('b') == 'x' * 60
+        assert cache.size() <= 100
+
+
+class TestNumbaBackend:
+    def test_jit_compiled_rhs(self):
+        pytest.importorskip('numba')
+        m = Lorenz()
+        x = m._meta.y0
+        fn = compiler(m, backend='numba').compile_diff_fn()
+        assert hasattr(fn, 'kernel')
+        assert_almost_equal(fn(0.0, x), compiler(m).compile_diff_fn()(0.0, x))
+
+    def test_jit_solver_loop(self):
+        pytest.importorskip('numba')
+        m = Lorenz()
+        fn = compiler(m, backend='numba').compile_diff_fn()
+        dt = np.full(100, 0.01)
+        native = RK4(fn, m._meta.y0)
+        python = RK4(compiler(m).compile_diff_fn(), m._meta.y0)
+        assert native.native_loop() is not None
+        assert_almost_equal(native.solve_steps(dt), python.solve_steps(dt))
+        assert (native.t, native.ncalls) == (python.t, python.ncalls)
+
+    def test_fallback_if_numba_is_not_installed(self, monkeypatch):
+        monkeypatch.setattr(jit, 'numba', None)
+        m = Lorenz()
+        with pytest.warns(RuntimeWarning, match='not installed'):
+            fn = compiler(m, backend='numba').compile_diff_fn()
+        assert not hasattr(fn, 'kernel')
+        assert_almost_equal(fn(0.0, m._meta.y0), [-10, 28, 0])
+
+    def test_fallback_if_expression_is_not_supported(self, monkeypatch):
+        def compile_kernel(*args):
+            raise TypeError('unsupported')
+
+        monkeypatch.setattr(jit, 'is_available', lambda: True)
+        monkeypatch.setattr(jit, 'compile_kernel', compile_kernel)
+        with pytest.warns(RuntimeWarning, match='unsupported'):
+            fn = compiler(Lorenz(), backend='numba').compile_diff_fn()
+        assert not hasattr(fn, 'kernel')
+
+
+class TestJacobian:
+    def numeric_jacobian(self, fn, x, eps=1e-6):
+        cols = [(fn(0.0, x + eps * e) - fn(0.0, x - eps * e)) / (2 * eps)
+                for e in np.eye(len(x))]
+        return np.array(cols).T
+
+    @pytest.mark.parametrize('cls', MODELS)
+    def test_jacobian_agrees_with_finite_differences(self, cls):
+        c = compiler(cls())
+        x = cls()._meta.y0 * 1.1
+        jac = c.compile_jacobian_fn(sparse=False)
+        expect = self.numeric_jacobian(c.compile_diff_fn(), x)
+        assert_almost_equal(jac(0.0, x), expect, 5)
+
+    def test_chain_rule_through_aux_terms(self):
+        class M(Model):
+            x = 1.0
+            y = 2.0
+            a = x * y
+            b = a ** 2 + x
+            D_x = b * y
+            D_y = -x
+
+        c = compiler(M())
+        x = np.array([1.3, 0.7])
+        jac = c.compile_jacobian_fn()
+        assert_almost_equal(jac(0.0, x), self.numeric_jacobian(c.compile_diff_fn(), x))
+        assert (jac.sparsity == [[True, True], [True, False]]).all()
+
+    def test_position_velocity_split(self):
+        q, v = compiler(Particle2D()).position_velocity_split()
+        names = list(Particle2D().vars)
+        assert [names[i] for i in q] == ['x', 'y']
+        assert [names[i] for i in v] == ['vx', 'vy']
+        with pytest.raises(ValueError):
+            compiler(Lorenz()).position_velocity_split()
+
+    def test_split_requires_velocity_independent_forces(self):
+        class M(Model):
+            x = 1.0
+            v = 0.0
+            D_x = v
+            D_v = -x - 0.1 * v
+
+        with pytest.raises(ValueError, match='velocities'):
+            compiler(M()).position_velocity_split()
+
+    def test_sparse_jacobian(self):
+        pytest.importorskip('scipy')
+        n = 40
+        vars = {f'x{i}': Value(f'x{i}', 1.0) for i in range(n)}
+        eqs = {f'x{i}': -(i + 1) * vars[f'x{i}'].symbol for i in range(n)}
+        c = Compiler(vars, {}, eqs)
+        jac = c.compile_jacobian_fn()
+        assert jac.sparsity.sum() == n
+        result = jac(0.0, np.ones(n))
+        assert result.format == 'csr'
+        assert_almost_equal(result.toarray(), np.diag(-np.arange(1.0, n + 1)))
+        assert isinstance(c.compile_jacobian_fn(sparse=False)(0.0, np.ones(n)),
+                          np.ndarray)
@@ -2,7 +2,13 @@ import numpy as np
 import pytest
 from numpy.testing import assert_almost_equal
 
-from toy import Model
+from toy import Model, Run, compose
+from toy.core import parareal
+from toy.core.output import Output
+from toy.core.sweep import grid, latin_hypercube
+from toy.examples.dice import Carbon, Costs, Production, DICE
+from toy.examples.lorenz import Lorenz
+from toy.examples.particle import Particle2D
 
 
 class ModelMixin:
@@ -82,6 +88,328 @@ class TestParametricModel(ModelMixin):
         assert m.equations == {'x': 2 * m.x.symbol}
 
 
+class TestAdaptiveRun:
+    def test_run_with_adaptive_solver(self):
+        class M(Model):
+            x = 1.0
+            k = 2.0
+            D_x = -k * x
+
+        times = np.linspace(0, 1, 11)
+        run = M().run(times, solver='dopri5',
+                      solver_options={'rtol': 1e-8, 'atol': 1e-10})
+        assert_almost_equal(run.x_ts, np.exp(-2 * times), 7)
+        assert_almost_equal(run.times, times)
+
+    @pytest.mark.parametrize('solver', ['bdf', 'rosenbrock'])
+    def test_stiff_solvers_use_model_jacobian(self, solver):
+        class M(Model):
+            x = 1.0
+            y = 1.0
+            k = 1000.0
+            D_x = -k * x + y
+            D_y = -y
+
+        times = np.linspace(0, 1, 11)
+        run = M().run(times, solver=solver, solver_options={'rtol': 1e-6})
+        c = 1 / 999
+        assert_almost_equal(run.x_ts, c * np.exp(-times) + (1 - c) * np.exp(-1000 * times), 5)
+        assert run.solver.jac is not None
+        assert run.solver.nsteps < 500
+
+    @pytest.mark.parametrize('solver', ['lsoda', 'radau'])
+    def test_scipy_solvers(self, solver):
+        pytest.importorskip('scipy')
+
+        class M(Model):
+            x = 1.0
+            y = 1.0
+            k = 1000.0
+            D_x = -k * x + y
+            D_y = -y
+
+        times = np.linspace(0, 1, 11)
+        run = M().run(times, solver=solver, solver_options={'rtol': 1e-8})
+        c = 1 / 999
+        assert_almost_equal(run.x_ts, c * np.exp(-times) + (1 - c) * np.exp(-1000 * times), 5)
+        assert run.solver.njev > 0
+
+
+class TestSymplecticRun:
+    @pytest.mark.parametrize('solver', ['leapfrog', 'verlet', 'yoshida4'])
+    def test_particle_under_constant_acceleration(self, solver):
+        run = Particle2D(vx=2.0, ay=-10.0).run(0, 1, 11, solver=solver)
+        assert_almost_equal(run.x_ts, 2 * run.times)
+        assert_almost_equal(run.y_ts, -5 * run.times ** 2)
+        assert_almost_equal(run.vy, -10)
+
+
+class TestParareal:
+    def test_agrees_with_serial_run(self):
+        m = Carbon()
+        serial = m.run(0, 200, 2001)
+        run = m.run_parareal(0, 200, 2001, workers=0, slices=4, coarse_steps=10)
+        assert_almost_equal(run.times, serial.times)
+        assert_almost_equal(run.values / serial.values, 1, 6)
+        assert run.parareal.iterations < 4
+        assert run.parareal.error <= 1
+        assert run.parareal.converged
+
+    def test_converge_after_one_iteration_per_slice(self):
+        m = Lorenz()
+        run = m.run_parareal(0, 1, 501, workers=2, slices=3, rtol=1e-15, atol=1e-15)
+        assert run.parareal.iterations == 3
+        assert not run.parareal.converged
+        assert_almost_equal(run.values, m.run(0, 1, 501).values, 10)
+        assert run.parareal.speedup > 0
+
+    def test_default_coarse_resolution(self):
+        m = Carbon()
+        run = m.run_parareal(0, 100, 4001, workers=0, slices=4)
+        assert run.parareal.converged
+        assert run.parareal.iterations < 4
+        assert_almost_equal(run.values / m.run(0, 100, 4001).values, 1, 6)
+
+    def test_serial_time_is_cpu_time(self, monkeypatch):
+        clock = iter(range(0, 100, 3))
+        monkeypatch.setattr(parareal.time, 'process_time', lambda: next(clock))
+        run = Carbon().run_parareal(0, 10, 101, workers=0, slices=2)
+        assert run.parareal.serial_time == 2 * 3
+
+    def test_not_converged(self):
+        run = Lorenz().run_parareal(0, 1, 501, workers=0, slices=4, max_iter=1)
+        assert run.parareal.iterations == 1
+        assert run.parareal.error > 1
+        assert not run.parareal.converged
+
+    def test_single_time(self):
+        run = Carbon().run_parareal([0.0], workers=0)
+        assert run.parareal.iterations == 0
+        assert run.parareal.converged
+        assert_almost_equal(run.times, [0.0])
+
+
+class TestSweep:
+    def test_agrees_with_single_runs(self):
+        m = Carbon()
+        sweep = m.sweep(0, 100, 21, params=grid(f_AO=[0.02, 0.03], f_OA=[0.03, 0.04]),
+                        workers=0, chunk_size=3)
+        assert sweep.values.shape == (4, 21, 3)
+        assert_almost_equal(sweep.params['f_OA'], [0.03, 0.04, 0.03, 0.04])
+        for i in range(4):
+            params = {k: v[i] for k, v in sweep.params.items()}
+            run = m.with_params(**params).run(0, 100, 21)
+            assert_almost_equal(sweep.co2_atm_ts[i], run.co2_atm_ts)
+            assert_almost_equal(sweep.member(i), run.values.T)
+
+    def test_process_pool(self):
+        m = Lorenz()
+        params = [{'rho': 10.0, 'x': 1.0}, {'rho': 28.0, 'x': 2.0}, {'rho': 5.0, 'x': 0.5}]
+        sweep = m.sweep(0, 1, 51, params=params, workers=2, chunk_size=2)
+        local = m.sweep(0, 1, 51, params=params, workers=0)
+        assert_almost_equal(sweep.values, local.values)
+        assert_almost_equal(sweep.x_ts[:, 0], [1.0, 2.0, 0.5])
+
+    def test_reduce_to_statistics(self):
+        m = Carbon()
+        params = latin_hypercube(5, seed=0, f_AO=(0.02, 0.03))
+        full = m.sweep(0, 100, 21, params=params, workers=0)
+        sweep = m.sweep(0, 100, 21, params=params, workers=0, reduce=['final', 'max'])
+        assert sweep.values.shape == (5, 2, 3)
+        assert_almost_equal(sweep.statistic('final'), full.values[:, -1])
+        assert_almost_equal(sweep.statistic('max', 'co2_deep'), full.co2_deep_ts.max(1))
+        assert_almost_equal(sweep.co2_atm[:, 0], full.co2_atm)
+        with pytest.raises(ValueError):
+            sweep.statistic('std')
+        with pytest.raises(ValueError):
+            m.sweep(1, params=params, reduce='median')
+
+    def test_reduce_with_function(self):
+        sweep = Carbon().sweep(0, 100, 21, params={'f_AO': [0.02, 0.03]}, workers=0,
+                               reduce=lambda ts, ys: ys[:, 0].sum())
+        assert sweep.values.shape == (2,)
+
+    @pytest.mark.parametrize('workers', [0, 2])
+    def test_progress(self, workers):
+        calls = []
+        Carbon().sweep(1, params={'f_AO': np.linspace(0.02, 0.03, 5)}, workers=workers,
+                       chunk_size=2, progress=lambda *args: calls.append(args))
+        done = [n for n, total in calls]
+        assert {total for n, total in calls} == {5}
+        assert len(done) == 3 and done == sorted(done) and done[-1] == 5
+        if workers == 0:
+            assert done == [2, 4, 5]
+
+    def test_invalid_parameters(self):
+        with pytest.raises(TypeError):
+            Carbon().sweep(1, params={'invalid': [1, 2]}, workers=0)
+
+    def test_designs(self):
+        table = grid(a=[1, 2, 3], b=[0, 1])
+        assert_almost_equal(table['a'], [1, 1, 2, 2, 3, 3])
+        assert_almost_equal(table['b'], [0, 1, 0, 1, 0, 1])
+        table = latin_hypercube(10, seed=0, a=(0, 1), b=(2, 4))
+        assert sorted((table['a'] * 10).astype(int)) == list(range(10))
+        assert sorted(((table['b'] - 2) * 5).astype(int)) == list(range(10))
+
+    def test_to_dataframe(self):
+        pytest.importorskip('pandas')
+        sweep = Carbon().sweep(1, params={'f_AO': [0.02, 0.03]}, workers=0,
+                               reduce=['final', 'max'])
+        df = sweep.to_dataframe()
+        assert list(df.columns)[:3] == ['f_AO', 'co2_atm_final', 'co2_shallow_final']
+        assert len(df) == 2
+
+
+class TestRunStorage:
+    def test_incremental_runs_grow_geometrically(self):
+        run = Carbon().runner()
+        sizes = set()
+        for _ in range(100):
+            run.run(steps=3)
+            sizes.add(len(run._times))
+        assert len(run.times) == 201
+        assert len(sizes) < 10
+        assert_almost_equal(run.values, Carbon().run(0, 1000, 201).values)
+
+    def test_keep_model_dtype(self):
+        class M(Model):
+            x = 1.0
+            D_x = -x
+
+        M.dtype = np.float32
+        run = M().runner()
+        run.run(0, 1, 11)
+        run.run(steps=11)
+        assert run.values.dtype == np.float32
+
+    def test_reserve(self):
+        run = Carbon().runner()
+        assert run.reserve(1001) is run
+        buffer = run._values
+        for _ in range(10):
+            run.run(steps=101)
+        run.step(1.0)
+        assert run._values is buffer
+        assert len(run.times) == 1002
+
+
+class TestMemmapStorage:
+    def test_save_results_to_files(self, tmp_path):
+        m = Lorenz()
+        run = m.run(0, 1, 101, storage=tmp_path)
+        run.run(1, 1.5, steps=51)
+        assert isinstance(run.values, np.memmap)
+        assert_almost_equal(run.values, m.run(0, 1.5, 151).values)
+        assert sorted(p.name for p in tmp_path.iterdir()) == \
+            ['run.json', 'times.npy', 'values.npy']
+
+    def test_reopen_saved_run(self, tmp_path):
+        run = Lorenz().run(0, 1, 101, storage=tmp_path)
+        saved = Run.open(tmp_path, Lorenz(), mode='r')
+        assert isinstance(saved.x_ts.base, np.memmap)
+        assert_almost_equal(saved.x_ts, run.x_ts)
+        assert saved.t == 1.0
+
+    def test_continue_saved_run(self, tmp_path):
+        Lorenz().run(0, 1, 101, storage=tmp_path)
+        run = Run.open(tmp_path, Lorenz())
+        run.run(1, 1.5, steps=51)
+        assert_almost_equal(Run.open(tmp_path, Lorenz(), mode='r').values,
+                            Lorenz().run(0, 1.5, 151).values)
+
+    def test_model_must_match_saved_variables(self, tmp_path):
+        Lorenz().run(0, 1, 11, storage=tmp_path)
+        with pytest.raises(ValueError):
+            Run.open(tmp_path, Carbon())
+
+
+class TestOutputSchedule:
+    class Decay(Model):
+        x = 1.0
+        k = 2.0
+        D_x = -k * x
+
+    def test_every_nth_step(self):
+        m = Lorenz()
+        full = m.run(0, 1, 1001)
+        run = m.run(0, 1, 1001, output=10)
+        assert_almost_equal(run.times, full.times[::10])
+        assert_almost_equal(run.values, full.values[:, ::10])
+
+    def test_every_nth_step_across_chunks(self, monkeypatch):
+        monkeypatch.setattr(Output, 'chunk_size', 7)
+        full = Lorenz().run(0, 1, 101)
+        run = Lorenz().run(0, 1, 101, output=3)
+        assert_almost_equal(run.values, full.values[:, ::3])
+
+    def test_interpolate_output_times(self):
+        out = np.linspace(0, 1, 7)
+        run = self.Decay().run(0, 1, 101, output=out)
+        assert_almost_equal(run.times, out)
+        assert_almost_equal(run.x_ts, np.exp(-2 * out), 7)
+        assert run.t == 1.0
+
+    def test_predicate(self):
+        run = self.Decay().run(0, 1, 101, output=lambda t, y: y[0] < 0.5)
+        assert run.times[1] == pytest.approx(0.35)
+        assert len(run.times) == 67
+
+
+class TestAuxSeries:
+    def test_aux_time_series(self):
+        m = Production()
+        run = m.run(0, 10, 11)
+        aux_fn, c = m._meta.aux_fn, m._meta.compiler
+        for name in ['Q', 'Q_raw', 'consumption_per_capta']:
+            expect = [aux_fn(t, y)[c.aux_index(name)] for t, y in zip(run.times, run.values.T)]
+            assert_almost_equal(getattr(run, name + '_ts'), expect)
+            assert_almost_equal(getattr(run, name), expect[-1])
+
+    def test_cache_until_run_advances(self):
+        run = Production().run(0, 10, 11)
+        series = run.aux_series()
+        assert run.aux_series() is series
+        run.run(steps=6)
+        assert run.aux_series() is not series
+        assert run.Q_ts.shape == (16,)
+        run.step(1.0)
+        assert run.Q_ts.shape == (17,)
+
+
+class TestResults:
+    def test_columns_are_views(self):
+        run = Production().run(0, 10, 11)
+        results = run.results
+        assert list(results) == ['t', 'K', 'Q_raw', 'Q', 'consumption_per_capta']
+        assert np.shares_memory(results['K'], run._values)
+        assert np.shares_memory(results['t'], run._times)
+        assert results['Q'].flags.c_contiguous
+        assert_almost_equal(results['Q'], run.Q_ts)
+        assert run.K_ts.base is not None
+
+    def test_aux_is_evaluated_on_demand(self):
+        run = Production().run(0, 10, 11)
+        run.results['K']
+        assert run._aux_cache is None
+
+    def test_to_dataframe(self):
+        pytest.importorskip('pandas')
+        run = Production().run(0, 10, 11)
+        df = run.results.to_dataframe()
+        assert list(df.columns) == ['K', 'Q_raw', 'Q', 'consumption_per_capta']
+        assert_almost_equal(df.index.values, run.times)
+        assert_almost_equal(df['Q'].values, run.Q_ts)
+        assert np.shares_memory(df['K'].values, run._values)
+
+    def test_to_arrow(self):
+        pytest.importorskip('pyarrow')
+        run = Production().run(0, 10, 11)
+        table = run.results.to_arrow(aux=False)
+        assert table.column_names == ['t', 'K']
+        assert_almost_equal(table.column('K').to_numpy(), run.K_ts)
+
+
 class TestRegressions:
     def test_transitive_dependencies(self):
         class M(Model):
@@ -106,3 +434,254 @@ class TestRegressions:
 
         m = M()
         m.run(0, 50)
+
+
+class TestWithParams:
+    def get_class(self):
+        class M(Model):
+            x = 1.0
+            k = 2.0
+            r = k / 2
+            a = r * x
+            D_x = -a
+
+        return M
+
+    def test_share_compiled_code(self):
+        m = self.get_class()()
+        m.run(0, 1, 11)
+        m2 = m.with_params(k=4.0)
+        assert m2._meta.compiler is m._meta.compiler
+        assert m2.k.value == 4.0
+        assert m2.r.value == 2.0
+        assert m.k.value == 2.0
+
+    def test_agrees_with_new_instance(self):
+        cls = self.get_class()
+        run = cls().with_params(k=4.0, x=2.0).run(0, 1, 11)
+        expect = cls(k=4.0, x=2.0).run(0, 1, 11)
+        assert_almost_equal(run.x_ts, expect.x_ts)
+        assert_almost_equal(run.x_ts[-1], 2 * np.exp(-2), 5)
+
+    def test_substitute_aux_and_equations(self):
+        cls = self.get_class()
+        m = cls().with_params(k=4.0)
+        expect = cls(k=4.0)
+        assert m.aux == expect.aux
+        assert m.a == expect.a
+        assert m.equations == expect.equations
+        assert set(m.values) == {'x', 'k', 'r', 'a'}
+
+    def test_structural_changes_create_new_model(self):
+        m = self.get_class()().with_params(r=3.0)
+        assert m.r.value == 3.0
+        assert m.param_values() == {'k': 2.0, 'r': 3.0}
+        assert_almost_equal(m.run(0, 1, 11).x_ts[-1], np.exp(-3), 5)
+
+    def test_invalid_parameter(self):
+        with pytest.raises(TypeError):
+            self.get_class()().with_params(invalid=1.0)
+
+    def test_model_created_from_declarations_with_overrides(self):
+        m = Production._from_declarations({'gamma': 0.5}).with_params(gamma=0.3)
+        assert_almost_equal(m.run(0, 10, 11).K_ts, Production().run(0, 10, 11).K_ts)
+        m = self.get_class()._from_declarations({'k': 6.0}).with_params(k=4.0)
+        assert m.r.value == 2.0
+        assert_almost_equal(m.run(0, 1, 11).x_ts[-1], np.exp(-2), 5)
+
+
+class TestInstantiation:
+    def get_class(self):
+        return TestWithParams.get_class(self)
+
+    def test_share_template(self):
+        cls = self.get_class()
+        m = cls(k=4.0, x=2.0)
+        assert m._template is cls()._template
+        assert m._meta.compiler is cls()._meta.compiler
+        assert m.param_values() == {'k': 4.0, 'r': 2.0}
+        assert m.var_values() == {'x': 2.0}
+
+    def test_agrees_with_declarations(self):
+        cls = self.get_class()
+        m = cls(k=4.0, x=2.0)
+        expect = cls._from_declarations({'k': 4.0, 'x': 2.0})
+        assert m._template is not expect._template
+        assert m.aux == expect.aux
+        assert m.equations == expect.equations
+        assert m.aux_values() == expect.aux_values()
+        assert_almost_equal(m.run(0, 1, 11).x_ts, expect.run(0, 1, 11).x_ts)
+
+    def test_structural_overrides(self):
+        cls = self.get_class()
+        m = cls(r=3.0)
+        assert m._template is not cls()._template
+        assert m._template is cls(r=1.0, k=5.0)._template
+        assert m.param_values() == {'k': 2.0, 'r': 3.0}
+        assert_almost_equal(m.run(0, 1, 11).x_ts[-1], np.exp(-3), 5)
+
+        # Prototypes do not freeze the values of structural overrides
+        m = cls(r=1.0)
+        assert m._template is cls(r=3.0)._template
+        assert m.param_values() == {'k': 2.0, 'r': 1.0}
+        assert_almost_equal(m.run(0, 1, 11).x_ts[-1], np.exp(-1), 5)
+
+    def test_sweep_structural_overrides(self):
+        sweep = Production().sweep(0, 10, 5, params={'L': [5, 6, 7]}, workers=0)
+        for i, L in enumerate([5, 6, 7]):
+            expect = Production._from_declarations({'L': L}).run(0, 10, 5)
+            assert_almost_equal(sweep.K_ts[i], expect.K_ts)
+
+    def test_symbolic_overrides(self):
+        cls = self.get_class()
+        m = cls(r=cls.values['k'].symbol)
+        assert m._template is not cls()._template
+        assert m.param_values() == {'k': 2.0, 'r': 2.0}
+
+    def test_dtype_changes_template(self):
+        cls = self.get_class()
+        default = cls()
+        cls.dtype = np.float32
+        m = cls()
+        assert m._template is not default._template
+        assert m._meta.y0.dtype == np.float32
+
+
+class TestComposite:
+    def get_classes(self):
+        class A(Model):
+            x = 1.0
+            y = 0.0, '[1] external'
+            D_x = y
+
+        class B(Model):
+            y = 0.0
+            x = 1.0, '[1] external'
+            w = 2.0
+            D_y = -w ** 2 * x
+
+        return A, B
+
+    def test_bind_shared_names(self):
+        A, B = self.get_classes()
+        AB = compose(A, B, name='AB')
+        assert AB.__name__ == 'AB'
+        assert AB.submodels == (A, B)
+        assert AB.bindings == {'x': A, 'y': B}
+        m = AB()
+        assert list(m.vars) == ['x', 'y']
+        assert m.param_values() == {'w': 2.0}
+
+    def test_single_system(self):
+        A, B = self.get_classes()
+        times = np.linspace(0, 1, 11)
+        run = compose(A, B)(w=1.5).run(times)
+        assert_almost_equal(run.x_ts, np.cos(1.5 * times), 4)
+        assert_almost_equal(run.y_ts, -1.5 * np.sin(1.5 * times), 4)
+
+    def test_conflicting_declarations(self):
+        A, B = self.get_classes()
+
+        class C(Model):
+            x = 2.0
+            D_x = -x
+
+        class D(Model):
+            w = 3.0
+
+        with pytest.raises(ValueError):
+            compose(A, C)
+        with pytest.raises(ValueError):
+            compose(A, B, D)
+        assert compose(A, B, D, w=3.0)().param_values() == {'w': 3.0}
+
+    def test_dice_agrees_with_submodels(self):
+        dice = DICE()
+        meta = dice._meta
+        y0 = meta.y0
+        state = {**dice.var_values(), **meta.unvectorize_vars(y0)}
+        aux = meta.aux_fn(0.0, y0)
+        state.update((k, meta.read_aux(k, aux)) for k in dice.aux)
+        diff = meta.unvectorize_vars(meta.diff_fn(0.0, y0))
+
+        for cls in DICE.submodels:
+            inputs = {k: float(state[k]) for k in cls.values
+                      if k in state and k not in cls.equations}
+            sub = cls(**inputs)
+            expect = sub._meta.unvectorize_vars(sub._meta.diff_fn(0.0, sub._meta.y0))
+            for k, v in expect.items():
+                assert_almost_equal(diff[k], v)
+
+    def test_dice_ensemble_and_sweep(self):
+        dice = DICE()
+        savings = [0.2, 0.3]
+        ens = dice.run_ensemble(0, 10, 11, savings=savings)
+        sweep = dice.sweep(0, 10, 11, params={'savings': savings}, workers=0)
+        assert ens.values.shape == sweep.values.shape == (2, 11, len(dice.vars))
+        for i, s in enumerate(savings):
+            run = DICE(savings=s).run(0, 10, 11)
+            assert_almost_equal(ens.K_ts[i], run.K_ts)
+            assert_almost_equal(sweep.K_ts[i], run.K_ts)
+
+
+class TestEnsemble:
+    def get_class(self):
+        class M(Model):
+            x = 1.0
+            y = 0.0
+            k = 1.0
+            w = k * 2
+            D_x = y
+            D_y = -w * x
+
+        return M
+
+    @pytest.mark.parametrize('solver', ['euler', 'heun', 'rk4'])
+    def test_members_agree_with_single_runs(self, solver):
+        m = self.get_class()()
+        ks = [0.5, 1.0, 2.0]
+        xs = [1.0, 2.0, 3.0]
+        ens = m.run_ensemble(0, 1, 11, solver=solver, k=ks, x=xs)
+        assert ens.values.shape == (3, 11, 2)
+        assert_almost_equal(ens.params['w'], [1, 2, 4])
+        for i, (k, x) in enumerate(zip(ks, xs)):
+            run = m.with_params(k=k, x=x).run(0, 1, 11, solver=solver)
+            assert_almost_equal(ens.x_ts[i], run.x_ts)
+            assert_almost_equal(ens.y[i], run.y)
+
+    def test_shared_overrides(self):
+        m = self.get_class()()
+        ens = m.run_ensemble(0, 1, 5, members=4, k=2.0)
+        assert ens.members == 4
+        assert_almost_equal(ens.x_ts, np.tile(m.run_ensemble(0, 1, 5, k=2.0).x_ts, (4, 1)))
+
+    def test_invalid_overrides(self):
+        m = self.get_class()()
+        with pytest.raises(ValueError):
+            m.run_ensemble(1, k=[1, 2], x=[1, 2, 3])
+        with pytest.raises(TypeError):
+            m.run_ensemble(1, w=[1, 2])
+
+    @pytest.mark.parametrize('solver', ['dopri5', 'bdf', 'lsoda'])
+    def test_adaptive_solvers_are_rejected(self, solver):
+        with pytest.raises(ValueError, match='does not support ensembles'):
+            self.get_class()().run_ensemble(1, k=[1, 2], solver=solver)
+        with pytest.raises(ValueError, match='does not support ensembles'):
+            Costs().run_ensemble(1, g_bsp=[0.005, 0.01], solver=solver)
+
+    def test_keep_model_dtype(self):
+        cls = self.get_class()
+        cls.dtype = np.float32
+        ens = cls().run_ensemble(0, 1, 11, k=[1, 2])
+        assert ens.values.dtype == np.float32
+        assert_almost_equal(ens.x_ts[1], cls(k=2).run(0, 1, 11).x_ts, 5)
+
+    def test_derived_parameters_depend_on_aux(self):
+        m = Costs()
+        assert not m._template.is_parametric
+        ens = m.run_ensemble(0, 10, 11, g_bsp=[0.005, 0.01], abatement=0.1)
+        assert ens.values.shape == (2, 11, 1)
+        assert_almost_equal(ens.params['g_bsp'], [0.005, 0.01])
+        for i, g_bsp in enumerate([0.005, 0.01]):
+            run = Costs(g_bsp=g_bsp, abatement=0.1).run(0, 10, 11)
+            assert_almost_equal(ens.backstop_price_ts[i], run.backstop_price_ts)
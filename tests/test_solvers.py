@@ -2,7 +2,9 @@ import numpy as np
 import pytest
 from numpy.testing import assert_almost_equal
 
-from toy.solvers import Euler, RK2, RK4
+from toy.solvers import Euler, RK2, RK4, EnsembleSolver, DormandPrince, SOLVERS, \
+    BDF, Rosenbrock, numeric_jacobian, AdamsBashforth, AdamsBashforthMoulton, \
+    ScipySolver, Leapfrog, VelocityVerlet, Yoshida4
 
 
 class TestSteppedSolvers:
@@ -38,3 +40,301 @@ class TestSteppedSolvers:
         e_rk2 = err(rk2)
         e_rk4 = err(rk4)
         assert e_euler > e_rk2 > e_rk4 < 1e-3
+
+
+class TestInplaceSolvers:
+    @pytest.mark.parametrize('cls', [Euler, RK2, RK4])
+    def test_inplace_step_agrees_with_step_function(self, cls):
+        fn = lambda t, y: np.array([y[1], -y[0]])
+        solver = cls(fn, [1.0, 0.0])
+        expect = solver.step_function(0.0, solver.y, 0.1)
+        y = solver.y
+        solver.step(0.1)
+        assert solver.y is y
+        assert_almost_equal(solver.y, expect)
+
+    def test_solver_uses_out_argument(self):
+        buffers = set()
+
+        def fn(t, y, out=None):
+            buffers.add(id(out))
+            out[:] = y
+            return out
+
+        solver = RK4(fn, [1.0])
+        solver.steps([0.1] * 10)
+        assert len(buffers) == 4
+        assert_almost_equal(solver.y, [np.exp(1.0)], 5)
+
+
+class TestFastPath:
+    @pytest.mark.parametrize('cls', [Euler, RK2, RK4, DormandPrince])
+    def test_solve_into_agrees_with_callbacks(self, cls):
+        fn = lambda t, y: np.array([y[1], -y[0]])
+        dt = np.full(20, 0.1)
+        steps = []
+        slow = cls(fn, [1.0, 0.0], callback=lambda t, y: steps.append(y.copy()))
+        slow.steps(dt)
+        fast = cls(fn, [1.0, 0.0])
+        data = np.zeros((21, 2))
+        assert fast.solve_into(dt, data) is data
+        assert_almost_equal(data[1:], steps)
+        assert (fast.t, fast.ncalls, fast.niter) == (slow.t, slow.ncalls, slow.niter)
+
+    def test_fast_path_skips_logging_wrappers(self):
+        calls = []
+
+        def fn(t, y):
+            calls.append(t)
+            return y
+
+        solver = RK4(fn, [1.0])
+        solver._raw_fns = (fn, lambda t, y, out: np.copyto(out, fn(t, y)) or out)
+        solver.fn = solver.fn_into = None
+        solver.solve_into([0.1] * 10, np.zeros((11, 1)))
+        assert solver.ncalls == len(calls) == 40
+        assert_almost_equal(solver.y, [np.exp(1.0)], 5)
+
+
+class TestMultistepSolvers:
+    fn = staticmethod(lambda t, y: np.array([y[1], -y[0]]))
+
+    def error(self, cls, n, order):
+        ys = cls(self.fn, [1.0, 0.0], order=order).solve(np.linspace(0, 2, n + 1))
+        return abs(ys[-1, 0] - np.cos(2))
+
+    @pytest.mark.parametrize('cls', [AdamsBashforth, AdamsBashforthMoulton])
+    @pytest.mark.parametrize('order', [2, 3, 4])
+    def test_order_of_convergence(self, cls, order):
+        rate = np.log2(self.error(cls, 200, order) / self.error(cls, 400, order))
+        assert abs(rate - order) < 0.2
+
+    def test_corrector_improves_predictor(self):
+        assert self.error(AdamsBashforthMoulton, 50, 4) < self.error(AdamsBashforth, 50, 4)
+
+    @pytest.mark.parametrize('cls, calls', [(AdamsBashforth, 22), (AdamsBashforthMoulton, 33)])
+    def test_bootstrap_with_rk4(self, cls, calls):
+        solver = cls(self.fn, [1.0, 0.0], order=4)
+        solver.steps([0.1] * 3)
+        assert solver.ncalls == 3 * 4 and solver.nhist == 3
+        assert_almost_equal(solver.y, RK4(self.fn, [1.0, 0.0]).steps([0.1] * 3).y)
+        solver.steps([0.1] * 10)
+        assert solver.ncalls == calls
+
+    def test_restart_if_step_or_state_changes(self):
+        solver = AdamsBashforth(self.fn, [1.0, 0.0], order=3)
+        solver.steps([0.1] * 5)
+        assert solver.nhist == 3
+        solver.step(0.05)
+        assert solver.nhist == 1
+        solver.steps([0.05] * 2)
+        solver.y[:] = [1.0, 0.0]
+        solver.step(0.05)
+        assert solver.nhist == 1
+
+    def test_step_function_does_not_change_history(self):
+        solver = AdamsBashforthMoulton(self.fn, [1.0, 0.0])
+        solver.steps([0.1] * 5)
+        y = solver.step_function(solver.t, solver.y, 0.1)
+        assert_almost_equal(solver.step(0.1).y, y)
+
+    def test_invalid_order(self):
+        with pytest.raises(ValueError):
+            AdamsBashforth(self.fn, [1.0, 0.0], order=6)
+
+
+class TestSymplecticSolvers:
+    fn = staticmethod(lambda t, y: np.array([y[1], -y[0]]))
+
+    def error(self, cls, n):
+        ys = cls(self.fn, [1.0, 0.0]).solve(np.linspace(0, 2, n + 1))
+        return abs(ys[-1, 0] - np.cos(2))
+
+    @pytest.mark.parametrize('cls, order', [(Leapfrog, 2), (VelocityVerlet, 2), (Yoshida4, 4)])
+    def test_order_of_convergence(self, cls, order):
+        rate = np.log2(self.error(cls, 50) / self.error(cls, 100))
+        assert abs(rate - order) < 0.1
+
+    @pytest.mark.parametrize('cls', [Leapfrog, VelocityVerlet, Yoshida4])
+    def test_energy_does_not_drift(self, cls):
+        times = np.linspace(0, 1000, 2001)
+        energy = lambda ys: 0.5 * (ys ** 2).sum(1)
+        ys = cls(self.fn, [1.0, 0.0]).solve(times)
+        rk4 = RK4(self.fn, [1.0, 0.0]).solve(times)
+        assert abs(energy(ys) - 0.5).max() < 0.05
+        assert abs(energy(rk4) - 0.5).max() > 0.1
+
+    def test_velocity_verlet_reuses_acceleration(self):
+        solver = VelocityVerlet(self.fn, [1.0, 0.0])
+        solver.steps([0.1] * 10)
+        assert solver.ncalls == 11
+        solver.y[0] = 0.5
+        solver.step(0.1)
+        assert solver.ncalls == 13
+
+    def test_explicit_split(self):
+        fn = lambda t, y: np.array([-y[1], y[0]])
+        solver = Leapfrog(fn, [0.0, 1.0], split=([1], [0]))
+        expect = Leapfrog(self.fn, [1.0, 0.0]).steps([0.1] * 10).y
+        assert_almost_equal(solver.steps([0.1] * 10).y, expect[::-1])
+
+
+class TestScipySolver:
+    fn = staticmethod(lambda t, y: np.array([y[1], -y[0]]))
+
+    @pytest.fixture(autouse=True)
+    def scipy(self):
+        return pytest.importorskip('scipy')
+
+    @pytest.mark.parametrize('method', ['LSODA', 'Radau', 'DOP853'])
+    def test_integrate_with_single_call(self, method, monkeypatch):
+        from scipy import integrate
+
+        calls = []
+        solve_ivp = integrate.solve_ivp
+        monkeypatch.setattr(integrate, 'solve_ivp', lambda *args, **kwargs:
+                            calls.append(args) or solve_ivp(*args, **kwargs))
+        times = np.linspace(0, 2, 11)
+        solver = ScipySolver(self.fn, [1.0, 0.0], method=method, rtol=1e-8, atol=1e-10)
+        ys = solver.solve(times)
+        assert len(calls) == 1
+        assert_almost_equal(ys[:, 0], np.cos(times), 6)
+        assert solver.t == times[-1]
+        assert solver.niter == 10
+        assert solver.ncalls > 10
+
+    @pytest.mark.parametrize('method', ['LSODA', 'BDF', 'RK45'])
+    def test_count_integrator_steps(self, method):
+        from scipy.integrate import solve_ivp
+
+        times = np.linspace(0, 10, 3)
+        solver = ScipySolver(self.fn, [1.0, 0.0], method=method)
+        solver.solve(times)
+        dense = solve_ivp(self.fn, (0, 10), [1.0, 0.0], method=method,
+                          rtol=1e-6, atol=1e-9)
+        assert solver.niter == 2
+        assert solver.nsteps == len(dense.t) - 1 > 2
+
+    def test_report_jacobian_evaluations(self):
+        jac = lambda t, y: np.array([[0.0, 1.0], [-1.0, 0.0]])
+        solver = ScipySolver(self.fn, [1.0, 0.0], method='Radau', jac=jac)
+        solver.steps([0.5] * 4)
+        assert solver.njev > 0 and solver.nlu > 0
+        assert_almost_equal(solver.y, [np.cos(2), -np.sin(2)], 5)
+
+    def test_call_callback_for_each_step(self):
+        steps = []
+        solver = ScipySolver(self.fn, [1.0, 0.0], callback=lambda t, y: steps.append(t))
+        for t, y in solver.iter_times([0, 0.5, 1.0]):
+            pass
+        solver.steps([0.5] * 2)
+        assert_almost_equal(steps, [0.5, 1.0, 1.5, 2.0])
+        assert solver.niter == 4
+
+    def test_registered_solvers(self):
+        for name in ['lsoda', 'radau', 'dop853']:
+            assert SOLVERS[name].func is ScipySolver
+
+
+class TestEnsembleSolver:
+    @pytest.mark.parametrize('cls', [Euler, RK2, RK4, AdamsBashforthMoulton, Yoshida4])
+    def test_integrate_all_members_at_once(self, cls):
+        fn = lambda t, y: np.stack([y[:, 1], -y[:, 0]], axis=1)
+        y0 = np.array([[1.0, 0.0], [0.0, 1.0], [2.0, 0.5]])
+        times = np.linspace(0, 1, 6)
+        result = EnsembleSolver(cls, fn, y0).solve(times)
+        assert result.shape == (3, 6, 2)
+        for y, expect in zip(y0, result):
+            single = cls(lambda t, y: np.array([y[1], -y[0]]), y).solve(times)
+            assert_almost_equal(expect, single)
+
+    def test_require_2d_state(self):
+        with pytest.raises(ValueError):
+            EnsembleSolver(RK4, lambda t, y: y, [1.0])
+
+
+class TestAdaptiveSolvers:
+    def oscillator(self, **kwargs):
+        return DormandPrince(lambda t, y: np.array([y[1], -y[0]]), [1.0, 0.0],
+                             **kwargs)
+
+    def test_dense_output_at_requested_times(self):
+        times = np.linspace(0, 10, 37)
+        solver = self.oscillator(rtol=1e-8, atol=1e-10)
+        ys = solver.solve(times)
+        assert_almost_equal(ys[:, 0], np.cos(times), 6)
+        assert solver.t == times[-1]
+
+    def test_tolerance_controls_error(self):
+        times = np.linspace(0, 10, 5)
+        errors, calls = [], []
+        for rtol in [1e-3, 1e-6, 1e-9]:
+            solver = self.oscillator(rtol=rtol, atol=rtol * 1e-3)
+            errors.append(np.abs(solver.solve(times)[:, 0] - np.cos(times)).max())
+            calls.append(solver.ncalls)
+        assert errors[0] > errors[1] > errors[2]
+        assert calls[0] < calls[1] < calls[2]
+
+    def test_steps_do_not_follow_output_grid(self):
+        solver = DormandPrince(lambda t, y: -y, [1.0])
+        ys = solver.solve(np.linspace(0, 1, 1001))
+        assert_almost_equal(ys[-1], [np.exp(-1)], 6)
+        assert solver.nsteps < 100
+
+    def test_step_function_does_not_change_state(self):
+        solver = self.oscillator()
+        y = solver.step_function(0.0, solver.y, 1.0)
+        assert_almost_equal(y, [np.cos(1), -np.sin(1)], 5)
+        assert_almost_equal(solver.y, [1.0, 0.0])
+
+    def test_registered_solvers(self):
+        assert SOLVERS['dopri5'] is DormandPrince
+        assert SOLVERS['rk45'] is DormandPrince
+
+
+class TestStiffSolvers:
+    # Robertson's chemical kinetics problem
+    def fn(self, t, y):
+        return np.array([-0.04 * y[0] + 1e4 * y[1] * y[2],
+                         0.04 * y[0] - 1e4 * y[1] * y[2] - 3e7 * y[1] ** 2,
+                         3e7 * y[1] ** 2])
+
+    def jac(self, t, y):
+        return np.array([[-0.04, 1e4 * y[2], 1e4 * y[1]],
+                         [0.04, -1e4 * y[2] - 6e7 * y[1], -1e4 * y[1]],
+                         [0, 6e7 * y[1], 0]])
+
+    @pytest.mark.parametrize('cls', [BDF, Rosenbrock])
+    @pytest.mark.parametrize('analytic', [True, False])
+    def test_robertson_problem(self, cls, analytic):
+        jac = self.jac if analytic else None
+        solver = cls(self.fn, [1.0, 0.0, 0.0], jac=jac, rtol=1e-6, atol=1e-10)
+        y = solver.solve([0, 40, 1e4])
+        assert_almost_equal(y[1], [0.7158, 9.185e-6, 0.2842], 4)
+        assert_almost_equal(y[2], [0.1073, 4.800e-7, 0.8927], 4)
+        assert_almost_equal(y[-1].sum(), 1.0)
+        assert solver.nsteps < 1000
+
+    def test_bdf_reuses_lu_factorization(self):
+        solver = BDF(self.fn, [1.0, 0.0, 0.0], jac=self.jac)
+        solver.solve([0, 100])
+        assert solver.nlu < solver.nsteps / 2
+        assert solver.njev < solver.nlu
+
+    @pytest.mark.parametrize('cls', [BDF, Rosenbrock])
+    def test_non_stiff_accuracy(self, cls):
+        times = np.linspace(0, 10, 11)
+        solver = cls(lambda t, y: np.array([np.cos(t), -y[1]]), [0.0, 1.0],
+                     rtol=1e-8, atol=1e-10)
+        y = solver.solve(times)
+        assert_almost_equal(y[:, 0], np.sin(times), 5)
+        assert_almost_equal(y[:, 1], np.exp(-times), 5)
+
+    def test_numeric_jacobian(self):
+        y = np.array([0.9, 1e-5, 0.1])
+        assert_almost_equal(numeric_jacobian(self.fn, 0.0, y) / 1e4,
+                            self.jac(0.0, y) / 1e4, 4)
+
+    def test_registered_solvers(self):
+        assert SOLVERS['bdf'] is BDF
+        assert SOLVERS['rosenbrock'] is Rosenbrock
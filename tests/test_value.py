@@ -1,3 +1,4 @@
+import numpy as np
 from sympy import S, symbols
 from toy import Value
 from toy.core.value import fix_numeric
@@ -22,4 +23,9 @@ class TestValue:
             'z': Value('z', 2 * y),
         }
         ns = fix_numeric(ns)
-        assert {k: v.value for k, v in ns.items()} == {'x': 1, 'y': 2, 'z': 4}
\ No newline at end of file
+        assert {k: v.value for k, v in ns.items()} == {'x': 1, 'y': 2, 'z': 4}
+
+    def test_numpy_scalars_are_scalar_values(self):
+        value = Value('x', np.float64(1.5))
+        assert value.shape == (1,)
+        assert value.copy(value=np.float64(2.0)).value == 2.0
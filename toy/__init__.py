@@ -7,7 +7,7 @@ also useful to  compose models from many sub-systems, which is typical from
 many integrated assessment models.
 """
 from .app import App
-from .core import Model, Run, Value
+from .core import Model, Run, Ensemble, Sweep, Value, compose
 
 __author__ = 'Fábio Macêdo Mendes'
 __version__ = '0.1.0'
@@ -1 +1,2 @@
-from .base import Compiler
\ No newline at end of file
+from .base import Compiler, bind_params
+from .cache import CodeCache, enable_cache, disable_cache
@@ -1,28 +1,122 @@
+import ast
+from functools import partial
 from numbers import Number
 
 import numpy as np
-from sympy import Symbol, Expr, lambdify, S
-from typing import Mapping
+from sympy import Symbol, Expr, lambdify, S, cse, count_ops, numbered_symbols
+from typing import Mapping, NamedTuple, Tuple
 
+import sidekick as sk
+
+from . import codegen, jit
+from .cache import get_cache, structural_hash, entry_key
+from .graph import dependencies, topological_order, required
 from ..utils import is_numeric
 
+scipy_sparse = sk.import_later('scipy.sparse')
+BACKENDS = ('python', 'lambdify', 'numba')
+
+#: Jacobians are sparse if they have at least SPARSE_MIN_SIZE variables and
+#: the fraction of non-zero elements is at most SPARSE_MAX_DENSITY.
+SPARSE_MIN_SIZE = 32
+SPARSE_MAX_DENSITY = 0.1
+
+
+class CSEStats(NamedTuple):
+    """
+    Number of operations before and after common subexpression elimination.
+    """
+
+    before: int
+    after: int
+    subexpressions: int
+
+    @property
+    def removed(self):
+        return self.before - self.after
+
 
 class Compiler:
     """
     Compiler is responsible for creating functions to calculate the derivative
     and computed values.
+
+    Args:
+        dynamic:
+            Mapping from variable names to Value declarations.
+        computed:
+            Mapping from auxiliary term names to Value declarations.
+        equations:
+            Mapping from variable names to their derivatives.
+        params:
+            Mapping from parameter names to Value declarations. Generated
+            functions read parameters from a runtime vector passed in the
+            ``p`` argument, thus models that differ only by the values of
+            parameters can share compiled code.
+        dtype:
+            Type of elements in the state and auxiliary arrays.
+        backend:
+            Strategy used to build functions.
+
+            'python':
+                Generate a single Python function for the whole system, which
+                evaluates all terms in straight-line code.
+            'lambdify':
+                Lambdify each auxiliary term and equation separately and
+                call them in a loop.
+            'numba':
+                Like 'python', but compile the generated function with
+                numba. Fixed step solvers also run their integration loop in
+                native code. Fall back to 'python' with a warning if numba
+                is not installed or cannot compile some expression.
+        cse:
+            If True, eliminate common subexpressions across all auxiliary
+            terms and equations, so each shared subterm is evaluated only
+            once per call. Ignored by the 'lambdify' backend.
+        cache:
+            A :class:`toy.compiler.cache.CodeCache` used to store generated
+            code. If None, uses the global cache (if enabled). Pass False to
+            disable caching.
     """
 
-    def __init__(self, dynamic, computed, equations, dtype=np.float64):
+    vars_size = property(lambda self: self._var_size)
+    aux_size = property(lambda self: self._aux_size)
+    params_size = property(lambda self: len(self._idx_params))
+
+    def __init__(self, dynamic, computed, equations, dtype=np.float64,
+                 backend='python', cse=False, cache=None, params=None):
+        if backend not in BACKENDS:
+            raise ValueError(f'invalid backend: {backend!r}')
         self.dtype = dtype
+        self.backend = backend
+        self.cse = cse
+        self.cache = cache
         self.vars = dynamic
         self.aux = computed
         self.equations = equations
+        self.params = params or {}
 
         self._idx_vars = {k: i for i, k in enumerate(self.vars)}
         self._idx_aux = {k: i for i, k in enumerate(self.aux)}
+        self._idx_params = {k: i for i, k in enumerate(self.params)}
         self._var_size = sum(v.size for v in self.vars.values())
         self._aux_size = sum(v.size for v in self.aux.values())
+        self._cse = None
+        self._jacobian = None
+        self._sparsity = None
+        self._structure = None
+        self._functions = {}
+
+        # Auxiliary terms are evaluated in dependency order and the derivative
+        # function only evaluates the ones required by some equation
+        aux_values = {k: v.value for k, v in self.aux.items()}
+        self.aux_deps = dependencies(aux_values, self.aux)
+        try:
+            self.aux_order = topological_order(self.aux_deps)
+        except ValueError as exc:
+            raise ValueError(f'auxiliary terms: {exc}') from None
+        eq_deps = dependencies(self.equations, self.aux)
+        self.diff_aux = required({**self.aux_deps, **eq_deps}, eq_deps)
 
     def vectorize_vars(self, m: Mapping[str, Number]) -> np.ndarray:
         """
@@ -36,6 +130,12 @@ class Compiler:
         """
         return self._vectorize(m, self._idx_aux, self._aux_size)
 
+    def vectorize_params(self, m: Mapping[str, Number]) -> np.ndarray:
+        """
+        Vectorize dictionary mapping from parameter names to values.
+        """
+        return self._vectorize(m, self._idx_params, len(self._idx_params))
+
     def _vectorize(self, data, idx, n):
         res = np.empty(n, dtype=self.dtype)
         for k, v in data.items():
@@ -52,6 +152,9 @@ class Compiler:
             s = self._var_size
             return {k: v + s for k, v in self._idx_aux.items()}
 
+    def param_map(self):
+        return self._idx_params.copy()
+
     def var_index(self, attr):
         return self._idx_vars[attr]
 
@@ -66,16 +169,16 @@ class Compiler:
         Return the derivative updater function calculates the computed terms
         from a state array.
 
-        The updater function has the signature ``fn(diff, y, x, t) -> None``
+        The updater function has the signature ``fn(diff, y, x, t, p) -> None``
         in which ``diff`` is the output array of the same size of state ``x``,
-        ``y`` is the
+        ``y`` is the array of computed terms and ``p`` is the parameter vector.
         """
         idx = self._idx_vars
         functions = tuple((idx[k], self._get_diff_fn(k)) for k in self.vars)
 
-        def update_diff(diff, y, x, t):
+        def update_diff(diff, y, x, t, p=None):
             for i, fn in functions:
-                yi = fn(t, y, x)
+                yi = fn(t, y, x, p)
                 diff[i] = yi
 
         return update_diff
@@ -85,12 +188,12 @@ class Compiler:
         Return a function that computes the computed terms from a state array.
         """
         idx = self._idx_aux
-        functions = tuple((idx[k], self._get_aux_fn(k)) for k in self.aux)
+        functions = tuple((idx[k], self._get_aux_fn(k)) for k in self.aux_order)
 
-        def update_computed(y, x, t):
+        def update_computed(y, x, t, p=None):
             try:
                 for i, fn in functions:
-                    yi = fn(t, y, x)
+                    yi = fn(t, y, x, p)
                     y[i] = yi
             except Exception as exc:
                 name = type(exc).__name__
@@ -99,45 +202,339 @@ class Compiler:
 
         return update_computed
 
-    def compile_diff_fn(self, require_computed=False):
+    def compile_diff_fn(self, require_computed=False, batch=False):
         """
         Create function that computes the derivative from state and time.
 
+        The resulting function has the signature ``fn(t, x, out=None, p=None)``.
+        If ``out`` is given, it writes the derivative in this array instead of
+        allocating a new one. ``p`` is the vector of parameters and may be
+        omitted only if the compiler has no parameters.
+
         If ``required_computed=True`` it will additionally take a vector with
         the value of computed values as an additional parameter.
+
+        If ``batch=True``, the function evaluates an ensemble of states at
+        once: ``x`` is a ``(N, vars_size)`` matrix and ``p`` is either a
+        ``(N, params_size)`` matrix or a parameter vector shared by all
+        members. It returns a ``(N, vars_size)`` matrix. Batched functions
+        always use vectorized NumPy code, regardless of the backend.
+
+        See Also:
+            :func:`bind_params`
         """
+        kind = 'diff+computed' if require_computed else 'diff'
+        if batch:
+            src = self._cached_source(kind + '/batch', self.diff_source,
+                                      require_computed, False, True)
+            return codegen.exec_source(src, 'diff', self.dtype)
+        if self.backend == 'numba':
+            arrays = 4 if require_computed else 3
+            fn = self._compile_jit(kind, 'diff', self._var_size, arrays,
+                                   lambda: self.diff_source(require_computed, kernel=True))
+            if fn is not None:
+                return fn
+        if self.backend != 'lambdify':
+            src = self._cached_source(kind, self.diff_source, require_computed)
+            return codegen.exec_source(src, 'diff', self.dtype)
+
         update = self.compile_update_diff_fn()
         empty_vars = np.zeros(self._var_size, dtype=self.dtype).copy
 
         if require_computed:
-            def diff(t, y, x):
-                out = empty_vars()
-                update(out, y, x, t)
+            def diff(t, y, x, out=None, p=None):
+                if out is None:
+                    out = empty_vars()
+                update(out, y, x, t, p)
                 return out
         else:
             update_computed = self.compile_update_aux_fn()
-            empty_computed = np.zeros(self._aux_size, dtype=self.dtype).copy
+            computed = np.zeros(self._aux_size, dtype=self.dtype)
 
-            def diff(t, x):
-                y = empty_computed()
-                update_computed(y, x, t)
-                out = empty_vars()
-                update(out, y, x, t)
+            def diff(t, x, out=None, p=None):
+                update_computed(computed, x, t, p)
+                if out is None:
+                    out = empty_vars()
+                update(out, computed, x, t, p)
                 return out
 
         return diff
 
-    def compile_aux_fn(self):
+    def compile_aux_fn(self, batch=False):
+        """
+        Create function that computes the auxiliary terms from time and state.
+
+        The resulting function has the signature ``fn(t, x, out=None, p=None)``.
+        Batched functions work as in :meth:`compile_diff_fn`.
+        """
+        if batch:
+            src = self._cached_source('aux/batch', self.aux_source, False, True)
+            return codegen.exec_source(src, 'aux', self.dtype)
+        if self.backend == 'numba':
+            fn = self._compile_jit('aux', 'aux', self._aux_size, 3,
+                                   lambda: self.aux_source(kernel=True))
+            if fn is not None:
+                return fn
+        if self.backend != 'lambdify':
+            src = self._cached_source('aux', self.aux_source)
+            return codegen.exec_source(src, 'aux', self.dtype)
+
         update = self.compile_update_aux_fn()
         empty_computed = np.zeros(self._aux_size, dtype=self.dtype).copy
 
-        def computed(t, x):
-            y = empty_computed()
-            update(y, x, t)
-            return y
+        def computed(t, x, out=None, p=None):
+            if out is None:
+                out = empty_computed()
+            update(out, x, t, p)
+            return out
 
         return computed
 
+    def compile_jacobian_fn(self, sparse=None):
+        """
+        Create function that computes the Jacobian of the derivative function
+        with respect to the dynamic variables.
+
+        Jacobians are computed by symbolic differentiation, with auxiliary
+        terms chained in. The resulting function has the signature
+        ``fn(t, x, out=None, p=None)`` and returns either a dense array or a
+        ``scipy.sparse.csr_matrix``. The boolean sparsity pattern is
+        stored in the ``sparsity`` attribute of the function.
+
+        Args:
+            sparse:
+                If True, return a sparse matrix. If None, decide based on the
+                sparsity pattern. Sparse matrices require scipy.
+        """
+        pattern = self.jacobian_sparsity()
+        if sparse is None:
+            sparse = prefer_sparse(pattern)
+
+        if sparse:
+            src = self._cached_source('jac/sparse', self.jacobian_source, True)
+            data = codegen.exec_source(src, 'jac', self.dtype)
+            rows, cols = np.nonzero(pattern)
+            indptr = np.searchsorted(rows, np.arange(len(pattern) + 1))
+            shape = pattern.shape
+            csr_matrix = scipy_sparse.csr_matrix
+
+            def jac(t, x, out=None, p=None):
+                return csr_matrix((data(t, x, None, p), cols, indptr), shape=shape)
+        else:
+            src = self._cached_source('jac', self.jacobian_source, False)
+            jac = codegen.exec_source(src, 'jac', self.dtype)
+
+        jac.sparsity = pattern
+        return jac
+
+    def function(self, kind, **options):
+        """
+        Return the compiled function of the given kind ('diff', 'aux' or
+        'jacobian'). Options are passed to the corresponding compile method.
+
+        Functions are compiled only once and shared by all callers.
+        """
+        key = (kind, *sorted(options.items()))
+        try:
+            return self._functions[key]
+        except KeyError:
+            fn = getattr(self, f'compile_{kind}_fn')(**options)
+            self._functions[key] = fn
+            return fn
+
+    def jacobian_sparsity(self) -> np.ndarray:
+        """
+        Boolean matrix with the non-zero elements of the Jacobian.
+
+        The list of non-zero elements is stored in the code cache next to the
+        Jacobian source, thus warm processes do not differentiate equations.
+        """
+        if self._sparsity is None:
+            src = self._cached_source('jac/sparsity', self._sparsity_source)
+            n = self._var_size
+            pattern = np.zeros((n, n), dtype=bool)
+            for i, j in ast.literal_eval(src):
+                pattern[i, j] = True
+            self._sparsity = pattern
+        return self._sparsity.copy()
+
+    def _sparsity_source(self):
+        _, entries = self.jacobian_exprs()
+        return repr(sorted((int(i), int(j)) for i, j in entries))
+
+    def position_velocity_split(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return a tuple of (positions, velocities) with the indices of
+        variables of a mechanical system, in which each position x has an
+        equation of the form ``D_x = v`` and v is a velocity.
+
+        Raises ValueError if some variable is neither a position nor a
+        velocity or if the derivative of a velocity depends on velocities.
+        """
+        pairs = {}
+        for name, expr in self.equations.items():
+            if isinstance(expr, Symbol) and expr.name in self._idx_vars:
+                pairs[name] = expr.name
+        positions = [k for k in self._idx_vars if k in pairs and k not in pairs.values()]
+        velocities = [pairs[k] for k in positions]
+        invalid = set(self._idx_vars) - set(positions) - set(velocities)
+        if invalid or len(set(velocities)) != len(velocities):
+            invalid = ', '.join(sorted(invalid)) or 'shared velocities'
+            raise ValueError(f'cannot split state in positions and velocities: {invalid}')
+
+        q = np.array([self._idx_vars[k] for k in positions], dtype=int)
+        v = np.array([self._idx_vars[k] for k in velocities], dtype=int)
+        if self.jacobian_sparsity()[np.ix_(v, v)].any():
+            raise ValueError('accelerations must not depend on velocities')
+        return q, v
+
+    def jacobian_exprs(self):
+        """
+        Return a tuple of (derivatives, entries) with the expressions used to
+        compute the Jacobian.
+
+        ``derivatives`` is a list of (name, expr) pairs with the non-zero
+        total derivatives of auxiliary terms with respect to dynamic
+        variables, in evaluation order. ``entries`` maps (i, j) to the
+        non-zero element of the Jacobian and may refer to those names.
+        """
+        if self._jacobian is not None:
+            return self._jacobian
+
+        vars = list(self._idx_vars)
+        total = {}
+        derivatives = []
+        for a in self.aux_order:
+            if a not in self.diff_aux:
+                continue
+            expr = self.aux[a].value
+            for v in vars:
+                d = self._total_derivative(expr, v, total)
+                if d != 0:
+                    name = f'_{self._idx_aux[a]}_{self._idx_vars[v]}'
+                    total[a, v] = Symbol(name)
+                    derivatives.append((name, d))
+
+        entries = {}
+        for v_i, i in self._idx_vars.items():
+            for v_j, j in self._idx_vars.items():
+                d = self._total_derivative(self.equations[v_i], v_j, total)
+                if d != 0:
+                    entries[i, j] = d
+
+        self._jacobian = derivatives, entries
+        return self._jacobian
+
+    def _total_derivative(self, expr, var, total):
+        if not isinstance(expr, Expr):
+            return S(0)
+
+        result = S(0)
+        for symb in expr.free_symbols:
+            name = symb.name
+            if name == var:
+                result += expr.diff(symb)
+            elif (name, var) in total:
+                result += expr.diff(symb) * total[name, var]
+        return result
+
+    def expressions(self):
+        """
+        Return a tuple of (temps, aux, equations) with the expressions
+        evaluated by generated code.
+
+        ``temps`` is a list of (name, expr) pairs with common subexpressions
+        and the ``aux`` and ``equations`` mappings may refer to them. If
+        common subexpression elimination is disabled, ``temps`` is empty.
+        """
+        aux = {k: v.value for k, v in self.aux.items()}
+        if not self.cse:
+            return [], aux, dict(self.equations)
+        if self._cse is None:
+            self._cse = self._eliminate_subexpressions(aux, self.equations)
+        return self._cse
+
+    def cse_stats(self) -> CSEStats:
+        """
+        Count the number of operations removed by common subexpression
+        elimination.
+        """
+        aux = {k: v.value for k, v in self.aux.items()}
+        temps, aux_, eqs_ = self._eliminate_subexpressions(aux, self.equations)
+        before = _count_ops([*aux.values(), *self.equations.values()])
+        after = _count_ops([*(e for _, e in temps), *aux_.values(), *eqs_.values()])
+        return CSEStats(before, after, len(temps))
+
+    def _eliminate_subexpressions(self, aux, equations):
+        names = [*aux, *equations]
+        exprs = [*aux.values(), *equations.values()]
+        symbolic = [i for i, e in enumerate(exprs) if isinstance(e, Expr)]
+
+        replacements, reduced = cse([exprs[i] for i in symbolic],
+                                    symbols=numbered_symbols('_'))
+        for i, expr in zip(symbolic, reduced):
+            exprs[i] = expr
+
+        temps = [(str(k), v) for k, v in replacements]
+        n = len(aux)
+        return (temps,
+                dict(zip(names[:n], exprs[:n])),
+                dict(zip(names[n:], exprs[n:])))
+
+    def diff_source(self, require_computed=False, kernel=False, batch=False):
+        """
+        Source code for the generated derivative function.
+
+        See Also:
+            :meth:`compile_diff_fn`
+        """
+        return codegen.diff_source(self, require_computed=require_computed,
+                                   kernel=kernel, batch=batch)
+
+    def aux_source(self, kernel=False, batch=False):
+        """
+        Source code for the generated auxiliary terms function.
+
+        See Also:
+            :meth:`compile_aux_fn`
+        """
+        return codegen.aux_source(self, kernel=kernel, batch=batch)
+
+    def jacobian_source(self, sparse=False):
+        """
+        Source code for the generated Jacobian function.
+
+        See Also:
+            :meth:`compile_jacobian_fn`
+        """
+        return codegen.jacobian_source(self, sparse=sparse)
+
+    def _compile_jit(self, kind, name, size, arrays, generate):
+        if not jit.is_available():
+            jit.fallback('numba is not installed')
+            return None
+        source = self._cached_source(kind + '/kernel', generate)
+        try:
+            kernel = jit.compile_kernel(source, name, self.dtype, arrays)
+        except Exception as exc:
+            jit.fallback('cannot compile expressions', exc)
+            return None
+        return jit.wrap_kernel(kernel, size, self.dtype, arrays)
+
+    def _cached_source(self, kind, generate, *args):
+        cache = get_cache() if self.cache is None else self.cache
+        if not cache:
+            return generate(*args)
+
+        if self._structure is None:
+            self._structure = structural_hash(self)
+        key = entry_key(self._structure, kind)
+        source = cache.get(key)
+        if source is None:
+            source = generate(*args)
+            cache.put(key, source)
+        return source
+
     def _get_diff_fn(self, name):
         fn = self._get_fn(name, self.equations[name])
         fn.__name__ = fn.__qualname__ = f'eq/{name}'
@@ -162,15 +559,18 @@ class Compiler:
 
     def _get_numeric_fn(self, name, value):
         number = float(value)
-        return lambda t, y, x: number
+        return lambda t, y, x, p: number
 
     def _get_symbol_fn(self, name, symb):
         if symb.name in self.vars:
             idx = self._idx_vars[symb.name]
-            return lambda t, y, x: x[idx]
+            return lambda t, y, x, p: x[idx]
         elif symb.name in self.aux:
             idx = self._idx_aux[symb.name]
-            return lambda t, y, x: y[idx]
+            return lambda t, y, x, p: y[idx]
+        elif symb.name in self.params:
+            idx = self._idx_params[symb.name]
+            return lambda t, y, x, p: p[idx]
         else:
             raise ValueError(f'invalid variable for {name}: {symb.name}')
 
@@ -180,19 +580,65 @@ class Compiler:
             S('t'),
             *(k for k in self.vars if k in deps),
             *(k for k in self.aux if k in deps),
+            *(k for k in self.params if k in deps),
         )
         lambd = lambdify(args, expr)
 
         args_var = np.array([self._idx_vars[k] for k in self.vars if k in deps],
                             dtype=int)
         args_aux = np.array([self._idx_aux[k] for k in self.aux if k in deps], dtype=int)
+        args_par = np.array([self._idx_params[k] for k in self.params if k in deps],
+                            dtype=int)
 
-        def fn(t, y, x):
-            a = y[args_aux]
-            b = x[args_var]
-            return lambd(t, *a, *b)
+        if not len(args_par):
+            def fn(t, y, x, p):
+                a = y[args_aux]
+                b = x[args_var]
+                return lambd(t, *b, *a)
+        else:
+            def fn(t, y, x, p):
+                a = y[args_aux]
+                b = x[args_var]
+                c = p[args_par]
+                return lambd(t, *b, *a, *c)
 
         return fn
 
     def _get_callable_fn(self, name, expr):
         raise NotImplementedError(name, expr)
+
+
+def bind_params(fn, p):
+    """
+    Bind parameter vector to a function created by the compiler.
+
+    Return a function with the signature ``fn(t, x, out=None)`` that preserves
+    the attributes of the original function.
+    """
+    if not len(p):
+        return fn
+    bind = getattr(fn, 'bind', None)
+    if bind is not None:
+        return bind(p)
+    bound = partial(fn, p=p)
+    bound.__dict__.update(getattr(fn, '__dict__', {}))
+    return bound
+
+
+def _count_ops(exprs):
+    return sum(count_ops(e) for e in exprs if isinstance(e, Expr))
+
+
+def prefer_sparse(pattern):
+    """
+    Return True if a Jacobian with the given sparsity pattern should be
+    stored as a sparse matrix.
+    """
+    n = len(pattern)
+    if n < SPARSE_MIN_SIZE or pattern.sum() > SPARSE_MAX_DENSITY * n * n:
+        return False
+    try:
+        import scipy.sparse
+    except ImportError:
+        return False
+    return True
@@ -0,0 +1,210 @@
+"""
+Persistent cache of generated source code.
+
+Generating code requires printing (and possibly simplifying) sympy
+expressions, which dominates the startup time of short-lived processes.
+The cache stores generated sources on disk, keyed by a structural hash of
+the model, so warm processes can skip this step.
+
+The cache is disabled by default. Enable it by calling :func:`enable_cache`
+or by setting the TOY_CACHE_DIR environment variable.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from sympy import Basic, srepr
+
+#: Increment this number when code generation changes
+FORMAT_VERSION = 4
+
+#: Default maximum size of the cache directory in bytes
+MAX_SIZE = 64 * 2 ** 20
+
+_default_cache = None
+
+
+class CodeCache:
+    """
+    A size-bounded directory of generated source files.
+
+    Least recently used entries are evicted when the total size of the cache
+    exceeds max_size.
+
+    Args:
+        path:
+            Cache directory. It is created if it does not exist.
+        max_size:
+            Maximum size of all cached files in bytes.
+    """
+
+    def __init__(self, path, max_size=MAX_SIZE):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def __repr__(self):
+        return f'CodeCache({str(self.path)!r}, hits={self.hits}, misses={self.misses})'
+
+    def _file(self, key):
+        return self.path / (key + '.py')
+
+    def get(self, key) -> Optional[str]:
+        """
+        Return cached source or None, if key is not in cache.
+        """
+        path = self._file(key)
+        try:
+            source = path.read_text()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return source
+
+    def put(self, key, source):
+        """
+        Save source in cache.
+
+        Files are written atomically, so concurrent processes never read an
+        incomplete entry.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(source)
+            os.replace(tmp, self._file(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def size(self) -> int:
+        """
+        Total size of cached files in bytes.
+        """
+        return sum(f.stat().st_size for f in self.path.glob('*.py'))
+
+    def evict(self, max_size=None):
+        """
+        Remove least recently used entries until cache is below max_size.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = []
+        for f in self.path.glob('*.py'):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+
+        size = sum(e[1] for e in entries)
+        for _, fsize, f in sorted(entries, key=lambda e: e[0]):
+            if size <= max_size:
+                break
+            try:
+                f.unlink()
+            except OSError:
+                continue
+            size -= fsize
+
+    def clear(self):
+        """
+        Remove all entries and reset counters.
+        """
+        self.evict(0)
+        self.hits = self.misses = 0
+
+
+def structural_hash(compiler, kind='') -> str:
+    """
+    Hash all information that determines the generated code for compiler:
+    equations, aux expressions, variable and parameter layout, dtype and
+    backend.
+
+    Compilers memoize the hash of their structure and derive the key of
+    each kind of generated code from it with :func:`entry_key`.
+    """
+    h = hashlib.sha256()
+
+    def update(*args):
+        h.update(repr(args).encode('utf8'))
+        h.update(b'\0')
+
+    update(FORMAT_VERSION, compiler.backend, bool(compiler.cse),
+           np.dtype(compiler.dtype).str)
+    for k, v in compiler.vars.items():
+        update('var', k, v.shape)
+    for k, v in compiler.params.items():
+        update('param', k, v.shape)
+    for k, v in compiler.aux.items():
+        update('aux', k, v.shape, _expr_repr(v.value))
+    for k, eq in compiler.equations.items():
+        update('eq', k, _expr_repr(eq))
+    return entry_key(h.hexdigest(), kind) if kind else h.hexdigest()
+
+
+def entry_key(structure, kind) -> str:
+    """
+    Key of the cache entry of the given kind for a compiler with the given
+    structural hash.
+    """
+    return hashlib.sha256(f'{structure}/{kind}'.encode('utf8')).hexdigest()
+
+
+def _expr_repr(expr):
+    # Walk the expression tree instead of calling srepr() on the whole
+    # expression, since srepr sorts the terms of each sum and product, which
+    # is much slower. The arguments of sympy expressions are stored in a
+    # canonical order, thus the result is still stable across processes.
+    if not isinstance(expr, Basic):
+        return repr(expr)
+    if not expr.args:
+        try:
+            return srepr(expr)
+        except Exception:
+            return repr(expr)
+    args = ', '.join(map(_expr_repr, expr.args))
+    return f'{type(expr).__name__}({args})'
+
+
+def enable_cache(path=None, max_size=MAX_SIZE) -> CodeCache:
+    """
+    Enable the global code cache and return it.
+
+    If no path is given, uses TOY_CACHE_DIR or ~/.cache/toy-model.
+    """
+    global _default_cache
+    if path is None:
+        path = os.environ.get('TOY_CACHE_DIR') or Path.home() / '.cache' / 'toy-model'
+    _default_cache = CodeCache(path, max_size)
+    return _default_cache
+
+
+def disable_cache():
+    """
+    Disable the global code cache.
+    """
+    global _default_cache
+    _default_cache = None
+
+
+def get_cache() -> Optional[CodeCache]:
+    """
+    Return the global code cache or None, if it is disabled.
+    """
+    return _default_cache
+
+
+if os.environ.get('TOY_CACHE_DIR'):
+    enable_cache()
@@ -0,0 +1,371 @@
+import linecache
+from itertools import count
+
+import numpy as np
+from sympy import Expr, Symbol
+from sympy.printing.pycode import NumPyPrinter
+
+from .graph import dependencies, required, topological_order
+from ..utils import is_numeric
+
+_counter = count()
+
+
+class Printer(NumPyPrinter):
+    """
+    Print sympy expressions as NumPy code, renaming symbols to the local
+    variable names used in the generated function.
+    """
+
+    def __init__(self, names, settings=None):
+        super().__init__(settings)
+        self.names = names
+
+    def _print_Symbol(self, symb):
+        try:
+            return self.names[symb.name]
+        except KeyError:
+            raise ValueError(f'invalid variable: {symb.name}')
+
+    # Elementwise, so it also works with columns of batched states
+    def _print_Min(self, expr):
+        return self._print_reduce('numpy.minimum', expr.args)
+
+    def _print_Max(self, expr):
+        return self._print_reduce('numpy.maximum', expr.args)
+
+    def _print_reduce(self, func, args):
+        func = self._module_format(func)
+        *rest, last = args
+        result = self._print(last)
+        for arg in reversed(rest):
+            result = f'{func}({self._print(arg)}, {result})'
+        return result
+
+
+def var_name(name):
+    """
+    Local variable name used for dynamic variables in generated code.
+    """
+    return 'v_' + name
+
+
+def aux_name(name):
+    """
+    Local variable name used for auxiliary terms in generated code.
+    """
+    return 'a_' + name
+
+
+def param_name(name):
+    """
+    Local variable name used for parameters in generated code.
+    """
+    return 'p_' + name
+
+
+def temp_name(name):
+    """
+    Local variable name used for common subexpressions in generated code.
+    """
+    return 'c' + name
+
+
+def deriv_name(name):
+    """
+    Local variable name used for total derivatives of auxiliary terms.
+    """
+    return 'd' + name
+
+
+def symbol_names(vars, aux, params=()):
+    """
+    Map model names to the local names used in generated code.
+    """
+    names = {'t': 't'}
+    names.update((k, var_name(k)) for k in vars)
+    names.update((k, aux_name(k)) for k in aux)
+    names.update((k, param_name(k)) for k in params)
+    return names
+
+
+def signature(name, *args, kernel=False):
+    """
+    Header of a generated function that receives the given array arguments
+    followed by the ``out`` array and the parameter vector ``p``.
+
+    Kernels take all arguments positionally.
+    """
+    tail = 'out, p' if kernel else 'out=None, p=None'
+    return f'def {name}(t, {", ".join(args)}, {tail}):'
+
+
+def print_expr(printer, name, expr):
+    """
+    Render value or equation as Python source.
+    """
+    if is_numeric(expr):
+        return repr(float(expr))
+    elif isinstance(expr, (Symbol, Expr)):
+        try:
+            return printer.doprint(expr)
+        except ValueError as exc:
+            raise ValueError(f'{exc} in {name}') from exc
+    elif callable(expr):
+        raise NotImplementedError(name, expr)
+    else:
+        raise TypeError(f'invalid value for {name}: {expr}')
+
+
+def diff_source(compiler, name='diff', require_computed=False, kernel=False,
+                batch=False):
+    """
+    Return the source code of a function that computes the derivative of
+    the whole system.
+
+    The generated function reads the state vector once, evaluates all
+    auxiliary terms and equations in straight-line code and writes the
+    result in the ``out`` array, allocating it only if it is not given. It
+    has the signature ``fn(t, x, out=None, p=None) -> diff`` or
+    ``fn(t, y, x, out=None, p=None) -> diff``, if ``require_computed=True``.
+    Parameters are read from the ``p`` vector.
+
+    If ``kernel=True``, the ``out`` and ``p`` arguments are mandatory and
+    the function never allocates memory, which is suitable for JIT compilers.
+
+    If ``batch=True``, the function evaluates many states at once. States
+    are rows of the ``x`` matrix and parameters are either a vector shared by
+    all states or a matrix with one row per state.
+    """
+    emitter = Emitter(compiler, batch=batch)
+    idx_vars = compiler.var_map()
+    idx_aux = compiler.aux_map(absolute=True)
+    exprs = list(compiler.equations.values())
+
+    if require_computed:
+        emitter.line(signature(name, 'y', 'x', kernel=kernel))
+        emitter.read('x', idx_vars, var_name)
+        emitter.read_params(exprs)
+        emitter.read('y', idx_aux, aux_name)
+    else:
+        emitter.line(signature(name, 'x', kernel=kernel))
+        emitter.read('x', idx_vars, var_name)
+        emitter.read_params([*exprs, *emitter.aux_values(compiler.diff_aux)])
+        emitter.aux(compiler.diff_aux)
+
+    if not kernel:
+        emitter.alloc(compiler.vars_size)
+    for k, i in idx_vars.items():
+        emitter.assign(emitter.item('out', i), k, emitter.equations[k])
+    emitter.line('    return out')
+    return emitter.source()
+
+
+def aux_source(compiler, name='aux', kernel=False, batch=False):
+    """
+    Return the source code of a function that computes all auxiliary terms
+    from time and state. It has the signature
+    ``fn(t, x, out=None, p=None) -> aux``.
+
+    See Also:
+        :func:`diff_source`
+    """
+    emitter = Emitter(compiler, batch=batch)
+    emitter.line(signature(name, 'x', kernel=kernel))
+    emitter.read('x', compiler.var_map(), var_name)
+    emitter.read_params(emitter.aux_values())
+    emitter.aux()
+    if not kernel:
+        emitter.alloc(compiler.aux_size)
+    for k, i in compiler.aux_map(absolute=True).items():
+        emitter.line(f'    {emitter.item("out", i)} = {aux_name(k)}')
+    emitter.line('    return out')
+    return emitter.source()
+
+
+def jacobian_source(compiler, name='jac', sparse=False):
+    """
+    Return the source code of a function that computes the Jacobian of the
+    derivative function with respect to the dynamic variables.
+
+    The generated function evaluates the total derivatives of auxiliary
+    terms with respect to each variable and then the non-zero elements of
+    the Jacobian. It has the signature ``fn(t, x, out=None, p=None) -> jac``.
+
+    If ``sparse=False``, it returns the dense Jacobian matrix. Otherwise, it
+    returns an array with non-zero elements in row-major order.
+    """
+    derivatives, entries = compiler.jacobian_exprs()
+    extra = {k: deriv_name(k) for k, _ in derivatives}
+    emitter = Emitter(compiler, extra)
+    n = compiler.vars_size
+    exprs = [*(e for _, e in derivatives), *entries.values()]
+
+    emitter.line(signature(name, 'x'))
+    emitter.read('x', compiler.var_map(), var_name)
+    used = _free_names(exprs) & set(compiler.aux)
+    used |= required(compiler.aux_deps, used)
+    emitter.read_params([*exprs, *emitter.aux_values(used)])
+    emitter.aux(used)
+    for k, expr in derivatives:
+        emitter.assign(deriv_name(k), k, expr)
+
+    if sparse:
+        emitter.alloc(len(entries))
+        for k, (i, j) in enumerate(sorted(entries)):
+            emitter.assign(f'out[{k}]', f'jac[{i}, {j}]', entries[i, j])
+    else:
+        emitter.line('    if out is None:')
+        emitter.line(f'        out = zeros(({n}, {n}), dtype)')
+        emitter.line('    else:')
+        emitter.line('        out.fill(0.0)')
+        for (i, j), expr in sorted(entries.items()):
+            emitter.assign(f'out[{i}, {j}]', f'jac[{i}, {j}]', expr)
+    emitter.line('    return out')
+    return emitter.source()
+
+
+def params_source(params, derived, name='params'):
+    """
+    Return the source code of a function that fills the derived parameters
+    in a parameter vector from the values of the other parameters.
+
+    Args:
+        params:
+            Sequence of parameter names, in the order they appear in the
+            vector.
+        derived:
+            Mapping from names of derived parameters to expressions that
+            compute them from other parameters.
+
+    The generated function has the signature ``fn(p) -> p`` and updates
+    ``p`` in place. ``p`` is either a vector or a matrix with one parameter
+    vector per row.
+    """
+    idx = {k: i for i, k in enumerate(params)}
+    deps = dependencies(derived, derived)
+    printer = Printer({k: param_name(k) for k in params})
+    used = _free_names(derived.values()) - set(derived)
+
+    lines = [f'def {name}(p):']
+    lines.extend(f'    {param_name(k)} = p[..., {i}]'
+                 for k, i in idx.items() if k in used)
+    for k in topological_order(deps):
+        lines.append(f'    {param_name(k)} = {print_expr(printer, k, derived[k])}')
+        lines.append(f'    p[..., {idx[k]}] = {param_name(k)}')
+    lines.append('    return p')
+    return '\n'.join(lines) + '\n'
+
+
+def _free_names(exprs):
+    names = set()
+    for expr in exprs:
+        if isinstance(expr, Expr):
+            names.update(s.name for s in expr.free_symbols)
+    return names
+
+
+class Emitter:
+    """
+    Accumulate lines of generated code for the body of a function.
+
+    If compiler eliminates common subexpressions, each shared subterm is
+    assigned to a temporary variable just before the first statement that
+    uses it.
+    """
+
+    def __init__(self, compiler, extra_names=None, batch=False):
+        temps, aux, equations = compiler.expressions()
+        self.temps = dict(temps)
+        self.aux_exprs = aux
+        self.equations = equations
+        self.aux_order = compiler.aux_order
+        self.params = compiler.param_map()
+        self.batch = batch
+        self.lines = []
+        self._emitted = set()
+
+        names = symbol_names(compiler.vars, compiler.aux, compiler.params)
+        names.update((k, temp_name(k)) for k in self.temps)
+        names.update(extra_names or {})
+        self.printer = Printer(names)
+
+    def source(self):
+        return '\n'.join(self.lines) + '\n'
+
+    def line(self, line):
+        self.lines.append(line)
+
+    def item(self, src, i):
+        """
+        Return expression that reads the i-th component of a state array.
+        """
+        return f'{src}[:, {i}]' if self.batch else f'{src}[{i}]'
+
+    def alloc(self, size):
+        self.line('    if out is None:')
+        if self.batch:
+            self.line(f'        out = empty((x.shape[0], {size}), dtype)')
+        else:
+            self.line(f'        out = empty({size}, dtype)')
+
+    def read(self, src, idx, rename):
+        for k, i in idx.items():
+            self.line(f'    {rename(k)} = {self.item(src, i)}')
+
+    def read_params(self, exprs):
+        """
+        Read all parameters used by the given expressions from the parameter
+        vector.
+        """
+        exprs = [*exprs, *self.temps.values()]
+        used = _free_names(exprs)
+        for k, i in self.params.items():
+            if k in used:
+                src = f'p[..., {i}]' if self.batch else f'p[{i}]'
+                self.line(f'    {param_name(k)} = {src}')
+
+    def aux_values(self, names=None):
+        """
+        Return a list with expressions of the given auxiliary terms.
+        """
+        return [e for k, e in self.aux_exprs.items() if names is None or k in names]
+
+    def aux(self, names=None):
+        """
+        Assign auxiliary terms in dependency order. If names is given, skip
+        all terms not in this collection.
+        """
+        for k in self.aux_order:
+            if names is None or k in names:
+                self.assign(aux_name(k), k, self.aux_exprs[k])
+
+    def assign(self, target, name, expr):
+        self._require_temps(expr)
+        self.line(f'    {target} = {print_expr(self.printer, name, expr)}')
+
+    def _require_temps(self, expr):
+        if not isinstance(expr, Expr):
+            return
+        for symb in sorted(expr.free_symbols, key=str):
+            k = symb.name
+            if k in self.temps and k not in self._emitted:
+                self._emitted.add(k)
+                self.assign(temp_name(k), k, self.temps[k])
+
+
+def exec_source(source, name, dtype=np.float64, namespace=None):
+    """
+    Execute generated source and return the function with the given name.
+
+    The source is registered in the linecache, so tracebacks that pass
+    through generated code display the offending lines.
+    """
+    filename = f'<toy-generated:{name}:{next(_counter)}>'
+    lines = source.splitlines(True)
+    linecache.cache[filename] = (len(source), None, lines, filename)
+
+    ns = {'numpy': np, 'empty': np.empty, 'zeros': np.zeros, 'dtype': dtype}
+    ns.update(namespace or {})
+    exec(compile(source, filename, 'exec'), ns)
+    return ns[name]
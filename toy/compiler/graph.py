@@ -0,0 +1,79 @@
+from typing import Mapping, Dict, Set, List, Iterable
+
+from sympy import Expr
+
+
+def dependencies(exprs: Mapping[str, object], names: Iterable[str]) -> Dict[str, Set[str]]:
+    """
+    Map each expression name to the set of given names it depends on.
+
+    Args:
+        exprs:
+            A mapping from names to sympy expressions. Numeric and other
+            non-symbolic values have no dependencies.
+        names:
+            Only those names are considered to be dependencies.
+    """
+    names = set(names)
+    deps = {}
+    for k, expr in exprs.items():
+        if isinstance(expr, Expr):
+            deps[k] = {s.name for s in expr.free_symbols} & names
+        else:
+            deps[k] = set()
+    return deps
+
+
+def topological_order(deps: Mapping[str, Set[str]]) -> List[str]:
+    """
+    Sort names so each one comes after all of its dependencies.
+
+    Ties are resolved by preserving the original order of the mapping, thus
+    names that are already sorted are kept in place.
+
+    Raises:
+        ValueError: if there is a cyclic dependency.
+    """
+    position = {k: i for i, k in enumerate(deps)}
+    order = []
+    done = set()
+
+    for root in deps:
+        if root in done:
+            continue
+        path = [root]
+        visiting = {root}
+        stack = [iter(sorted(deps[root], key=position.get))]
+        while stack:
+            for dep in stack[-1]:
+                if dep in done:
+                    continue
+                if dep in visiting:
+                    cycle = path[path.index(dep):] + [dep]
+                    raise ValueError('cyclic dependency: ' + ' -> '.join(cycle))
+                path.append(dep)
+                visiting.add(dep)
+                stack.append(iter(sorted(deps[dep], key=position.get)))
+                break
+            else:
+                stack.pop()
+                name = path.pop()
+                visiting.discard(name)
+                done.add(name)
+                order.append(name)
+    return order
+
+
+def required(deps: Mapping[str, Set[str]], roots: Iterable[str]) -> Set[str]:
+    """
+    Return the set of all names transitively required by roots. Roots are
+    not included, unless some other root depends on them.
+    """
+    result = set()
+    stack = [dep for root in roots for dep in deps.get(root, ())]
+    while stack:
+        name = stack.pop()
+        if name not in result:
+            result.add(name)
+            stack.extend(deps.get(name, ()))
+    return result
@@ -0,0 +1,179 @@
+"""
+Optional Numba backend.
+
+Generated kernels are compiled to native code with numba.njit and fixed-step
+solvers may request a native integration loop that calls the kernel
+directly, so a whole :meth:`toy.solvers.Solver.solve_steps` call runs
+without touching the Python interpreter.
+"""
+import warnings
+
+import numpy as np
+
+from . import codegen
+
+try:
+    import numba
+except ImportError:  # pragma: no cover
+    numba = None
+
+
+def is_available() -> bool:
+    """
+    True if numba is installed.
+    """
+    return numba is not None
+
+
+def compile_kernel(source, name, dtype, arrays=3):
+    """
+    Compile generated kernel source with numba.
+
+    Kernels take a float time argument followed by ``arrays`` 1d arrays, the
+    last ones being the output and the parameter vector. It compiles
+    specializations for the model dtype and for float64 and raises an
+    exception if numba is not installed or if the expression cannot be
+    compiled.
+    """
+    if numba is None:
+        raise ImportError('numba is not installed')
+
+    fn = codegen.exec_source(source, name, dtype)
+    signatures = []
+    for tt in {np.dtype(dtype), np.dtype(np.float64)}:
+        array = numba.from_dtype(tt)[:]
+        signatures.append((numba.float64, *([array] * arrays)))
+    return numba.njit(signatures)(fn)
+
+
+def wrap_kernel(kernel, size, dtype, arrays=3, p=None, loops=None):
+    """
+    Wrap kernel into a function that allocates the output array if it is not
+    given.
+
+    The wrapper exposes the kernel in the ``kernel`` attribute and a
+    ``jit_loop(method, *args)`` function that returns native integration
+    loops for fixed step solvers. If ``p`` is given, it is used as the
+    default parameter vector. ``wrapper.bind(p)`` creates a new wrapper that
+    shares the kernel and native loops, but uses a different vector.
+    """
+    empty = np.empty
+    params = np.empty(0, dtype) if p is None else p
+    loops = {} if loops is None else loops
+
+    if arrays == 3:
+        def fn(t, x, out=None, p=None):
+            if out is None:
+                out = empty(size, dtype)
+            kernel(t, x, out, params if p is None else p)
+            return out
+    else:
+        def fn(t, y, x, out=None, p=None):
+            if out is None:
+                out = empty(size, dtype)
+            kernel(t, y, x, out, params if p is None else p)
+            return out
+
+    def jit_loop(method, *args):
+        key = (method, *args)
+        try:
+            loop = loops[key]
+        except KeyError:
+            loops[key] = loop = LOOP_FACTORIES[method](kernel, *args)
+        return lambda t, y, dts, data: loop(t, y, dts, data, params)
+
+    fn.kernel = kernel
+    fn.jit_loop = jit_loop
+    fn.bind = lambda p: wrap_kernel(kernel, size, dtype, arrays, p, loops)
+    return fn
+
+
+def fallback(reason, exc=None):
+    """
+    Warn that the numba backend is not used.
+    """
+    msg = f'numba backend is not available ({reason}), using the Python backend'
+    if exc is not None:
+        msg += f': {exc}'
+    warnings.warn(msg, RuntimeWarning, stacklevel=3)
+
+
+#
+# Native integration loops. Each loop has the signature
+# loop(t, y, dts, data, p) -> t, updates y in place and saves the state after
+# the i-th step in data[i + 1].
+#
+def euler_loop(kernel):
+    @numba.njit
+    def loop(t, y, dts, data, p):
+        k = np.empty_like(y)
+        for i in range(dts.shape[0]):
+            dt = dts[i]
+            kernel(t, y, k, p)
+            for j in range(y.shape[0]):
+                y[j] += dt * k[j]
+            t += dt
+            data[i + 1, :] = y
+        return t
+
+    return loop
+
+
+def rk2_loop(kernel, alpha, w1, w2):
+    @numba.njit
+    def loop(t, y, dts, data, p):
+        k1 = np.empty_like(y)
+        k2 = np.empty_like(y)
+        tmp = np.empty_like(y)
+        for i in range(dts.shape[0]):
+            dt = dts[i]
+            tau = alpha * dt
+            kernel(t, y, k1, p)
+            for j in range(y.shape[0]):
+                tmp[j] = y[j] + tau * k1[j]
+            kernel(t + tau, tmp, k2, p)
+            for j in range(y.shape[0]):
+                y[j] += dt * (w1 * k1[j] + w2 * k2[j])
+            t += dt
+            data[i + 1, :] = y
+        return t
+
+    return loop
+
+
+def rk4_loop(kernel):
+    @numba.njit
+    def loop(t, y, dts, data, p):
+        k1 = np.empty_like(y)
+        k2 = np.empty_like(y)
+        k3 = np.empty_like(y)
+        k4 = np.empty_like(y)
+        tmp = np.empty_like(y)
+        n = y.shape[0]
+        for i in range(dts.shape[0]):
+            dt = dts[i]
+            tau = dt / 2
+            kernel(t, y, k1, p)
+            for j in range(n):
+                tmp[j] = y[j] + tau * k1[j]
+            kernel(t + tau, tmp, k2, p)
+            for j in range(n):
+                tmp[j] = y[j] + tau * k2[j]
+            kernel(t + tau, tmp, k3, p)
+            for j in range(n):
+                tmp[j] = y[j] + dt * k3[j]
+            kernel(t + dt, tmp, k4, p)
+            for j in range(n):
+                y[j] += dt / 6 * (k1[j] + 2 * k2[j] + 2 * k3[j] + k4[j])
+            t += dt
+            data[i + 1, :] = y
+        return t
+
+    return loop
+
+
+LOOP_FACTORIES = {
+    'euler': euler_loop,
+    'rk2': rk2_loop,
+    'rk4': rk4_loop,
+}
@@ -1,3 +1,6 @@
 from .model import Model
 from .run import Run
+from .composite import compose
+from .ensemble import Ensemble
+from .sweep import Sweep
 from .value import Value
\ No newline at end of file
@@ -0,0 +1,133 @@
+import sys
+from typing import Dict, Tuple, Type
+
+import numpy as np
+
+from .model import Model
+from .model_meta import ModelMeta, Environment
+from .value import Value
+
+# Rank of declarations bound to the same name: dynamic variables and
+# computed expressions take precedence over numeric placeholders.
+NUMERIC, COMPUTED, DYNAMIC = range(3)
+
+
+def compose(*models: Type[Model], name: str = None, **values) -> Type[Model]:
+    """
+    Create a model class that couples the given sub-models into a single
+    system of equations.
+
+    Names shared by sub-models refer to the same quantity. Numeric values
+    are treated as external inputs and are bound to dynamic variables or
+    computed terms with the same name in other sub-models. The composite
+    class is an ordinary model: it compiles the union of all equations into
+    a single derivative function and its state concatenates the dynamic
+    variables of each sub-model, in order.
+
+    Examples:
+        DICE = compose(Carbon, Temperature, Population, Production,
+                       Emissions, Costs, name='DICE')
+        run = DICE(savings=0.3).run(0, 100)
+
+    Args:
+        models:
+            Model classes.
+        name:
+            Name of the new class. Defaults to the concatenated names of the
+            sub-models. The class must be assigned to a global variable with
+            this name, in the module that calls compose(), to be used by
+            worker processes.
+        values:
+            Additional declarations, with the same syntax as class bodies.
+            They override sub-model declarations and bind names that differ
+            across sub-models or resolve conflicting external values.
+
+    Raises:
+        ValueError:
+            If a name is the dynamic variable of more than one sub-model, or
+            has different computed expressions or numeric values in distinct
+            sub-models.
+    """
+    if not models:
+        raise TypeError('at least one model is required')
+    name = name or ''.join(m.__name__ for m in models)
+
+    env = Environment()
+    declarations, bindings = merge_declarations(models, values)
+    for k, v in declarations.items():
+        env.declare_value(k, v)
+    for k, v in values.items():
+        env.declare_value(k, v)
+    for model in models:
+        for k, eq in model.equations.items():
+            env.declare_derivative(k, eq)
+        env.invariants.update(getattr(model, 'invariants', {}))
+
+    names = ', '.join(m.__name__ for m in models)
+    env['__doc__'] = f'Composite of {names}.'
+    env['__qualname__'] = name
+    env['__module__'] = sys._getframe(1).f_globals.get('__name__', '__main__')
+    cls = ModelMeta(name, (Model,), env)
+    cls.dtype = np.result_type(*(m.dtype for m in models)).type
+    cls.submodels = models
+    cls.bindings = bindings
+    return cls
+
+
+def merge_declarations(models, values=()) -> Tuple[Dict[str, Value], Dict[str, type]]:
+    """
+    Merge value declarations of sub-models.
+
+    Return a tuple (declarations, bindings). Declarations are ordered by the
+    first sub-model that provides the selected value of each name and names
+    in values are skipped. Bindings map external inputs of some sub-model to
+    the sub-model that computes them.
+    """
+    candidates = {}
+    for model in models:
+        for k, v in model.values.items():
+            if k in values:
+                continue
+            if k in model.equations:
+                rank = DYNAMIC
+            elif v.is_numeric:
+                rank = NUMERIC
+            else:
+                rank = COMPUTED
+            candidates.setdefault(k, []).append((rank, model, v))
+
+    selected = {}
+    bindings = {}
+    for k, options in candidates.items():
+        rank, model, value = max(options, key=lambda x: x[0])
+        for other_rank, other, other_value in options:
+            if other is model or other_rank < rank:
+                continue
+            if rank == DYNAMIC:
+                raise ValueError(f'{k} is a dynamic variable of both '
+                                 f'{model.__name__} and {other.__name__}')
+            if other_rank == DYNAMIC or not same_value(value.value, other_value.value):
+                raise ValueError(f'conflicting declarations of {k} in '
+                                 f'{model.__name__} and {other.__name__}')
+        selected[k] = model
+        if rank != NUMERIC and len(options) > 1:
+            bindings[k] = model
+
+    declarations = {}
+    for model in models:
+        for k, v in model.values.items():
+            if selected.get(k) is model and k not in declarations:
+                declarations[k] = v
+    return declarations, bindings
+
+
+def same_value(x, y) -> bool:
+    """
+    Check if two declared values are equal.
+    """
+    if x is y:
+        return True
+    try:
+        return bool(np.all(np.asarray(x) == np.asarray(y)))
+    except (TypeError, ValueError):
+        return x == y
@@ -0,0 +1,129 @@
+from typing import Mapping, Dict
+
+import numpy as np
+
+from . import run
+from ..compiler import bind_params
+from ..solvers import EnsembleSolver, uses_split, supports_ensemble
+
+
+class Ensemble:
+    """
+    Results of simulating many members of the same model at once.
+
+    Trajectories are stored in the ``values`` array with shape
+    (members, steps, vars). Each variable is exposed as an attribute with its
+    final values and the ``<var>_ts`` attribute returns a (members, steps)
+    array with its time series.
+    """
+
+    members = property(lambda self: self.values.shape[0])
+
+    @classmethod
+    def from_model(cls, model, times, solver_class, members=None,
+                   overrides: Mapping = None, name=None):
+        """
+        Simulate ensemble of model members over the given times.
+
+        Overrides map variables and parameters to either scalars, shared by
+        all members, or to sequences with one value per member.
+        """
+        meta = model._meta
+        template = model._template
+        compiler = meta.compiler
+        overrides = {k: np.asarray(v) for k, v in (overrides or {}).items()}
+        members = ensemble_size(overrides, members)
+
+        if not supports_ensemble(solver_class):
+            name = getattr(solver_class, '__name__', solver_class)
+            raise ValueError(f'solver does not support ensembles: {name}. '
+                             f'Use a fixed step method such as rk4.')
+
+        invalid = set(overrides) - set(template.free_params) - set(model.vars)
+        if invalid:
+            raise TypeError(f'cannot set in ensemble: {invalid}. Only '
+                            f'variables and free parameters are accepted.')
+
+        # Derived parameters that depend on auxiliary terms cannot be computed
+        # from the parameter vector, thus each member is a separate model
+        if not template.is_parametric:
+            return cls._from_members(model, times, solver_class, members,
+                                     overrides, name=name)
+
+        # Parameter matrix
+        values = model.param_values()
+        values.update((k, v) for k, v in overrides.items() if k in template.params)
+        p = template.param_vector(values, members)
+
+        # Initial conditions
+        y0 = np.tile(meta.y0, (members, 1))
+        for k, v in overrides.items():
+            if k in model.vars:
+                y0[:, compiler.var_index(k)] = v
+
+        fn = bind_params(meta.batch_diff_fn, p)
+        options = {'split': meta.split} if uses_split(solver_class) else {}
+        solver = EnsembleSolver(solver_class, fn, y0, times[0], **options)
+        values = solver.solve(times)
+        params = {k: p[:, i] for i, k in enumerate(template.params)}
+        return cls(model, times, values, params, name=name)
+
+    @classmethod
+    def _from_members(cls, model, times, solver_class, members, overrides, name=None):
+        # Create each member with with_params() and integrate them one at a
+        # time. Parameters that become auxiliary terms in some member are
+        # recorded as NaN.
+        values = None
+        params = {k: np.full(members, np.nan) for k in model.params}
+        for i in range(members):
+            ns = {k: (v[i] if v.ndim else v).item() for k, v in overrides.items()}
+            member = model.with_params(**ns)
+            solver = run.make_solver(solver_class, member)
+            ys = solver.solve(times)
+            if values is None:
+                values = np.empty((members, *ys.shape), dtype=ys.dtype)
+            values[i] = ys
+            for k, v in member.param_values().items():
+                if k in params:
+                    params[k][i] = v
+        return cls(model, times, values, params, name=name)
+
+    def __init__(self, model, times, values, params: Dict[str, np.ndarray], name=None):
+        self.model = model
+        self.name = name
+        self.times = times
+        self.values = values
+        self.params = params
+
+    def __getattr__(self, attr):
+        ts = attr.endswith('_ts')
+        name = attr[:-3] if ts else attr
+        try:
+            idx = self.__dict__['model']._meta.compiler.var_index(name)
+        except KeyError:
+            raise AttributeError(attr) from None
+        return self.values[:, :, idx] if ts else self.values[:, -1, idx]
+
+    def __repr__(self):
+        name = f'Ensemble:{self.name}' if self.name else 'Ensemble'
+        return f'<{name} members={self.members}, steps={len(self.times)}>'
+
+    def member(self, i) -> np.ndarray:
+        """
+        Return (steps, vars) array with the trajectory of the i-th member.
+        """
+        return self.values[i]
+
+
+def ensemble_size(overrides: Mapping[str, np.ndarray], members=None) -> int:
+    """
+    Infer the number of members from the length of overrides.
+    """
+    sizes = {len(v) for v in overrides.values() if v.ndim == 1}
+    if any(v.ndim > 1 for v in overrides.values()):
+        raise ValueError('overrides must be scalars or 1-D sequences')
+    if members is not None:
+        sizes.add(members)
+    if len(sizes) > 1:
+        raise ValueError(f'inconsistent number of members: {sorted(sizes)}')
+    return sizes.pop() if sizes else 1
@@ -1,5 +1,5 @@
 from sidekick import lazy, delegate_to
-from ..compiler import Compiler
+from ..compiler import bind_params
 
 
 class Meta:
@@ -13,26 +13,62 @@ class Meta:
     params = delegate_to('model')
     compile_diff_fn = delegate_to('compiler')
     compile_aux_fn = delegate_to('compiler')
+    compile_jacobian_fn = delegate_to('compiler')
 
     # Computed variables
-    diff_fn = lazy(lambda self: self.compile_diff_fn())
-    aux_fn = lazy(lambda self: self.compile_aux_fn())
+    diff_fn = lazy(lambda self: self.bind_params(self.compiler.function('diff')))
+    aux_fn = lazy(lambda self: self.bind_params(self.compiler.function('aux')))
+    jacobian_fn = lazy(lambda self: self.bind_params(self.compiler.function('jacobian')))
+    batch_diff_fn = lazy(lambda self: self.compiler.function('diff', batch=True))
+    batch_aux_fn = lazy(lambda self: self.compiler.function('aux', batch=True))
+    p = lazy(lambda self: self.compiler.vectorize_params(self.model.param_values()))
+    split = lazy(lambda self: self.compiler.position_velocity_split())
     vars_size = lazy(lambda self: sum(v.size for v in self.vars.values()))
     aux_size = lazy(lambda self: sum(v.size for v in self.aux.values()))
     params_size = lazy(lambda self: sum(v.size for v in self.params.values()))
     t0 = 0.0
     tf = 10.0
     steps = 100
+    backend = 'python'
+    cse = False
     y0 = property(lambda self: self.compiler.vectorize_vars(self.model.var_values()))
 
     @lazy
     def compiler(self):
-        m = self.model
-        return Compiler(m.vars, m.aux, m.equations, dtype=m.dtype)
+        template = self.model._template
+        return template.compiler(backend=self.backend, cse=self.cse)
 
     def __init__(self, model):
         self.model = model
 
+    def copy(self, model) -> 'Meta':
+        """
+        Return a copy of meta for the given model that keeps all
+        configuration options, but not the compiled functions.
+        """
+        new = Meta(model)
+        for attr in ('t0', 'tf', 'steps', 'backend', 'cse'):
+            if attr in self.__dict__:
+                setattr(new, attr, self.__dict__[attr])
+        return new
+
+    def bind_params(self, fn):
+        """
+        Bind the parameter vector of model to a compiled function.
+        """
+        return bind_params(fn, self.p)
+
+    def configure(self, **options):
+        """
+        Set compilation options and discard all compiled functions.
+        """
+        for k, v in options.items():
+            if v is not None:
+                setattr(self, k, v)
+        for attr in ('compiler', 'diff_fn', 'aux_fn', 'jacobian_fn',
+                     'batch_diff_fn', 'batch_aux_fn'):
+            self.__dict__.pop(attr, None)
+
     def unvectorize_vars(self, y):
         """
         Convert vector state to a dictionary.
@@ -1,15 +1,21 @@
+import os
+
 import numpy as np
-from sympy import Expr
-from typing import Mapping, Any, Dict
+from typing import Mapping, Any, Dict, Optional
 
 import sidekick as sk
 from toy.solvers import SOLVERS
+from ..compiler import Compiler
 from .meta import Meta
 from .model_meta import ModelMeta
+from .template import Template, substitute_params, substitute_equations
 from .value import Value, fix_numeric, NumericType
-from ..utils import substitute, coalesce
+from ..utils import coalesce, is_numeric, LazyMap
 
 run = sk.import_later('..run', package=__name__)
+ensemble = sk.import_later('..ensemble', package=__name__)
+parareal = sk.import_later('..parareal', package=__name__)
+sweep = sk.import_later('..sweep', package=__name__)
 
 
 class Model(metaclass=ModelMeta):
@@ -28,38 +34,109 @@ class Model(metaclass=ModelMeta):
     equations: Mapping[str, Any]
 
     def __init__(self, ic=(), **kwargs):
-        self._meta = Meta(self)
         initial_conditions = dict(ic, **kwargs)
+        prototype = type(self)._prototype(initial_conditions)
+        if prototype is None:
+            self._init_from_declarations(initial_conditions)
+        else:
+            self._init_from_prototype(prototype, initial_conditions)
+
+    @classmethod
+    def _prototype(cls, ns) -> Optional['Model']:
+        """
+        Return an instance whose compiled template is shared by new instances
+        with the given overrides, or None if the instance must be created
+        from declarations.
+
+        Prototypes are created once per class, dtype and set of overrides
+        that change the structure of the model, i.e., numeric values for
+        derived parameters or auxiliary terms. Other numeric overrides only
+        change the parameter vector or the initial conditions. Structural
+        overrides are free parameters of the prototype, thus their values are
+        not frozen in its template.
+        """
+        if not all(k in cls.values and is_numeric(v) for k, v in ns.items()):
+            return None
+        try:
+            prototypes = cls.__dict__['_prototypes']
+        except KeyError:
+            prototypes = cls._prototypes = {}
+
+        dtype = np.dtype(cls.dtype)
+        try:
+            prototype = prototypes[dtype, frozenset()]
+        except KeyError:
+            prototype = prototypes[dtype, frozenset()] = cls._from_declarations({})
+
+        free = prototype._template.free_params
+        structural = frozenset(k for k in ns if k not in free and k not in cls.equations)
+        if structural:
+            try:
+                prototype = prototypes[dtype, structural]
+            except KeyError:
+                prototype = cls._from_declarations({k: ns[k] for k in structural})
+                prototypes[dtype, structural] = prototype
+
+        if not (prototype._template.is_parametric
+                and all(v.is_numeric for v in prototype.vars.values())):
+            return None
+        return prototype
 
-        # Initialize vars, params, aux
-        subs = initial_conditions
-        values = {k: v.replace(**subs) for k, v in self.values.items()}
+    @classmethod
+    def _from_declarations(cls, ns) -> 'Model':
+        new = object.__new__(cls)
+        new._init_from_declarations(ns)
+        return new
+
+    def _init_from_declarations(self, initial_conditions):
+        self._meta = Meta(self)
+        self._initial = initial_conditions
+
+        # Initialize vars, params, aux. Overrides replace their own
+        # declarations, but are not substituted into other expressions, thus
+        # the template keeps them as symbols that are read from the parameter
+        # vector. Only initial conditions of dynamic variables are computed
+        # from the overrides.
+        subs = {k: v for k, v in initial_conditions.items() if k not in self.equations}
+        values = {k: v.copy(value=initial_conditions[k]) if k in initial_conditions
+                  else v.replace(**subs) if k in self.equations else v
+                  for k, v in self.values.items()}
         self.vars = {k: v for k, v in values.items() if k in self.equations}
 
         # We now must decide what is parameter and what is not
-        values = {k: v for k, v in values.items() if k not in self.vars}
-        values = fix_numeric(values)
+        declared = {k: v for k, v in values.items() if k not in self.vars}
+        values = fix_numeric(declared)
         self.params = {k: v for k, v in values.items() if v.is_numeric}
         self.aux = {k: v for k, v in values.items() if k not in self.params}
 
+        # Compiled code reads parameters from a runtime vector, thus it is
+        # created from declarations before parameters are substituted
+        derived = {k: declared[k].value for k in self.params
+                   if not declared[k].is_numeric}
+        aux = {k: declared[k] for k in self.aux}
+        self._template = Template(self.vars, self.params, aux, self.equations,
+                                  derived, dtype=self.dtype)
+
         # Replace values in equations
-        params = {k: v.value for k, v in self.params.items()}
+        params = self.param_values()
         if params:
-            eqs = {}
-            for k, eq in self.equations.items():
-                if isinstance(eq, Expr):
-                    eq = substitute(eq, params)
-                elif callable(eq):
-                    raise NotImplementedError(eq)
-                eqs[k] = eq
-            self.equations = eqs
+            self.equations = substitute_equations(self.equations, params)
 
         # Save all values as attributes
         self.values = {**self.vars, **self.params, **self.aux}
         for k, v in self.values.items():
             setattr(self, k, v)
 
-    def run(self, *args, solver='rk4', t0=None, tf=None, steps=None, name=None, **kwargs) -> 'Run':
+    def __getattr__(self, attr):
+        # Auxiliary terms of models created by with_params() are not saved as
+        # attributes, since they are computed lazily.
+        try:
+            return self.__dict__['aux'][attr]
+        except KeyError:
+            raise AttributeError(attr) from None
+
+    def run(self, *args, solver='rk4', t0=None, tf=None, steps=None, name=None,
+            solver_options=None, storage=None, output=None, **kwargs) -> 'Run':
         """
         Run simulation and return a Run object.
 
@@ -74,14 +151,279 @@ class Model(metaclass=ModelMeta):
                 Method used to solve equation:
                     - 'euler'
                     - 'rk4'
+                    - 'ab', 'abm': Adams-Bashforth and Adams-Bashforth-Moulton
+                      multistep methods. The order is set with
+                      ``solver_options={'order': k}``.
+                    - 'leapfrog', 'verlet', 'yoshida4': symplectic methods
+                      for mechanical models, in which every position x has
+                      an equation ``D_x = v``.
+                    - 'dopri5' (or 'rk45'): adaptive Dormand-Prince 5(4).
+                      Results are interpolated at the requested times.
+                    - 'bdf', 'rosenbrock': adaptive implicit methods for
+                      stiff models. They use the analytic Jacobian of the
+                      model.
+                    - 'lsoda', 'radau', 'dop853': integrators from
+                      scipy.integrate.solve_ivp.
+            solver_options:
+                A dictionary with additional arguments passed to the solver,
+                such as ``{'rtol': 1e-8, 'atol': 1e-10}`` for adaptive
+                solvers.
+            storage:
+                Directory in which results are saved as memory-mapped .npy
+                files, instead of being kept in memory. Saved runs are
+                opened with ``Run.open(storage, model)``.
+            output:
+                Schedule of recorded samples, independent of the integration
+                steps. By default, all steps are recorded. It accepts:
+                    - an integer n: record every n-th step.
+                    - a sequence of output times: states are interpolated
+                      between integration steps.
+                    - a predicate function f(t, y) -> bool: record steps in
+                      which it is true.
+        """
+        meta = self._meta
+        steps = coalesce(steps, meta.steps, 100)
+        t0 = coalesce(t0, meta.t0)
+        tf = coalesce(tf, meta.tf)
+        runner = self.runner(solver, name=name, solver_options=solver_options,
+                             storage=storage)
+        times = run.times_from_args(*args, start=t0, stop=tf, step=steps)
+        return runner.run(times, output=output, **kwargs)
+
+    def run_ensemble(self, *args, members=None, solver='rk4', t0=None, tf=None,
+                     steps=None, name=None, **kwargs) -> 'Ensemble':
+        """
+        Run many simulations of the model at once and return an Ensemble.
+
+        Accepts the same positional arguments as :meth:`run`. Keyword
+        arguments override initial conditions or parameters: scalars are
+        shared by all members and sequences give one value per member. All
+        members are integrated simultaneously using vectorized operations.
+
+        Examples:
+            ens = model.run_ensemble(10, k=np.linspace(0, 1, 1000))
+            ens.x_ts  # (1000, steps) array with trajectories of x
+
+        Keyword arguments:
+            members:
+                Number of members. Inferred from overrides, if not given.
+            solver:
+                Fixed step method used to solve equations:
+                    - 'euler'
+                    - 'midpoint', 'rk2', 'ralston', 'heun'
+                    - 'rk4'
+                    - 'ab', 'abm', 'leapfrog', 'verlet', 'yoshida4'
+                Adaptive and scipy solvers are not accepted.
+        """
+        meta = self._meta
+        steps = coalesce(steps, meta.steps, 100)
+        t0 = coalesce(t0, meta.t0)
+        tf = coalesce(tf, meta.tf)
+        times = run.times_from_args(*args, start=t0, stop=tf, step=steps)
+        times = np.asarray(times, dtype=float)
+        solver = SOLVERS[solver] if isinstance(solver, str) else solver
+        return ensemble.Ensemble.from_model(self, times, solver, members,
+                                            kwargs, name=name)
+
+    def run_parareal(self, *args, fine='rk4', coarse='euler', slices=None,
+                     workers=None, t0=None, tf=None, steps=None, name=None,
+                     **kwargs) -> 'Run':
+        """
+        Run simulation with the Parareal parallel-in-time algorithm and return
+        a Run object.
+
+        Accepts the same positional arguments as :meth:`run`. Slices of the
+        time interval are integrated concurrently by the fine solver in a
+        pool of worker processes and corrected by a sequential pass of the
+        coarse solver. Statistics, including the wall-clock speedup with
+        respect to serial integration, are saved in the ``run.parareal``
+        attribute.
+
+        Examples:
+            run = model.run_parareal(0, 1000, 100_000, workers=8)
+            run.parareal.speedup
+
+        Keyword arguments:
+            fine, coarse:
+                Names of the fine and coarse solvers.
+            slices:
+                Number of time slices. Defaults to the number of workers.
+            workers:
+                Number of worker processes. Defaults to the number of CPUs.
+                Use 0 to run all slices in the current process.
+
+        Other keyword arguments (coarse_steps, rtol, atol, max_iter,
+        fine_options) are passed to :class:`toy.core.parareal.Parareal`.
         """
         meta = self._meta
         steps = coalesce(steps, meta.steps, 100)
         t0 = coalesce(t0, meta.t0)
         tf = coalesce(tf, meta.tf)
-        runner = self.runner(solver, name=name)
         times = run.times_from_args(*args, start=t0, stop=tf, step=steps)
-        return runner.run(times, **kwargs)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        fine = SOLVERS[fine] if isinstance(fine, str) else fine
+        coarse = SOLVERS[coarse] if isinstance(coarse, str) else coarse
+        driver = parareal.Parareal(self, fine, coarse, slices=slices,
+                                   workers=workers, **kwargs)
+        result = driver.run(times, name=name)
+        result.parareal = driver.stats
+        return result
+
+    def sweep(self, *args, params=None, times=None, solver='rk4', workers=None,
+              chunk_size=None, reduce=None, progress=None, t0=None, tf=None,
+              steps=None, name=None, solver_options=None) -> 'Sweep':
+        """
+        Simulate the model for many sets of parameters in a pool of worker
+        processes and return a Sweep.
+
+        Accepts the same positional arguments as :meth:`run`, or an explicit
+        array of times. Chunks of parameter sets are sent to each worker,
+        which compiles the model only once and creates one copy of it with
+        :meth:`with_params` for each set.
+
+        Examples:
+            from toy.core.sweep import grid, latin_hypercube
+
+            sweep = model.sweep(0, 100, params=grid(f_AO=[0.02, 0.03],
+                                                    f_OA=[0.03, 0.04]))
+            sweep.co2_atm_ts  # (4, steps) array with trajectories
+            sweep.params      # table with the values of f_AO and f_OA
+
+            sweep = model.sweep(0, 100, params=latin_hypercube(10_000, f_AO=(0.02, 0.03)),
+                                reduce=['final', 'max'], progress=True)
+            sweep.statistic('max', 'co2_atm')
+
+        Keyword arguments:
+            params:
+                Mapping from names of variables or parameters to scalars,
+                shared by all members, or to sequences with one value per
+                member. It also accepts a sequence of mappings, one for each
+                member.
+            solver:
+                Name of the solver, as in :meth:`run`.
+            workers:
+                Number of worker processes. Defaults to the number of CPUs.
+                Use 0 to run all members in the current process.
+            chunk_size:
+                Number of parameter sets sent to a worker at once.
+            reduce:
+                By default, the trajectories of all members are stacked in a
+                (members, steps, vars) array. Memory-bounded sweeps reduce
+                each trajectory as soon as it is computed:
+                    - a name or a list of names of summary statistics, from
+                      'final', 'min', 'max', 'mean' and 'std'. Results are
+                      stacked in a (members, stats, vars) array.
+                    - a function f(times, values) -> array. It must be
+                      importable by worker processes.
+            progress:
+                If True, print progress to stderr. It may also be a function
+                called as progress(done, total) after each chunk.
+        """
+        meta = self._meta
+        if times is None:
+            steps = coalesce(steps, meta.steps, 100)
+            t0 = coalesce(t0, meta.t0)
+            tf = coalesce(tf, meta.tf)
+            times = run.times_from_args(*args, start=t0, stop=tf, step=steps)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        solver = SOLVERS[solver] if isinstance(solver, str) else solver
+        return sweep.Sweep.from_model(self, times, solver, params,
+                                      solver_options=solver_options,
+                                      workers=workers, chunk_size=chunk_size,
+                                      reduce=reduce, progress=progress, name=name)
+
+    def compile(self, backend=None, cse=None) -> Compiler:
+        """
+        Compile model with the given options and return the compiler.
+
+        Options that are not given keep their current values.
+
+        Keyword arguments:
+            backend:
+                Strategy used to build the derivative function:
+                    - 'python': a single generated function for the
+                      whole system (default)
+                    - 'lambdify': one function per equation
+                    - 'numba': like 'python', but JIT compiled with numba.
+                      Fixed step solvers also run in native code.
+            cse:
+                If True, eliminate common subexpressions across all
+                auxiliary terms and equations. Use
+                ``model.compile(cse=True).cse_stats()`` to inspect how many
+                operations were removed.
+        """
+        meta = self._meta
+        meta.configure(backend=backend, cse=cse)
+        meta.diff_fn
+        return meta.compiler
+
+    def with_params(*args, **kwargs) -> 'Model':
+        """
+        Return a copy of model with new values for parameters and initial
+        conditions.
+
+        Copies share compiled code with the original model if all overrides
+        are numeric values of dynamic variables or of parameters that do not
+        depend on other parameters. This takes only a few microseconds, which
+        is useful to run many scenarios of the same model. Other overrides
+        create a new model from scratch.
+
+        Examples:
+            runs = [model.with_params(k=k).run(10) for k in range(100)]
+        """
+        self, *args = args
+        ns = dict(*args, **kwargs)
+        invalid = set(ns) - set(self.values)
+        if invalid:
+            raise TypeError(f'invalid parameters: {invalid}')
+
+        free = set(self._template.free_params)
+        if not (self._template.is_parametric
+                and all(is_numeric(v) and (k in free or k in self.vars)
+                        for k, v in ns.items())):
+            return type(self)({**self._initial, **ns})
+
+        new = object.__new__(type(self))
+        new._init_from_prototype(self, ns)
+        return new
+
+    def _init_from_prototype(self, prototype, ns):
+        # Initialize model sharing the template and compiled code of
+        # prototype. All overrides must be numeric values of dynamic
+        # variables or free parameters.
+        self._initial = {**prototype._initial, **ns}
+        self._template = template = prototype._template
+        self._meta = prototype._meta.copy(self)
+        free = set(template.free_params)
+
+        # Parameters
+        params = prototype.param_values()
+        params.update((k, v) for k, v in ns.items() if k in free)
+        p = template.param_vector(params)
+        params.update((k, p[i].item()) for i, k in enumerate(template.params)
+                      if k in template.derived)
+        self.params = {k: v if v.value == params[k] else v.copy(value=params[k])
+                       for k, v in prototype.params.items()}
+        self._meta.p = p
+
+        # Variables, aux and equations. Substitution of parameters in symbolic
+        # expressions is delayed until they are requested.
+        self.vars = {k: v.copy(value=ns[k]) if k in ns else v
+                     for k, v in prototype.vars.items()}
+        self.aux = LazyMap(prototype.aux, lambda k: template.aux[k].replace(**params))
+        if params:
+            self.equations = LazyMap(
+                prototype.equations,
+                lambda k: substitute_params(template.equations[k], params))
+        else:
+            self.equations = prototype.equations
+        self.values = LazyMap(prototype.values,
+                              lambda k: (self.vars.get(k) or self.params.get(k)
+                                         or self.aux[k]))
+        for k, v in [*self.vars.items(), *self.params.items()]:
+            setattr(self, k, v)
 
     def runner(self, solver='rk4', **kwargs):
         """
@@ -91,6 +433,7 @@ class Model(metaclass=ModelMeta):
             solver = SOLVERS[solver]
             return run.Run.from_solver(solver, self, **kwargs)
         else:
+            kwargs.pop('solver_options', None)
             return run.Run(solver, self, **kwargs)
 
     def var_values(*args, **kwargs) -> Dict[str, NumericType]:
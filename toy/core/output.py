@@ -0,0 +1,109 @@
+from typing import Tuple
+
+import numpy as np
+
+Samples = Tuple[np.ndarray, np.ndarray]
+
+
+class Output:
+    """
+    Base class for output schedules, which select the samples recorded by a
+    run independently of the integration steps.
+
+    Runs integrate in chunks of consecutive steps and pass each chunk to
+    :meth:`select`.
+    """
+
+    #: Number of steps integrated before samples are selected
+    chunk_size = 4096
+
+    def select(self, ts, ys, fn) -> Samples:
+        """
+        Return a tuple of (times, states) with the samples recorded from a
+        chunk of consecutive steps.
+
+        The first element of ts and ys is the last state of the previous
+        chunk, or the initial state, and must not be selected again. The
+        derivative function fn(t, y) may be used to interpolate states.
+        """
+        raise NotImplementedError
+
+
+class EveryNth(Output):
+    """
+    Record every n-th integration step.
+    """
+
+    def __init__(self, n: int):
+        if n < 1:
+            raise ValueError('n must be positive')
+        self.n = n
+        self.step = 0
+
+    def select(self, ts, ys, fn):
+        first = (-self.step - 1) % self.n + 1
+        self.step += len(ts) - 1
+        return ts[first::self.n], ys[first::self.n]
+
+
+class AtTimes(Output):
+    """
+    Record states at the given output times.
+
+    States between integration steps are computed by cubic Hermite
+    interpolation, which uses the derivatives at both ends of the step.
+    Times outside the integration interval are ignored.
+    """
+
+    def __init__(self, times):
+        self.times = np.sort(np.asarray(times, dtype=float))
+
+    def select(self, ts, ys, fn):
+        out = self.times[(self.times > ts[0]) & (self.times <= ts[-1])]
+        idx = np.searchsorted(ts, out)
+        values = ys[idx]
+        for k, (t, i) in enumerate(zip(out, idx)):
+            if t != ts[i]:
+                values[k] = hermite(t, ts[i - 1], ys[i - 1], ts[i], ys[i], fn)
+        return out, values
+
+
+class Where(Output):
+    """
+    Record steps in which predicate(t, y) is true.
+    """
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def select(self, ts, ys, fn):
+        pred = self.predicate
+        mask = np.array([bool(pred(t, y)) for t, y in zip(ts[1:], ys[1:])], dtype=bool)
+        return ts[1:][mask], ys[1:][mask]
+
+
+def hermite(t, t0, y0, t1, y1, fn) -> np.ndarray:
+    """
+    Interpolate state at time t from states at both ends of a step.
+    """
+    h = t1 - t0
+    s = (t - t0) / h
+    s2, s3 = s * s, s * s * s
+    return ((2 * s3 - 3 * s2 + 1) * y0 + (s3 - 2 * s2 + s) * h * fn(t0, y0)
+            + (3 * s2 - 2 * s3) * y1 + (s3 - s2) * h * fn(t1, y1))
+
+
+def as_output(output) -> Output:
+    """
+    Create output schedule from argument passed to Run.
+
+    Integers record every n-th step, callables are predicates and sequences
+    are output times.
+    """
+    if output is None or isinstance(output, Output):
+        return output
+    elif isinstance(output, (int, np.integer)):
+        return EveryNth(int(output))
+    elif callable(output):
+        return Where(output)
+    return AtTimes(output)
@@ -0,0 +1,156 @@
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from . import run
+from .workers import model_spec, load_model, executor
+
+
+class PararealStats(NamedTuple):
+    """
+    Statistics of a Parareal integration.
+
+    The error is the largest change of states at slice boundaries in the
+    last iteration, relative to the tolerance, and the run converged if it is
+    at most 1. Runs that stop after as many iterations as slices return the
+    fine solution even if they did not converge, but they are slower than a
+    serial integration. Serial time is the CPU time spent by the fine solver
+    in all slices, which estimates the cost of a serial integration.
+    """
+    iterations: int
+    slices: int
+    error: float
+    converged: bool
+    wall_time: float
+    serial_time: float
+
+    @property
+    def speedup(self) -> float:
+        """
+        Wall-clock speedup with respect to serial integration.
+        """
+        return self.serial_time / self.wall_time
+
+
+class Parareal:
+    """
+    Parallel-in-time integration with the Parareal algorithm.
+
+    The time interval is divided in slices. A cheap coarse solver propagates
+    the state sequentially through all slices and an accurate fine solver
+    integrates each slice concurrently in a pool of worker processes. The
+    states at the start of each slice are corrected with the difference
+    between the fine and coarse solutions until they change less than the
+    tolerance. After k iterations, the first k slices are exactly the fine
+    solution, thus the algorithm never takes more iterations than slices.
+
+    Args:
+        model:
+            Model instance. Its class must be importable by worker processes.
+        fine, coarse:
+            Fine and coarse solver classes.
+        slices:
+            Number of time slices. Defaults to the number of workers.
+        workers:
+            Number of worker processes. Use 0 to integrate all slices in the
+            current process.
+        coarse_steps:
+            Number of coarse steps in each slice. Defaults to a tenth of the
+            fine steps in the slice.
+        rtol, atol:
+            Tolerances for the change in the states at slice boundaries.
+        max_iter:
+            Maximum number of iterations.
+        fine_options:
+            Dictionary with additional arguments passed to the fine solver.
+    """
+
+    #: Ratio between fine and coarse steps if coarse_steps is not given
+    coarse_ratio = 10
+
+    def __init__(self, model, fine, coarse, slices=None, workers=None,
+                 coarse_steps=None, rtol=1e-6, atol=1e-9, max_iter=None,
+                 fine_options=None):
+        self.model = model
+        self.fine = fine
+        self.coarse = coarse
+        self.workers = workers
+        self.slices = slices or workers or 1
+        self.coarse_steps = coarse_steps
+        self.rtol = rtol
+        self.atol = atol
+        self.max_iter = max_iter
+        self.fine_options = dict(fine_options or {})
+        self.stats = None
+
+    def run(self, times, name=None) -> 'run.Run':
+        """
+        Integrate model over the given times and return a Run with the
+        trajectory computed by the fine solver.
+        """
+        start = time.perf_counter()
+        times = np.asarray(times, dtype=float)
+        bounds = np.unique(np.linspace(0, len(times) - 1, self.slices + 1).round().astype(int))
+        n = len(bounds) - 1
+        max_iter = min(self.max_iter or n, n)
+
+        coarse = run.make_solver(self.coarse, self.model)
+        coarse_steps = [self.coarse_steps or max(1, (b - a) // self.coarse_ratio)
+                        for a, b in zip(bounds, bounds[1:])]
+        propagate = lambda y, k: coarse.solve(
+            np.linspace(times[bounds[k]], times[bounds[k + 1]], coarse_steps[k] + 1), y)[-1]
+
+        # Initial guess with the coarse solver
+        U = [self.model._meta.y0]
+        G = []
+        for k in range(n):
+            G.append(propagate(U[k], k))
+            U.append(G[k])
+
+        spec = model_spec(self.model)
+        trajectories = [None] * n
+        elapsed = np.zeros(n)
+        it, error = 0, 0.0
+        with executor(self.workers) as pool:
+            for it in range(1, max_iter + 1):
+                ks = range(it - 1, n)
+                jobs = [pool.submit(_propagate, spec, self.fine, self.fine_options,
+                                    times[bounds[k]:bounds[k + 1] + 1], U[k])
+                        for k in ks]
+                for k, job in zip(ks, jobs):
+                    trajectories[k], elapsed[k] = job.result()
+
+                # Sequential correction. The fine solution of the first slice
+                # starts from the exact state, thus it is also exact.
+                U_new = [*U[:it], trajectories[it - 1][-1]]
+                for k in ks[1:]:
+                    g = propagate(U_new[k], k)
+                    U_new.append(g + trajectories[k][-1] - G[k])
+                    G[k] = g
+                error = max((self._error(U_new[k], U[k]) for k in range(it, n + 1)),
+                            default=0.0)
+                U = U_new
+                if error <= 1:
+                    break
+
+        result = run.Run.from_solver(self.fine, self.model, self.fine_options, name=name)
+        if n:
+            values = np.concatenate([ys[1:] for ys in trajectories])
+            result._append(times[1:], values)
+        self.stats = PararealStats(it, n, error, error <= 1,
+                                   time.perf_counter() - start, elapsed.sum())
+        return result
+
+    def _error(self, new, old):
+        scale = self.atol + self.rtol * np.abs(new)
+        return np.max(np.abs(new - old) / scale)
+
+
+def _propagate(spec, solver_class, options, times, y0):
+    model = load_model(spec)
+    start = time.process_time()
+    solver = run.make_solver(solver_class, model, options)
+    ys = solver.solve(times, y0)
+    return ys, time.process_time() - start
+
@@ -0,0 +1,102 @@
+from typing import Mapping, Callable, List
+
+import numpy as np
+
+
+class Results(Mapping):
+    """
+    Columnar view of the results of a run.
+
+    It maps column names to 1-D arrays: "t" holds the times, followed by the
+    dynamic variables and auxiliary terms. Columns are views into the
+    buffers of the run and are never copied: variables are strided views
+    into the (steps, vars) state buffer and auxiliary terms are contiguous
+    rows of the array computed by :meth:`Run.aux_series`, which is only
+    evaluated if some aux column is requested.
+
+    Views reflect the state of the run when the results object was created.
+
+    Args:
+        times:
+            Array of times.
+        values:
+            A (steps, vars) array with the recorded states.
+        aux:
+            Function that returns an (aux, steps) array of auxiliary terms.
+        vars, aux_names:
+            Names of dynamic variables and auxiliary terms.
+    """
+
+    @property
+    def columns(self) -> List[str]:
+        return ['t', *self.vars, *self.aux_names]
+
+    def __init__(self, times: np.ndarray, values: np.ndarray,
+                 aux: Callable[[], np.ndarray], vars, aux_names):
+        self.times = times
+        self.values = values
+        self.vars = list(vars)
+        self.aux_names = list(aux_names)
+        self._aux_fn = aux
+        self._aux = None
+        self._idx_vars = {k: i for i, k in enumerate(self.vars)}
+        self._idx_aux = {k: i for i, k in enumerate(self.aux_names)}
+
+    def __getitem__(self, name) -> np.ndarray:
+        if name == 't':
+            return self.times
+        elif name in self._idx_vars:
+            return self.values[:, self._idx_vars[name]]
+        elif name in self._idx_aux:
+            return self.aux[self._idx_aux[name]]
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return 1 + len(self.vars) + len(self.aux_names)
+
+    def __repr__(self):
+        return f'<Results steps={len(self.times)}, columns={self.columns}>'
+
+    @property
+    def aux(self) -> np.ndarray:
+        """
+        An (aux, steps) array with the auxiliary terms.
+        """
+        if self._aux is None:
+            self._aux = self._aux_fn()
+        return self._aux
+
+    def to_dataframe(self, aux=True):
+        """
+        Return a pandas DataFrame indexed by time with one column per
+        variable and, optionally, per auxiliary term.
+
+        Data is not copied: each group of columns is a block that wraps the
+        corresponding buffer of the run.
+        """
+        import pandas as pd
+
+        index = pd.Index(self.times, name='t', copy=False)
+        df = pd.DataFrame(self.values, index=index, columns=self.vars, copy=False)
+        if aux and self.aux_names:
+            aux_df = pd.DataFrame(self.aux.T, index=index, columns=self.aux_names,
+                                  copy=False)
+            df = pd.concat([df, aux_df], axis=1, copy=False)
+        return df
+
+    def to_arrow(self, aux=True):
+        """
+        Return a pyarrow Table with the times and one column per variable
+        and, optionally, per auxiliary term.
+
+        Contiguous columns (times and auxiliary terms) are shared with
+        Arrow. Variables are strided views in the state buffer and must be
+        copied.
+        """
+        import pyarrow as pa
+
+        names = ['t', *self.vars, *(self.aux_names if aux else ())]
+        return pa.table({name: pa.array(self[name]) for name in names})
@@ -3,13 +3,25 @@ import numpy as np
 from sidekick import delegate_to
 from .meta import Meta
 from .model import Model
-from ..solvers import Solver
+from .output import as_output
+from .results import Results
+from .storage import MemmapStorage, as_storage
+from ..solvers import Solver, SOLVERS, uses_jacobian, uses_split
 from ..utils import coalesce
 
 
 class Run:
     """
     This class makes an interface between Models and Solvers.
+
+    States are recorded in preallocated buffers that grow geometrically, thus
+    advancing a run many times in small increments takes amortized constant
+    time per step. Use :meth:`reserve` to allocate space in advance, when the
+    number of steps is known.
+
+    Results are kept in memory, unless a ``storage`` directory is given. In
+    this case, they are appended to memory-mapped files as the run advances
+    and can be opened later with :meth:`Run.open`.
     """
 
     solver: Solver
@@ -22,35 +34,72 @@ class Run:
     _meta: Meta = delegate_to('model')
 
     @classmethod
-    def from_solver(cls, solver_class, model, **kwargs):
+    def from_solver(cls, solver_class, model, solver_options=None, **kwargs):
         """
         Create solver from solver class and prepare run method.
+
+        Solver options are passed as keyword arguments to the solver class.
         """
-        meta = model._meta
-        solver = solver_class(meta.diff_fn, y0=meta.y0, t0=meta.t0)
+        solver = make_solver(solver_class, model, solver_options)
         return cls(solver, model, **kwargs)
 
-    def __init__(self, solver, model, alloc_steps=1, name=None):
+    @classmethod
+    def open(cls, path, model, solver='rk4', mode='r+', **kwargs):
+        """
+        Open run saved in the given storage directory.
+
+        Data is mapped from files without being copied to memory. The run
+        continues from the last recorded state, unless it is opened in
+        read-only mode ('r').
+        """
+        storage = MemmapStorage(path, mode=mode)
+        names = storage.info.get('vars')
+        if names != list(model._meta.vars):
+            raise ValueError(f'stored variables {names} do not match model')
+        solver = SOLVERS[solver] if isinstance(solver, str) else solver
+        return cls.from_solver(solver, model, storage=storage, **kwargs)
+
+    def __init__(self, solver, model, alloc_steps=1, name=None, storage=None):
         meta = model._meta
         self.name = name
         self.model = model
         self.solver = solver
+        self._storage = storage = as_storage(storage)
+        self._aux_cache = None
+        self.solver.callback = self._callback
+
+        if storage is not None and storage.size:
+            self._values, self._times = storage.values, storage.times
+            self._idx = storage.size
+            self.solver.t = self._times[self._idx - 1]
+            self.solver.y[:] = self._values[self._idx - 1]
+            return
+
+        self._idx = 0
+        self._values = np.zeros((0, meta.vars_size), dtype=model.dtype)
+        self._times = np.zeros(0)
+        self._resize(max(alloc_steps, 1))
         self._idx = 1
-        self._times = np.ones(alloc_steps, dtype='float64') * float('nan')
-        self._values = np.zeros((alloc_steps, meta.vars_size), dtype=model.dtype)
-        # self._aux = np.zeros((alloc_steps, meta.aux_size), dtype=model.dtype)
-        self._attributes = _make_attributes(self)
         self._times[0] = self.t
         self._values[0] = self.solver.y
-        self.solver.callback = self._callback
+        self.flush()
 
     def __getattr__(self, attr):
+        # Variables and aux terms: <name> is the current value and <name>_ts
+        # is a view with the time series
         try:
-            attr_getter = self._attributes[attr]
+            meta = self.__dict__['model']._meta
         except KeyError:
-            raise AttributeError(attr)
-        else:
-            return attr_getter()
+            raise AttributeError(attr) from None
+        ts = attr.endswith('_ts')
+        name = attr[:-3] if ts else attr
+        if ts and (name in meta.vars or name in meta.aux):
+            return self.results[name]
+        elif name in meta.vars:
+            return meta.read_var(name, self.state)
+        elif name in meta.aux:
+            return meta.read_aux(name, meta.aux_fn(self.t, self.state))
+        raise AttributeError(attr)
 
     def __repr__(self):
         name = f'Run:{self.name}' if self.name else 'Run'
@@ -60,17 +109,51 @@ class Run:
         return f'<{name} {var_data}>'
 
     def _callback(self, t, y):
+        if self._idx == len(self._times):
+            self._grow(1)
         self._values[self._idx] = y
         self._times[self._idx] = t
         self._idx += 1
 
+    def aux_series(self) -> np.ndarray:
+        """
+        Return an (aux, steps) array with the auxiliary terms computed for
+        all recorded steps.
+
+        Aux terms are evaluated by a single vectorized call on first access
+        and cached until the run advances.
+        """
+        cache = self._aux_cache
+        if cache is None or cache[0] != self._idx:
+            meta = self._meta
+            idx = self._idx
+            # Columns of out are contiguous, thus each aux term is a
+            # contiguous row of the result
+            out = np.empty((meta.aux_size, idx), dtype=self._values.dtype).T
+            meta.batch_aux_fn(self._times[:idx], self._values[:idx], out=out, p=meta.p)
+            cache = self._aux_cache = (idx, out.T)
+        return cache[1]
+
+    @property
+    def results(self) -> Results:
+        """
+        Columnar view of the recorded times, variables and aux terms.
+
+        Columns are views into the buffers of the run, thus large runs can be
+        analyzed or exported to pandas and Arrow without duplicating data.
+        """
+        idx = self._idx
+        compiler = self._meta.compiler
+        return Results(self._times[:idx], self._values[:idx], self.aux_series,
+                       compiler.var_map(), compiler.aux_map())
+
     def var_values(self):
         """
         Return a dictionary with the variable values for the current state.
         """
         return self._meta.unvectorize_vars(self.state)
 
-    def run(self, *args, t0=None, tf=None, steps=None, **kwargs):
+    def run(self, *args, t0=None, tf=None, steps=None, output=None, **kwargs):
         """
         Advance simulation in the given time frame.
 
@@ -86,12 +169,27 @@ class Run:
         tf = coalesce(tf, self.t + meta.tf - meta.t0)
 
         times = times_from_args(*args, start=t0, stop=tf, step=steps)
-        self.simulate(times)
+        self.simulate(times, output=output)
         return self
 
-    def simulate(self, times, y0=None):
+    def simulate(self, times, y0=None, output=None):
         """
         Run simulation over the given time points.
+
+        States are written directly into the output buffer by the solver
+        without going through per-step callbacks.
+
+        Args:
+            times:
+                Times of the integration steps.
+            y0:
+                Optional initial state.
+            output:
+                Schedule of recorded samples. By default, all steps are
+                recorded. It can be an integer n, to record every n-th step,
+                a sequence of output times, which are interpolated between
+                steps, a predicate function ``f(t, y) -> bool``, or an
+                instance of :class:`toy.core.output.Output`.
         """
 
         # Fill missing times
@@ -99,21 +197,104 @@ class Run:
         if times.ndim == 0:
             times = times.reshape([1])
 
-        n, m = self._values.shape
-        missing = len(times) - (n - self._idx)
-        if missing > 0:
-            self._values = np.vstack([self._values, np.zeros((missing, m))])
-            self._times = np.concatenate([self._times, np.zeros(missing)])
+        steps = len(times) - 1
+        output = as_output(output)
+        if output is None:
+            self._grow(steps)
 
         # Set initial time and value
+        solver = self.solver
+        solver.t = times[0]
         if y0 is not None:
-            self.solver.y[:] = y0
-            self._values[self._idx] = y0
-        self._times[self._idx] = times[0]
+            solver.y[:] = y0
+        if output is not None:
+            return self._simulate_output(times, output)
+
+        # The solver writes the i-th step at out[i + 1], hence the view starts
+        # at the last recorded row.
+        idx = self._idx
+        solver.solve_into(np.diff(times), self._values[idx - 1:idx + steps])
+        self._times[idx:idx + steps] = times[1:]
+        self._idx += max(steps, 0)
+        self.flush()
+        return self
 
-        self.solver.simulate(times)
+    def _simulate_output(self, times, output):
+        # Integrate in chunks and record only the selected samples
+        solver = self.solver
+        fn = self._meta.diff_fn
+        dt = np.diff(times)
+        size = output.chunk_size
+        buffer = np.empty((min(size, len(dt)) + 1, *solver.y.shape), dtype=solver.y.dtype)
+        for start in range(0, len(dt), size):
+            chunk = dt[start:start + size]
+            n = len(chunk)
+            buffer[0] = solver.y
+            solver.solve_into(chunk, buffer)
+            ts, ys = output.select(times[start:start + n + 1], buffer[:n + 1], fn)
+            self._record(ts, ys)
+        self.flush()
         return self
 
+    def _record(self, times, values):
+        n = len(times)
+        self._grow(n)
+        idx = self._idx
+        self._values[idx:idx + n] = values
+        self._times[idx:idx + n] = times
+        self._idx += n
+
+    def flush(self):
+        """
+        Save recorded steps to storage, if the run has one.
+
+        It is called automatically by :meth:`simulate`, but not after each
+        call to :meth:`step`.
+        """
+        if self._storage is not None:
+            self._storage.sync(self._idx, self._meta.vars)
+
+    def reserve(self, steps):
+        """
+        Allocate space to record the given number of additional steps.
+
+        Return the run, which makes it usable as a fluent interface.
+        """
+        size = self._idx + steps
+        if size > len(self._times):
+            self._resize(size)
+        return self
+
+    def _grow(self, steps):
+        # Geometric growth amortizes the cost of copying the history
+        size = self._idx + steps
+        capacity = len(self._times)
+        if size > capacity:
+            self._resize(max(size, 2 * capacity))
+
+    def _resize(self, capacity):
+        idx = self._idx
+        if self._storage is not None:
+            m, dtype = self._values.shape[1], self._values.dtype
+            self._values, self._times = self._storage.allocate(capacity, m, dtype, idx)
+            return
+        values = np.empty((capacity, self._values.shape[1]), dtype=self._values.dtype)
+        values[:idx] = self._values[:idx]
+        times = np.full(capacity, np.nan)
+        times[:idx] = self._times[:idx]
+        self._values, self._times = values, times
+
+    def _append(self, times, values):
+        """
+        Record states computed elsewhere and move the solver to the last one.
+        """
+        if len(times) == 0:
+            return
+        self._record(times, values)
+        self.solver.t = times[-1]
+        self.solver.y[:] = values[-1]
+        self.flush()
+
     def step(self, dt):
         """
         Run a single step by
@@ -134,6 +315,22 @@ class Run:
         self.values[self._idx] = self.y
 
 
+def make_solver(solver_class, model, solver_options=None) -> Solver:
+    """
+    Create solver for model starting from its initial state.
+
+    Solvers for stiff problems receive the analytic Jacobian of the model
+    and symplectic solvers receive its split in positions and velocities.
+    """
+    meta = model._meta
+    options = dict(solver_options or {})
+    if uses_jacobian(solver_class):
+        options.setdefault('jac', meta.jacobian_fn)
+    if uses_split(solver_class):
+        options.setdefault('split', meta.split)
+    return solver_class(meta.diff_fn, y0=meta.y0, t0=meta.t0, **options)
+
+
 def times_from_args(*args, start=0, stop=1, step=100):
     """
     Create array of times from arguments to the run() function.
@@ -155,21 +352,3 @@ def times_from_args(*args, start=0, stop=1, step=100):
         return np.linspace(start, stop, step)
     else:
         raise TypeError('function receive 0 to 3 positional arguments')
-
-
-def _make_attributes(run: Run):
-    """
-    Create dictionary mapping attribute names to getter functions
-    """
-
-    def make_state_reader(var, data):
-        return lambda: meta.read_var(var, data())
-
-    meta = run.model._meta
-    attrs = {}
-
-    for var in meta.vars:
-        attrs[var] = make_state_reader(var, lambda: run.solver.y)
-        attrs[var + '_ts'] = make_state_reader(var, lambda: run.values)
-
-    return attrs
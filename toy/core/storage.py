@@ -0,0 +1,90 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+class MemmapStorage:
+    """
+    Store the results of a run in memory-mapped .npy files.
+
+    The directory contains ``times.npy`` and ``values.npy``, with one row per
+    recorded step, and ``run.json`` with the number of valid rows and the
+    names of the variables. Files are preallocated with spare rows and grow
+    geometrically, like in-memory buffers. States are written to the mapped
+    files as the solver advances and the operating system pages them to
+    disk, thus runs are not limited by the available RAM.
+
+    Args:
+        path:
+            Directory with the stored data. It is created if necessary.
+        mode:
+            'w+' creates new files, 'r+' opens existing files for reading and
+            appending and 'r' opens them read-only.
+    """
+
+    INFO_FILE = 'run.json'
+
+    @property
+    def size(self) -> int:
+        return self.info.get('size', 0)
+
+    def __init__(self, path, mode='w+'):
+        self.path = Path(path)
+        self.mode = mode
+        self.values = self.times = None
+        if mode == 'w+':
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.info = {}
+        else:
+            self.info = json.loads((self.path / self.INFO_FILE).read_text())
+            self.values = open_memmap(str(self.path / 'values.npy'), mode=mode)
+            self.times = open_memmap(str(self.path / 'times.npy'), mode=mode)
+
+    def __repr__(self):
+        return f'MemmapStorage({str(self.path)!r}, size={self.size})'
+
+    def allocate(self, capacity, width, dtype, size=0):
+        """
+        Return a tuple of (values, times) mapped arrays with the given
+        capacity. The first size rows are copied from the current files.
+        """
+        old_values, old_times = self.values, self.times
+        values = self._open('values', (capacity, width), dtype)
+        times = self._open('times', (capacity,), np.float64)
+        times[size:] = np.nan
+        if size:
+            values[:size] = old_values[:size]
+            times[:size] = old_times[:size]
+        self.values = self._replace('values', values)
+        self.times = self._replace('times', times)
+        return self.values, self.times
+
+    def sync(self, size, vars):
+        """
+        Flush mapped arrays and record the number of valid rows.
+        """
+        self.values.flush()
+        self.times.flush()
+        self.info = {'size': size, 'vars': list(vars), 'dtype': self.values.dtype.str}
+        (self.path / self.INFO_FILE).write_text(json.dumps(self.info))
+
+    def _open(self, name, shape, dtype):
+        path = str(self.path / f'{name}.tmp.npy')
+        return open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def _replace(self, name, array):
+        array.flush()
+        os.replace(str(self.path / f'{name}.tmp.npy'), str(self.path / f'{name}.npy'))
+        return open_memmap(str(self.path / f'{name}.npy'), mode='r+')
+
+
+def as_storage(storage):
+    """
+    Create storage from argument passed to Run.
+    """
+    if storage is None or isinstance(storage, MemmapStorage):
+        return storage
+    return MemmapStorage(storage)
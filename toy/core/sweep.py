@@ -0,0 +1,254 @@
+import sys
+from concurrent.futures import as_completed
+from typing import Mapping, Dict, Sequence, Callable, Union, Optional
+
+import numpy as np
+
+from . import run
+from .ensemble import ensemble_size
+from .workers import model_spec, load_model, executor
+
+#: Summary statistics computed from a (steps, vars) trajectory
+STATISTICS = {
+    'final': lambda ys: ys[-1],
+    'min': lambda ys: ys.min(axis=0),
+    'max': lambda ys: ys.max(axis=0),
+    'mean': lambda ys: ys.mean(axis=0),
+    'std': lambda ys: ys.std(axis=0),
+}
+
+Reduce = Union[None, str, Sequence[str], Callable[[np.ndarray, np.ndarray], np.ndarray]]
+
+
+class Sweep:
+    """
+    Results of simulating a model for many sets of parameters.
+
+    Parameter sets are stored in the ``params`` table, which maps each swept
+    name to an array with one value per member. The ``values`` array stacks
+    the results of all members:
+
+    * (members, steps, vars) with the trajectories of each member. Each
+      variable is exposed as an attribute with its final values and the
+      ``<var>_ts`` attribute returns a (members, steps) array with its time
+      series.
+    * (members, stats, vars) if runs are reduced to summary statistics. Use
+      :meth:`statistic` to read them.
+    * (members, ...) with the results of a custom reduce function.
+    """
+
+    members = property(lambda self: self.values.shape[0])
+
+    @classmethod
+    def from_model(cls, model, times, solver_class, params, solver_options=None,
+                   workers=None, chunk_size=None, reduce: Reduce = None,
+                   progress=None, name=None):
+        """
+        Simulate model for each set of parameters in a pool of worker
+        processes.
+
+        Params map names of variables or parameters to either scalars,
+        shared by all members, or sequences with one value per member.
+        Members are sent to workers in chunks of chunk_size consecutive
+        parameter sets.
+        """
+        params = as_param_table(params)
+        invalid = set(params) - set(model.values)
+        if invalid:
+            raise TypeError(f'invalid parameters: {invalid}')
+        members = ensemble_size(params)
+        params = {k: np.broadcast_to(v, (members,)) for k, v in params.items()}
+        if isinstance(reduce, str):
+            reduce = (reduce,)
+        if isinstance(reduce, (list, tuple)):
+            reduce = tuple(reduce)
+            invalid = set(reduce) - set(STATISTICS)
+            if invalid:
+                raise ValueError(f'invalid statistics: {invalid}')
+
+        if chunk_size is None:
+            chunk_size = -(-members // (4 * (workers or 1)))
+        chunk_size = max(chunk_size, 1)
+        bounds = range(0, members, chunk_size)
+        report = as_progress(progress)
+
+        spec = model_spec(model)
+        times = np.asarray(times, dtype=float)
+        chunks = [None] * len(bounds)
+        done = 0
+        with executor(workers) as pool:
+            jobs = {pool.submit(_run_chunk, spec, solver_class, solver_options, times,
+                                {k: v[i:i + chunk_size] for k, v in params.items()},
+                                min(chunk_size, members - i), reduce): n
+                    for n, i in enumerate(bounds)}
+            # Jobs of the local executor are finished as they are submitted,
+            # thus they are collected in order
+            for job in (jobs if workers == 0 else as_completed(jobs)):
+                chunks[jobs[job]] = result = job.result()
+                done += len(result)
+                if report is not None:
+                    report(done, members)
+
+        values = np.concatenate(chunks)
+        params = {k: np.array(v) for k, v in params.items()}
+        return cls(model, times, values, params, reduce=reduce, name=name)
+
+    def __init__(self, model, times, values, params: Dict[str, np.ndarray],
+                 reduce: Reduce = None, name=None):
+        self.model = model
+        self.name = name
+        self.times = times
+        self.values = values
+        self.params = params
+        self.reduce = reduce
+
+    def __getattr__(self, attr):
+        ts = attr.endswith('_ts')
+        name = attr[:-3] if ts else attr
+        reduce = self.__dict__['reduce']
+        try:
+            idx = self.__dict__['model']._meta.compiler.var_index(name)
+        except KeyError:
+            raise AttributeError(attr) from None
+        if reduce is None:
+            return self.values[:, :, idx] if ts else self.values[:, -1, idx]
+        elif isinstance(reduce, tuple) and not ts:
+            return self.values[:, :, idx]
+        raise AttributeError(attr)
+
+    def __repr__(self):
+        name = f'Sweep:{self.name}' if self.name else 'Sweep'
+        return f'<{name} members={self.members}, params={list(self.params)}>'
+
+    def member(self, i) -> np.ndarray:
+        """
+        Return the result of the i-th member.
+        """
+        return self.values[i]
+
+    def statistic(self, stat, var=None) -> np.ndarray:
+        """
+        Return a (members, vars) array with the given summary statistic, or a
+        (members,) array if var is given.
+        """
+        if not isinstance(self.reduce, tuple) or stat not in self.reduce:
+            raise ValueError(f'statistic was not computed: {stat}')
+        data = self.values[:, self.reduce.index(stat)]
+        if var is None:
+            return data
+        return data[:, self.model._meta.compiler.var_index(var)]
+
+    def to_dataframe(self):
+        """
+        Return a pandas DataFrame with one row per member, with the swept
+        parameters followed by the final values of the variables or by one
+        "<var>_<stat>" column for each summary statistic.
+        """
+        import pandas as pd
+
+        df = pd.DataFrame(self.params)
+        names = list(self.model._meta.compiler.var_map())
+        if self.reduce is None:
+            for i, k in enumerate(names):
+                df[k] = self.values[:, -1, i]
+        elif isinstance(self.reduce, tuple):
+            for j, stat in enumerate(self.reduce):
+                for i, k in enumerate(names):
+                    df[f'{k}_{stat}'] = self.values[:, j, i]
+        return df
+
+
+def _run_chunk(spec, solver_class, options, times, params, size, reduce):
+    model = load_model(spec)
+    out = None
+    for i in range(size):
+        member = model.with_params(**{k: v[i].item() for k, v in params.items()})
+        solver = run.make_solver(solver_class, member, options)
+        ys = solver.solve(times)
+        if reduce is None:
+            result = ys
+        elif isinstance(reduce, tuple):
+            result = np.stack([STATISTICS[stat](ys) for stat in reduce])
+        else:
+            result = np.asarray(reduce(times, ys))
+        if out is None:
+            out = np.empty((size, *result.shape), dtype=result.dtype)
+        out[i] = result
+    return out
+
+
+def as_param_table(params) -> Dict[str, np.ndarray]:
+    """
+    Normalize parameter sets passed to Model.sweep() to a mapping from names
+    to arrays. It accepts a mapping of columns or a sequence of mappings,
+    one for each member.
+    """
+    if params is None:
+        return {}
+    if not isinstance(params, Mapping):
+        rows = list(params)
+        names = list(dict.fromkeys(k for row in rows for k in row))
+        try:
+            params = {k: [row[k] for row in rows] for k in names}
+        except KeyError as exc:
+            raise ValueError(f'missing value for {exc.args[0]} in some parameter set')
+    params = {k: np.asarray(v, dtype=float) for k, v in params.items()}
+    if any(v.ndim > 1 for v in params.values()):
+        raise ValueError('parameters must be scalars or 1-D sequences')
+    return params
+
+
+def as_progress(progress) -> Optional[Callable[[int, int], None]]:
+    """
+    Create progress reporter from argument passed to Model.sweep().
+
+    True prints progress to stderr and callables are called as
+    progress(done, total) after each chunk.
+    """
+    if progress is None or progress is False:
+        return None
+    elif progress is True:
+        return print_progress
+    return progress
+
+
+def print_progress(done, total):
+    """
+    Print progress of a sweep in a single line of stderr.
+    """
+    pct = 100 * done / total
+    end = '\n' if done == total else ''
+    print(f'\rsweep: {done}/{total} members ({pct:.0f}%)', end=end,
+          file=sys.stderr, flush=True)
+
+
+def grid(**axes) -> Dict[str, np.ndarray]:
+    """
+    Return the parameter table of a full factorial design, with all
+    combinations of the values given to each parameter.
+
+    Examples:
+        model.sweep(params=grid(f_AO=[0.02, 0.03], T_double=[2.5, 3, 3.5]))
+    """
+    values = np.meshgrid(*(np.asarray(v, dtype=float) for v in axes.values()),
+                         indexing='ij')
+    return {k: v.ravel() for k, v in zip(axes, values)}
+
+
+def latin_hypercube(samples, seed=None, **bounds) -> Dict[str, np.ndarray]:
+    """
+    Return the parameter table of a Latin hypercube sample with the given
+    number of samples. Bounds map parameter names to (lower, upper) pairs.
+
+    Each interval is split in samples bins of equal size and each bin is
+    sampled exactly once for each parameter.
+
+    Examples:
+        model.sweep(params=latin_hypercube(1000, savings=(0.2, 0.3)))
+    """
+    rng = np.random.RandomState(seed)
+    table = {}
+    for k, (lower, upper) in bounds.items():
+        u = (rng.permutation(samples) + rng.uniform(size=samples)) / samples
+        table[k] = lower + u * (upper - lower)
+    return table
@@ -0,0 +1,110 @@
+from typing import Mapping, Dict, Any
+
+import numpy as np
+from sympy import Expr
+
+from .value import Value
+from ..compiler import Compiler
+from ..compiler import codegen
+from ..utils import substitute
+
+
+class Template:
+    """
+    Structure of a model that is shared by all instances that differ only by
+    the numeric values of parameters and initial conditions.
+
+    Expressions in the template keep parameters as symbols, thus compiled
+    functions read their values from a runtime parameter vector.
+
+    Args:
+        vars:
+            Mapping from variable names to Value declarations.
+        params:
+            Mapping from parameter names to Value declarations.
+        aux:
+            Mapping from auxiliary term names to Value declarations, before
+            parameters are substituted.
+        equations:
+            Mapping from variable names to their derivatives, before
+            parameters are substituted.
+        derived:
+            Mapping from names of parameters that are computed from other
+            parameters to the corresponding expressions.
+        dtype:
+            Type of elements in the state and parameter arrays.
+    """
+
+    def __init__(self, vars: Mapping[str, Value], params: Mapping[str, Value],
+                 aux: Mapping[str, Value], equations: Mapping[str, Any],
+                 derived: Mapping[str, Expr], dtype=np.float64):
+        self.vars = vars
+        self.params = params
+        self.aux = aux
+        self.equations = equations
+        self.derived = derived
+        self.dtype = dtype
+        self.free_params = [k for k in params if k not in derived]
+
+        #: True if derived parameters depend only on other parameters. Only
+        #: these templates can recompute the parameter vector and create
+        #: instances without substituting values in declarations.
+        self.is_parametric = all(str(s) in params for expr in derived.values()
+                                 for s in getattr(expr, 'free_symbols', ()))
+        self._compilers = {}
+        self._params_fn = None
+
+    def compiler(self, backend='python', cse=False) -> Compiler:
+        """
+        Return the compiler for the given options.
+
+        Compilers are created only once for each combination of options.
+        """
+        key = (backend, bool(cse))
+        try:
+            return self._compilers[key]
+        except KeyError:
+            compiler = Compiler(self.vars, self.aux, self.equations,
+                                dtype=self.dtype, backend=backend, cse=cse,
+                                params=self.params)
+            self._compilers[key] = compiler
+            return compiler
+
+    def param_vector(self, values: Mapping[str, float], members=None) -> np.ndarray:
+        """
+        Return the parameter vector from a mapping with the values of all
+        free parameters. Derived parameters are recomputed.
+
+        If members is given, return a (members, params_size) matrix. Values
+        are either scalars shared by all members or arrays with one value
+        per member.
+        """
+        shape = (len(self.params),) if members is None else (members, len(self.params))
+        p = np.full(shape, np.nan, dtype=self.dtype)
+        for i, k in enumerate(self.params):
+            if k in values:
+                p[..., i] = values[k]
+        if self.derived:
+            if self._params_fn is None:
+                src = codegen.params_source(list(self.params), self.derived)
+                self._params_fn = codegen.exec_source(src, 'params', self.dtype)
+            self._params_fn(p)
+        return p
+
+
+def substitute_params(expr, params: Mapping[str, float]):
+    """
+    Substitute the values of parameters into expression.
+    """
+    if isinstance(expr, Expr):
+        return substitute(expr, params)
+    elif callable(expr):
+        raise NotImplementedError(expr)
+    return expr
+
+
+def substitute_equations(equations, params: Mapping[str, float]) -> Dict[str, Any]:
+    """
+    Substitute the values of parameters into all equations.
+    """
+    return {k: substitute_params(eq, params) for k, eq in equations.items()}
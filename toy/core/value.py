@@ -38,12 +38,12 @@ class Value(Record):
         if shape is None and value is None:
             kwargs['shape'] = (1,)
         elif shape is None:
-            kwargs['shape'] = getattr(value, 'shape', (1,))
+            kwargs['shape'] = getattr(value, 'shape', None) or (1,)
         else:
-            vshape = getattr(value, 'shape', (1,))
+            vshape = getattr(value, 'shape', None) or (1,)
             assert tuple(shape) == vshape
             kwargs['shape'] = vshape
-        symbol = kwargs.pop('symbol', Symbol(name, real=True))
+        symbol = kwargs.pop('symbol', None) or Symbol(name, real=True)
         super().__init__(name, value, symbol, **kwargs)
 
     def __repr__(self):
@@ -0,0 +1,71 @@
+"""
+Helpers to simulate models in worker processes.
+
+Compiled functions cannot be pickled, thus models are sent to workers as a
+small description with the model class and the values of its free parameters
+and initial conditions. Each worker compiles the model class only once and
+creates the requested instances with :meth:`Model.with_params`.
+"""
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Tuple, Dict, Any
+
+_models = {}
+
+ModelSpec = Tuple[type, Dict[str, Any], str, bool]
+
+
+def model_spec(model) -> ModelSpec:
+    """
+    Return a picklable description of model.
+
+    The model class must be importable by worker processes.
+    """
+    meta = model._meta
+    params = model.param_values()
+    values = {k: params[k] for k in model._template.free_params}
+    values.update(model.var_values())
+    return type(model), values, meta.backend, meta.cse
+
+
+def load_model(spec: ModelSpec):
+    """
+    Return model from description created by :func:`model_spec`.
+
+    Compiled code is shared by all models of the same class loaded in the
+    current process.
+    """
+    cls, values, backend, cse = spec
+    key = (cls, backend, cse)
+    try:
+        base = _models[key]
+    except KeyError:
+        base = _models[key] = cls()
+        base.compile(backend=backend, cse=cse)
+    return base.with_params(**values)
+
+
+def executor(workers):
+    """
+    Return a pool of worker processes. If workers is 0, jobs run in the
+    current process.
+    """
+    if workers == 0:
+        return LocalExecutor()
+    return ProcessPoolExecutor(workers)
+
+
+class LocalExecutor:
+    """
+    Executor that runs jobs in the current process.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
@@ -1,6 +1,6 @@
 import sympy as sp
 
-from toy import Model
+from toy import Model, compose
 
 
 class Carbon(Model):
@@ -196,6 +196,12 @@ class Costs(Model):
                      '[1] ratio of production dedicated to abatement'
 
 
+# Integrated assessment model: external inputs of each sub-model are bound to
+# the state and computed terms of the others.
+DICE = compose(Carbon, Temperature, Population, TotalFactorOfProductivity,
+               Production, Emissions, Costs, name='DICE')
+
+
 if __name__ == '__main__':
     from toy.app import App
 
@@ -1,3 +1,6 @@
+import inspect
+import warnings
+
 import numpy as np
 from functools import partial
 from typing import Iterable, Tuple
@@ -14,24 +17,50 @@ class Solver:
         dy/dt = fn(t, y);  y(t0) = y0;
 
     User must provide the initial conditions t0, y0, as well as the derivative
-    function fn(t, y).
+    function fn(t, y). If fn accepts an ``out`` argument, as in
+    fn(t, y, out=None), solvers write derivatives into preallocated arrays
+    rather than creating new ones at each call.
 
     The solver may track statistics about execution and is responsible for
     evolving its current state and time variable.
+
+    Functions compiled by the numba backend expose a ``jit_loop`` attribute.
+    Fixed step solvers use it to run :meth:`solve_steps` in native code when
+    no callback is installed.
     """
-    __slots__ = ('fn', 'y', 't', 'callback', 'ncalls', 'niter')
+    __slots__ = ('fn', 'fn_into', 'y', 't', 'callback', 'ncalls', 'niter',
+                 'log', 'jit_loop', '_workspace', '_raw_fns')
+
+    #: Number of function evaluations per step
+    stages = 1
+
+    #: True if every step calls the derivative function exactly ``stages``
+    #: times.
+    fixed_step = True
+
+    #: True if the solver can integrate a (members, size) ensemble state. Step
+    #: size control of adaptive solvers is only defined for a single state.
+    supports_ensemble = True
 
     def __init__(self, fn, y0: ST, t0=0.0, callback=None, log=True):
         self.fn = fn
-        self.y = np.asarray(y0) + np.array([0.0])
+        y0 = np.asarray(y0)
+        dtype = y0.dtype if np.issubdtype(y0.dtype, np.floating) else np.float64
+        self.y = y0 + np.zeros(1, dtype=dtype)
         self.t = t0 + 0.0
         self.callback = callback
         self.ncalls = 0
         self.niter = 0
+        self.log = log
+        self.jit_loop = getattr(fn, 'jit_loop', None)
+        self._workspace = ()
 
+        has_out = accepts_out(fn)
+        self._raw_fns = (fn, _fn_into(fn, has_out))
         if log:
             self.fn = self._logging_fn(fn)
             self.callback = self._logging_callback(callback)
+        self.fn_into = _fn_into(self.fn, has_out)
 
     def call(self, func):
         """
@@ -51,13 +80,35 @@ class Solver:
         """
         raise NotImplementedError
 
+    def step_into(self, t, y, dt, out: ST) -> None:
+        """
+        Like :meth:`step_function`, but write the result into the ``out``
+        array, which may be the same as ``y``.
+
+        Subclasses should override this method to compute steps using the
+        arrays in :meth:`workspace` instead of allocating new ones.
+        """
+        out[...] = self.step_function(t, y, dt)
+
+    def workspace(self, y, n) -> Tuple[ST, ...]:
+        """
+        Return a tuple of n preallocated arrays with the same shape and type
+        of y.
+
+        Arrays are reused across calls and their contents are undefined.
+        """
+        ws = self._workspace
+        if len(ws) < n or ws[0].shape != y.shape or ws[0].dtype != y.dtype:
+            ws = self._workspace = tuple(np.empty_like(y) for _ in range(n))
+        return ws[:n]
+
     def step(self, dt) -> 'Solver':
         """
         Evolve the current state by a single time delta.
 
         Return solver, which makes it usable in a fluent interface.
         """
-        self.y[:] = self.step_function(self.t, self.y, dt)
+        self.step_into(self.t, self.y, dt, self.y)
         self.t += dt
         cb = self.callback
         if cb is not None:
@@ -81,9 +132,12 @@ class Solver:
         The resulting array **includes** the initial state.
         """
 
-        data = np.zeros((len(dt) + 1, len(self.y)), dtype=self.y.dtype)
+        data = np.zeros((len(dt) + 1, *self.y.shape), dtype=self.y.dtype)
         data[0] = self.y
         cb = self.callback
+
+        if cb is None:
+            return self.solve_into(dt, data)
         idx = 1
 
         try:
@@ -100,6 +154,42 @@ class Solver:
             self.callback = cb
         return data
 
+    def solve_into(self, dt, data) -> np.ndarray:
+        """
+        Advance by all time deltas and write the state after the i-th step
+        in ``data[i + 1]``. The first row of data is not touched.
+
+        This is the fast path of :meth:`solve_steps`: it runs a single loop
+        and never calls the callback. Fixed step solvers do not log each
+        call, but update the counters once at the end.
+        """
+        dt = np.asarray(dt, dtype=float)
+        if self._solve_native(dt, data):
+            return data
+
+        fast = self.log and self.fixed_step
+        if fast:
+            logged = self.fn, self.fn_into
+            self.fn, self.fn_into = self._raw_fns
+
+        y = self.y
+        t = self.t
+        step_into = self.step_into
+        n = 0
+        try:
+            for n, h in enumerate(dt.tolist(), 1):
+                step_into(t, y, h, y)
+                t += h
+                data[n] = y
+        finally:
+            self.t = t
+            if fast:
+                self.fn, self.fn_into = logged
+                self.ncalls += self.stages * n
+            if self.log:
+                self.niter += n
+        return data
+
     def simulate(self, times, y0=None) -> 'Solver':
         """
         Simulate ODE over for all given times.
@@ -156,6 +246,44 @@ class Solver:
             y = self.step(t - self.t).y.copy()
             yield self.t, y
 
+    def native_loop(self):
+        """
+        Return a native loop that integrates the solver equations or None, if
+        it is not available.
+
+        Native loops have the signature ``loop(t, y, dts, data) -> t``: they
+        update y in place and write the state after the i-th step in
+        ``data[i + 1]``.
+        """
+        args = self._jit_args()
+        if self.jit_loop is None or args is None or self.y.ndim != 1:
+            return None
+        return self.jit_loop(*args)
+
+    def _jit_args(self):
+        return None
+
+    def _solve_native(self, dt, data):
+        loop = self.native_loop()
+        if loop is None:
+            return False
+
+        dt = np.asarray(dt, dtype=float)
+        try:
+            self.t = loop(self.t, self.y, dt, data)
+        except Exception as exc:
+            if not type(exc).__module__.startswith('numba'):
+                raise
+            msg = f'cannot run native loop, using Python: {exc}'
+            warnings.warn(msg, RuntimeWarning, stacklevel=3)
+            self.jit_loop = None
+            return False
+
+        if self.log:
+            self.niter += len(dt)
+            self.ncalls += self.stages * len(dt)
+        return True
+
     def clear_logs(self):
         """
         Reset all current logs.
@@ -164,9 +292,9 @@ class Solver:
         self.niter = 0
 
     def _logging_fn(self, fn):
-        def log_fn(t, y):
+        def log_fn(t, y, *args):
             self.ncalls += 1
-            return fn(t, y)
+            return fn(t, y, *args)
 
         return log_fn
 
@@ -191,6 +319,15 @@ class Euler(Solver):
     def step_function(self, t, x, dt):
         return x + dt * self.fn(t, x)
 
+    def _jit_args(self):
+        return 'euler',
+
+    def step_into(self, t, x, dt, out):
+        k, = self.workspace(x, 1)
+        self.fn_into(t, x, k)
+        k *= dt
+        np.add(x, k, out=out)
+
 
 class RK2(Solver):
     """
@@ -203,6 +340,7 @@ class RK2(Solver):
         alpha = 1   - Heun/trapezoid rule
     """
     __slots__ = ('alpha', 'w1', 'w2')
+    stages = 2
 
     def __init__(self, *args, alpha=0.5, **kwargs):
         self.alpha = alpha
@@ -217,12 +355,29 @@ class RK2(Solver):
         k2 = diff(t + tau, x + k1 * tau)
         return x + dt * (self.w1 * k1 + self.w2 * k2)
 
+    def _jit_args(self):
+        return 'rk2', self.alpha, self.w1, self.w2
+
+    def step_into(self, t, x, dt, out):
+        diff = self.fn_into
+        k1, k2, tmp = self.workspace(x, 3)
+        tau = self.alpha * dt
+        diff(t, x, k1)
+        np.multiply(k1, tau, out=tmp)
+        tmp += x
+        diff(t + tau, tmp, k2)
+        k1 *= self.w1 * dt
+        k2 *= self.w2 * dt
+        k1 += k2
+        np.add(x, k1, out=out)
+
 
 class RK4(Solver):
     """
     Classic fourth order Runge-Kutta method.
     """
     __slots__ = ()
+    stages = 4
 
     def step_function(self, t, x, dt):
         diff = self.fn
@@ -233,6 +388,1122 @@ class RK4(Solver):
         k4 = diff(t + dt, x + k3 * dt)
         return x + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
 
+    def _jit_args(self):
+        return 'rk4',
+
+    def step_into(self, t, x, dt, out):
+        k1, *ws = self.workspace(x, 5)
+        self.fn_into(t, x, k1)
+        _rk4_into(self.fn_into, t, x, dt, k1, out, ws)
+
+
+def _rk4_into(diff, t, x, dt, k1, out, ws):
+    """
+    Write RK4 step into out, given the derivative k1 at (t, x) and 4 work
+    arrays. The k1 array is not modified.
+    """
+    k2, k3, k4, tmp = ws
+    tau = dt / 2
+    np.multiply(k1, tau, out=tmp)
+    tmp += x
+    diff(t + tau, tmp, k2)
+    np.multiply(k2, tau, out=tmp)
+    tmp += x
+    diff(t + tau, tmp, k3)
+    np.multiply(k3, dt, out=tmp)
+    tmp += x
+    diff(t + dt, tmp, k4)
+    k2 += k3
+    k2 *= 2
+    k2 += k1
+    k2 += k4
+    k2 *= dt / 6
+    np.add(x, k2, out=out)
+
+
+class AdamsBashforth(Solver):
+    """
+    Explicit Adams-Bashforth multistep method of the given order (1 to 5).
+
+    Each step evaluates the derivative function only once and combines it
+    with derivatives from previous steps, which are kept in a ring buffer.
+    The first ``order - 1`` steps are bootstrapped with RK4.
+
+    Adams methods assume a constant step size: the history is discarded and
+    bootstrapped again when the step size changes or when the state is
+    modified outside the solver.
+    """
+    __slots__ = ('order', 'history', 'nhist', '_head', '_current', '_dt',
+                 '_t_last', '_y_last')
+    fixed_step = False
+
+    #: Coefficients of f[n], f[n - 1], ... for each order
+    BETA = {
+        1: [1.0],
+        2: [3 / 2, -1 / 2],
+        3: [23 / 12, -16 / 12, 5 / 12],
+        4: [55 / 24, -59 / 24, 37 / 24, -9 / 24],
+        5: [1901 / 720, -2774 / 720, 2616 / 720, -1274 / 720, 251 / 720],
+    }
+
+    def __init__(self, fn, y0: ST, t0=0.0, order=4, **kwargs):
+        if order not in self.BETA:
+            raise ValueError(f'order must be between 1 and {len(self.BETA)}')
+        self.order = order
+        self.history = None
+        self.nhist = 0
+        self._head = 0
+        self._current = False
+        self._dt = None
+        self._t_last = None
+        self._y_last = None
+        super().__init__(fn, y0, t0, **kwargs)
+
+    def step_function(self, t, y, dt):
+        saved = self._save()
+        try:
+            out = np.empty_like(y)
+            self.step_into(t, y, dt, out)
+            return out
+        finally:
+            self._load(saved)
+
+    def step_into(self, t, y, dt, out):
+        if not self._continues(t, y, dt):
+            self._reset(y, dt)
+        if not self._current:
+            self.fn_into(t, y, self._push())
+
+        if self.nhist < self.order:
+            _rk4_into(self.fn_into, t, y, dt, self.past(0), out, self.workspace(y, 4))
+            self._current = False
+        else:
+            self._advance(t, y, dt, out)
+        self._t_last = t + dt
+        np.copyto(self._y_last, out)
+
+    def past(self, j) -> ST:
+        """
+        Return the derivative computed j steps before the current one.
+        """
+        return self.history[(self._head - j) % self.order]
+
+    def combine(self, beta, out, first=None):
+        """
+        Write the linear combination of the derivatives in history with the
+        given coefficients into out.
+
+        If first is given, it is the derivative at the next step and is
+        multiplied by the first coefficient.
+        """
+        terms = [self.past(j) for j in range(len(beta))]
+        if first is not None:
+            terms = [first, *terms[:-1]]
+        np.multiply(terms[0], beta[0], out=out)
+        for b, f in zip(beta[1:], terms[1:]):
+            out += b * f
+
+    def _advance(self, t, y, dt, out):
+        acc, = self.workspace(y, 1)
+        self.combine(self.BETA[self.order], acc)
+        acc *= dt
+        np.add(y, acc, out=out)
+        self._current = False
+
+    def _push(self) -> ST:
+        self._head = (self._head + 1) % self.order
+        self.nhist = min(self.nhist + 1, self.order)
+        return self.history[self._head]
+
+    def _continues(self, t, y, dt):
+        if self._dt is None or abs(dt - self._dt) > 1e-8 * abs(self._dt):
+            return False
+        return t == self._t_last and np.array_equal(y, self._y_last)
+
+    def _reset(self, y, dt):
+        if self.history is None or self.history.shape[1:] != y.shape:
+            self.history = np.empty((self.order, *y.shape), dtype=y.dtype)
+            self._y_last = np.empty_like(y)
+        self.nhist = 0
+        self._current = False
+        self._dt = dt
+
+    def _save(self):
+        copy = lambda x: None if x is None else x.copy()
+        return (copy(self.history), self.nhist, self._head, self._current,
+                self._dt, self._t_last, copy(self._y_last))
+
+    def _load(self, state):
+        (self.history, self.nhist, self._head, self._current,
+         self._dt, self._t_last, self._y_last) = state
+
+
+class AdamsBashforthMoulton(AdamsBashforth):
+    """
+    Adams-Bashforth-Moulton predictor-corrector method of the given order
+    (1 to 5).
+
+    Steps are predicted with the explicit Adams-Bashforth formula and
+    corrected once with the implicit Adams-Moulton formula of the same
+    order (PECE mode). It uses two evaluations of the derivative function
+    per step and is more accurate and stable than the plain predictor.
+    """
+    __slots__ = ()
+
+    #: Coefficients of f[n + 1], f[n], f[n - 1], ... for each order
+    BETA_CORRECTOR = {
+        1: [1.0],
+        2: [1 / 2, 1 / 2],
+        3: [5 / 12, 8 / 12, -1 / 12],
+        4: [9 / 24, 19 / 24, -5 / 24, 1 / 24],
+        5: [251 / 720, 646 / 720, -264 / 720, 106 / 720, -19 / 720],
+    }
+
+    def _advance(self, t, y, dt, out):
+        acc, y_predict, f_predict = self.workspace(y, 3)
+        self.combine(self.BETA[self.order], acc)
+        acc *= dt
+        np.add(y, acc, out=y_predict)
+        self.fn_into(t + dt, y_predict, f_predict)
+
+        self.combine(self.BETA_CORRECTOR[self.order], acc, first=f_predict)
+        acc *= dt
+        np.add(y, acc, out=out)
+        self.fn_into(t + dt, out, self._push())
+        self._current = True
+
+
+class SymplecticSolver(Solver):
+    """
+    Base class for symplectic splitting methods for mechanical systems.
+
+    The state is split in positions q and velocities v, with ``dq/dt = v``
+    and ``dv/dt = a(t, q)``. Each step is a composition of drifts, which
+    advance positions with constant velocities, and kicks, which advance
+    velocities with the acceleration at the current positions::
+
+        drift(c[0]), kick(d[0]), drift(c[1]), ..., kick(d[-1]), drift(c[-1])
+
+    Symplectic methods do not accumulate errors in energy over long
+    horizons and thus allow much larger steps than RK4 for the same
+    long-term fidelity.
+
+    Args:
+        split:
+            A tuple of (positions, velocities) with the indices of each kind
+            of variable in the state. If not given, the first half of the
+            state are positions and the second half velocities.
+    """
+    __slots__ = ('positions', 'velocities')
+    uses_split = True
+
+    #: Coefficients of drift and kick substeps
+    DRIFT: Tuple[float, ...]
+    KICK: Tuple[float, ...]
+
+    def __init__(self, fn, y0: ST, t0=0.0, split=None, **kwargs):
+        super().__init__(fn, y0, t0, **kwargs)
+        if split is None:
+            n = self.y.shape[-1]
+            if n % 2:
+                raise ValueError('state must have the same number of positions and velocities')
+            split = np.arange(n // 2), np.arange(n // 2, n)
+        self.positions, self.velocities = map(np.asarray, split)
+
+    def step_function(self, t, y, dt):
+        out = np.empty_like(y)
+        self.step_into(t, y, dt, out)
+        return out
+
+    def step_into(self, t, y, dt, out):
+        q, v = self.positions, self.velocities
+        state, accel = self.workspace(y, 2)
+        np.copyto(state, y)
+        for i, d in enumerate(self.KICK):
+            c = self.DRIFT[i]
+            if c:
+                state[..., q] += (c * dt) * state[..., v]
+                t += c * dt
+            self.acceleration(i, t, state, accel)
+            state[..., v] += (d * dt) * accel[..., v]
+        c = self.DRIFT[-1]
+        if c:
+            state[..., q] += (c * dt) * state[..., v]
+        np.copyto(out, state)
+
+    def acceleration(self, i, t, state, out):
+        """
+        Write the derivatives at state into out before the i-th kick.
+
+        Only the velocity components of out are used.
+        """
+        self.fn_into(t, state, out)
+
+
+class Leapfrog(SymplecticSolver):
+    """
+    Second order leapfrog method in drift-kick-drift form.
+
+    It evaluates the acceleration once per step, at the midpoint.
+    """
+    __slots__ = ()
+    DRIFT = (0.5, 0.5)
+    KICK = (1.0,)
+
+
+class VelocityVerlet(SymplecticSolver):
+    """
+    Second order velocity Verlet method in kick-drift-kick form.
+
+    The acceleration at the end of a step is reused at the start of the
+    next one, thus it takes one evaluation per step, except after the state
+    is modified outside the solver.
+    """
+    __slots__ = ('_t_last', '_y_last', '_accel')
+    fixed_step = False
+    DRIFT = (0.0, 1.0, 0.0)
+    KICK = (0.5, 0.5)
+
+    def __init__(self, *args, **kwargs):
+        self._t_last = None
+        self._y_last = None
+        self._accel = None
+        super().__init__(*args, **kwargs)
+
+    def step_function(self, t, y, dt):
+        try:
+            return super().step_function(t, y, dt)
+        finally:
+            self._t_last = None
+
+    def step_into(self, t, y, dt, out):
+        super().step_into(t, y, dt, out)
+        self._t_last = t + dt
+        np.copyto(self._y_last, out)
+
+    def acceleration(self, i, t, state, out):
+        if i == 0 and t == self._t_last and np.array_equal(state, self._y_last):
+            np.copyto(out, self._accel)
+            return
+        self.fn_into(t, state, out)
+        if i == len(self.KICK) - 1:
+            if self._accel is None or self._accel.shape != out.shape:
+                self._accel = np.empty_like(out)
+                self._y_last = np.empty_like(out)
+            np.copyto(self._accel, out)
+
+
+class Yoshida4(SymplecticSolver):
+    """
+    Fourth order symplectic method obtained by Yoshida's triple composition
+    of leapfrog steps.
+
+    It evaluates the acceleration three times per step.
+    """
+    __slots__ = ()
+    stages = 3
+    _W1 = 1 / (2 - 2 ** (1 / 3))
+    _W0 = -2 ** (1 / 3) * _W1
+    DRIFT = (_W1 / 2, (_W0 + _W1) / 2, (_W0 + _W1) / 2, _W1 / 2)
+    KICK = (_W1, _W0, _W1)
+
+
+class AdaptiveSolver(Solver):
+    """
+    Base class for solvers with adaptive step size control and dense output.
+
+    Steps are chosen to keep the estimated local error below
+    ``atol + rtol * |y|``. Each call to :meth:`step` integrates until the
+    requested time is reached or passed and computes the state at this time
+    with a dense output interpolant, thus the output times do not constrain
+    the steps taken by the integrator.
+
+    Subclasses implement :meth:`_advance`, which takes one step from the
+    integration frontier.
+
+    Args:
+        rtol, atol:
+            Relative and absolute tolerances.
+        max_step:
+            Maximum step size.
+        first_step:
+            Initial step size. It is chosen automatically, if not given.
+    """
+    __slots__ = ('rtol', 'atol', 'max_step', 'h', 'nsteps', 'nrejected',
+                 '_frontier', '_dense', '_last')
+    fixed_step = False
+    supports_ensemble = False
+
+    #: Order of the local error estimate
+    error_order: int
+
+    SAFETY = 0.9
+    MIN_FACTOR = 0.2
+    MAX_FACTOR = 10.0
+
+    def __init__(self, fn, y0: ST, t0=0.0, rtol=1e-6, atol=1e-9,
+                 max_step=np.inf, first_step=None, **kwargs):
+        self.rtol = rtol
+        self.atol = atol
+        self.max_step = max_step
+        self.h = first_step
+        self.nsteps = 0
+        self.nrejected = 0
+        self._frontier = None
+        self._dense = None
+        self._last = None
+        super().__init__(fn, y0, t0, **kwargs)
+
+    def step_function(self, t, y, dt):
+        saved = self._save()
+        try:
+            self._last = None
+            out = np.empty_like(y)
+            self.step_into(t, y, dt, out)
+            return out
+        finally:
+            self._load(saved)
+
+    def step_into(self, t, y, dt, out):
+        if dt < 0:
+            raise ValueError('adaptive solvers cannot integrate backwards')
+        last = self._last
+        if last is None or last[0] != t or not np.array_equal(last[1], y):
+            self._restart(t, y)
+
+        target = t + dt
+        while self._frontier[0] < target:
+            self._advance()
+        out[...] = self.interpolate(target)
+        self._last = (target, out.copy())
+
+    def interpolate(self, t) -> ST:
+        """
+        Evaluate the dense output interpolant of the last step at time t.
+        """
+        t_frontier, y_frontier, _ = self._frontier
+        if t == t_frontier or self._dense is None:
+            return y_frontier.copy()
+        return self._dense(t)
+
+    def error_norm(self, error, y, y_new):
+        """
+        Root mean square norm of error scaled by tolerances.
+        """
+        scale = self.atol + self.rtol * np.maximum(abs(y), abs(y_new))
+        return np.sqrt(np.mean((error / scale) ** 2))
+
+    def _save(self):
+        return self._frontier, self._dense, self._last, self.h
+
+    def _load(self, state):
+        self._frontier, self._dense, self._last, self.h = state
+
+    def _restart(self, t, y):
+        f = self.fn(t, y)
+        self._frontier = (t, np.array(y, copy=True), f)
+        self._dense = None
+        if self.h is None:
+            self.h = self._initial_step(t, y, f)
+
+    def _advance(self):
+        raise NotImplementedError
+
+    def _initial_step(self, t, y, f):
+        # Hairer, Norsett and Wanner, Solving ODEs I, sec. II.4
+        scale = self.atol + self.rtol * abs(y)
+        rms = lambda x: np.sqrt(np.mean((x / scale) ** 2))
+        d0, d1 = rms(y), rms(f)
+        h0 = 1e-6 if d0 < 1e-5 or d1 < 1e-5 else 0.01 * d0 / d1
+        f1 = self.fn(t + h0, y + h0 * f)
+        d2 = rms(f1 - f) / h0
+        if d1 <= 1e-15 and d2 <= 1e-15:
+            h1 = max(1e-6, h0 * 1e-3)
+        else:
+            h1 = (0.01 / max(d1, d2)) ** (1 / (self.error_order + 1))
+        return min(100 * h0, h1, self.max_step)
+
+    def _step_factor(self, error, rejected):
+        exponent = -1 / (self.error_order + 1)
+        if error > 1:
+            return max(self.MIN_FACTOR, self.SAFETY * error ** exponent)
+        factor = self.MAX_FACTOR
+        if error > 0:
+            factor = min(factor, self.SAFETY * error ** exponent)
+        return min(factor, 1.0) if rejected else factor
+
+
+class EmbeddedRK(AdaptiveSolver):
+    """
+    Base class for explicit embedded Runge-Kutta pairs.
+
+    Subclasses define the Butcher tableau in C, A and B, the coefficients of
+    the error estimator in E and the dense output matrix in P. The last stage
+    is evaluated at the end of the step and reused as the first stage of the
+    next one.
+    """
+    __slots__ = ()
+
+    C: np.ndarray
+    A: np.ndarray
+    B: np.ndarray
+    E: np.ndarray
+    P: np.ndarray
+    order: int
+
+    def _advance(self):
+        t, y, f = self._frontier
+        A, C, fn = self.A, self.C, self.fn_into
+        stages = len(self.B)
+        K = np.empty((stages + 1, *y.shape), dtype=y.dtype)
+        K[0] = f
+        h = min(self.h, self.max_step)
+        rejected = False
+
+        while True:
+            for i in range(1, stages):
+                dy = np.tensordot(A[i, :i], K[:i], axes=1)
+                fn(t + C[i] * h, y + h * dy, K[i])
+            y_new = y + h * np.tensordot(self.B, K[:stages], axes=1)
+            fn(t + h, y_new, K[stages])
+
+            error = self.error_norm(h * np.tensordot(self.E, K, axes=1), y, y_new)
+            factor = self._step_factor(error, rejected)
+            if error <= 1:
+                break
+            h *= factor
+            rejected = True
+            self.nrejected += 1
+            if t + h == t:
+                raise RuntimeError(f'step size too small at t={t}')
+
+        self.nsteps += 1
+        self.h = h * factor
+        self._dense = _rk_dense_output(t, h, y, np.tensordot(self.P.T, K, axes=1))
+        self._frontier = (t + h, y_new, K[stages].copy())
+
+
+def _rk_dense_output(t_old, h, y_old, Q):
+    def dense(t):
+        x = (t - t_old) / h
+        powers = np.cumprod(np.full(len(Q), x))
+        return y_old + h * np.tensordot(powers, Q, axes=1)
+
+    return dense
+
+
+class DormandPrince(EmbeddedRK):
+    """
+    Dormand-Prince 5(4) method with fourth order dense output.
+
+    Steps are advanced with the fifth order solution and errors are
+    estimated from the embedded fourth order one.
+    """
+    __slots__ = ()
+    order = 5
+    error_order = 4
+    stages = 6
+
+    C = np.array([0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1])
+    A = np.array([
+        [0, 0, 0, 0, 0],
+        [1 / 5, 0, 0, 0, 0],
+        [3 / 40, 9 / 40, 0, 0, 0],
+        [44 / 45, -56 / 15, 32 / 9, 0, 0],
+        [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729, 0],
+        [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+    ])
+    B = np.array([35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84])
+    E = np.array([-71 / 57600, 0, 71 / 16695, -71 / 1920, 17253 / 339200,
+                  -22 / 525, 1 / 40])
+    P = np.array([
+        [1, -8048581381 / 2820520608, 8663915743 / 2820520608,
+         -12715105075 / 11282082432],
+        [0, 0, 0, 0],
+        [0, 131558114200 / 32700410799, -68118460800 / 10900136933,
+         87487479700 / 32700410799],
+        [0, -1754552775 / 470086768, 14199869525 / 1410260304,
+         -10690763975 / 1880347072],
+        [0, 127303824393 / 49829197408, -318862633887 / 49829197408,
+         701980252875 / 199316789632],
+        [0, -282668133 / 205662961, 2019193451 / 616988883,
+         -1453857185 / 822651844],
+        [0, 40617522 / 29380423, -110615467 / 29380423,
+         69997945 / 29380423],
+    ])
+
+
+class ImplicitSolver(AdaptiveSolver):
+    """
+    Base class for adaptive solvers for stiff problems, which solve linear
+    systems with the Jacobian of the derivative function.
+
+    Args:
+        jac:
+            Function ``jac(t, y)`` that returns the Jacobian of fn as a dense
+            array or a scipy sparse matrix. If not given, the Jacobian is
+            approximated by finite differences.
+    """
+    __slots__ = ('jac', 'njev', 'nlu')
+
+    #: Solvers that accept a Jacobian receive the model's analytic Jacobian
+    #: when created by a Run.
+    uses_jacobian = True
+
+    def __init__(self, fn, y0: ST, t0=0.0, jac=None, **kwargs):
+        self.jac = jac
+        self.njev = 0
+        self.nlu = 0
+        super().__init__(fn, y0, t0, **kwargs)
+
+    def jacobian(self, t, y, f=None):
+        """
+        Evaluate Jacobian at the given time and state.
+
+        Uses forward finite differences if no Jacobian function was given.
+        f is the derivative at (t, y), if known.
+        """
+        self.njev += 1
+        if self.jac is not None:
+            return self.jac(t, y)
+        return numeric_jacobian(self.fn, t, y, f)
+
+    def factorize(self, c, jac):
+        """
+        Factorize the matrix ``I - c * jac`` and return a function that
+        solves linear systems with it.
+        """
+        self.nlu += 1
+        return lu_solver(c, jac)
+
+
+class Rosenbrock(ImplicitSolver):
+    """
+    Rosenbrock method of order 2 with an embedded third order error
+    estimate and L-stable stages, as in MATLAB's ode23s.
+
+    Each step evaluates the Jacobian once and all stages reuse the same LU
+    factorization.
+
+    Reference:
+        Shampine and Reichelt, The MATLAB ODE Suite, SIAM J. Sci. Comput.,
+        18 (1997).
+    """
+    __slots__ = ()
+    order = 2
+    error_order = 2
+
+    D = 1 / (2 + np.sqrt(2))
+    E32 = 6 + np.sqrt(2)
+
+    def _advance(self):
+        t, y, f0 = self._frontier
+        d, fn = self.D, self.fn
+        jac = self.jacobian(t, y, f0)
+        h = min(self.h, self.max_step)
+        rejected = False
+
+        # Derivative with respect to time for non-autonomous systems
+        eps = np.sqrt(np.finfo(float).eps)
+        tdel = eps * max(abs(t), 1.0)
+        dfdt = (fn(t + tdel, y) - f0) / tdel
+
+        while True:
+            solve = self.factorize(h * d, jac)
+            k1 = solve(f0 + h * d * dfdt)
+            f1 = fn(t + h / 2, y + h / 2 * k1)
+            k2 = solve(f1 - k1) + k1
+            y_new = y + h * k2
+            f2 = fn(t + h, y_new)
+            k3 = solve(f2 - self.E32 * (k2 - f1) - 2 * (k1 - f0) + h * d * dfdt)
+
+            error = self.error_norm(h / 6 * (k1 - 2 * k2 + k3), y, y_new)
+            factor = self._step_factor(error, rejected)
+            if error <= 1:
+                break
+            h *= factor
+            rejected = True
+            self.nrejected += 1
+            if t + h == t:
+                raise RuntimeError(f'step size too small at t={t}')
+
+        self.nsteps += 1
+        self.h = h * factor
+        self._dense = _rosenbrock_dense_output(t, h, y, k1, k2, d)
+        self._frontier = (t + h, y_new, f2)
+
+
+def _rosenbrock_dense_output(t_old, h, y_old, k1, k2, d):
+    def dense(t):
+        s = (t - t_old) / h
+        w1 = s * (1 - s) / (1 - 2 * d)
+        w2 = s * (s - 2 * d) / (1 - 2 * d)
+        return y_old + h * (w1 * k1 + w2 * k2)
+
+    return dense
+
+
+class BDF(ImplicitSolver):
+    """
+    Variable order (1 to 5) backward differentiation formulas in the
+    quasi-constant step size implementation.
+
+    Each step solves the implicit equations with a simplified Newton
+    iteration. The Jacobian is reused until Newton fails to converge and the
+    LU factorization is reused across steps while the step size and order do
+    not change. Step size and order are selected from error estimates of
+    neighbouring orders.
+
+    References:
+        Shampine and Reichelt, The MATLAB ODE Suite, SIAM J. Sci. Comput.,
+        18 (1997).
+        Byrne and Hindmarsh, A Polyalgorithm for the Numerical Solution of
+        ODEs, ACM Trans. Math. Softw., 1 (1975).
+    """
+    __slots__ = ('order', 'max_order', '_differences', '_n_equal_steps',
+                 '_jac_value', '_jac_current', '_solve')
+
+    error_order = 1
+    MAX_ORDER = 5
+    NEWTON_MAXITER = 4
+
+    GAMMA = np.hstack([0, np.cumsum(1 / np.arange(1, MAX_ORDER + 1))])
+    ERROR_CONST = 1 / np.arange(1, MAX_ORDER + 2)
+
+    def __init__(self, fn, y0: ST, t0=0.0, max_order=MAX_ORDER, **kwargs):
+        if not 1 <= max_order <= self.MAX_ORDER:
+            raise ValueError(f'max_order must be between 1 and {self.MAX_ORDER}')
+        self.max_order = max_order
+        self.order = 1
+        self._differences = None
+        self._n_equal_steps = 0
+        self._jac_value = None
+        self._jac_current = False
+        self._solve = None
+        super().__init__(fn, y0, t0, **kwargs)
+
+    def _save(self):
+        return (super()._save(), self.order, self._differences,
+                self._n_equal_steps, self._solve)
+
+    def _load(self, state):
+        base, self.order, D, self._n_equal_steps, self._solve = state
+        self._differences = None if D is None else D.copy()
+        super()._load(base)
+
+    def _restart(self, t, y):
+        super()._restart(t, y)
+        _, y, f = self._frontier
+        h = min(self.h, self.max_step)
+        self.h = h
+        self.order = 1
+        self._n_equal_steps = 0
+        self._solve = None
+        self._jac_value = None
+        self._differences = D = np.zeros((self.MAX_ORDER + 3, *y.shape), dtype=y.dtype)
+        D[0] = y
+        D[1] = f * h
+
+    def _change_step(self, factor):
+        order = self.order
+        D = self._differences
+        R = _bdf_step_matrix(order, factor).dot(_bdf_step_matrix(order, 1))
+        D[:order + 1] = np.tensordot(R.T, D[:order + 1], axes=1)
+        self.h *= factor
+        self._n_equal_steps = 0
+        self._solve = None
+
+    def _advance(self):
+        t = self._frontier[0]
+        D = self._differences
+        gamma = self.GAMMA
+        newton_tol = max(10 * np.finfo(float).eps / self.rtol, min(0.03, self.rtol ** 0.5))
+
+        if self.h > self.max_step:
+            self._change_step(self.max_step / self.h)
+        if self._jac_value is None:
+            self._jac_value = self.jacobian(t, self._frontier[1], self._frontier[2])
+            self._jac_current = True
+
+        while True:
+            order, h = self.order, self.h
+            if t + h == t:
+                raise RuntimeError(f'step size too small at t={t}')
+            t_new = t + h
+            y_predict = D[:order + 1].sum(axis=0)
+            psi = np.tensordot(gamma[1:order + 1], D[1:order + 1], axes=1) / gamma[order]
+            c = h / gamma[order]
+            if self._solve is None:
+                self._solve = self.factorize(c, self._jac_value)
+
+            converged, n_iter, y_new, d = self._newton(t_new, y_predict, c, psi, newton_tol)
+            if not converged:
+                if self._jac_current:
+                    self._change_step(0.5)
+                else:
+                    self._jac_value = self.jacobian(t_new, y_predict)
+                    self._jac_current = True
+                    self._solve = None
+                self.nrejected += 1
+                continue
+
+            safety = 0.9 * (2 * self.NEWTON_MAXITER + 1) / (2 * self.NEWTON_MAXITER + n_iter)
+            error = self.error_norm(self.ERROR_CONST[order] * d, y_new, y_new)
+            if error > 1:
+                factor = max(self.MIN_FACTOR, safety * error ** (-1 / (order + 1)))
+                self._change_step(factor)
+                self.nrejected += 1
+                continue
+            break
+
+        # Update differences
+        self.nsteps += 1
+        self._jac_current = False
+        self._n_equal_steps += 1
+        D[order + 2] = d - D[order + 1]
+        D[order + 1] = d
+        for i in reversed(range(order + 1)):
+            D[i] += D[i + 1]
+
+        self._dense = _bdf_dense_output(t_new, h, D[:order + 1].copy())
+        self._frontier = (t_new, y_new, None)
+
+        # Select order and step size for the next step
+        if self._n_equal_steps < order + 1:
+            return
+        errors = [np.inf, error, np.inf]
+        if order > 1:
+            errors[0] = self.error_norm(self.ERROR_CONST[order - 1] * D[order], y_new, y_new)
+        if order < self.max_order:
+            errors[2] = self.error_norm(self.ERROR_CONST[order + 1] * D[order + 2], y_new, y_new)
+        with np.errstate(divide='ignore'):
+            factors = np.array(errors) ** (-1 / np.arange(order, order + 3))
+        delta = int(np.argmax(factors)) - 1
+        self.order += delta
+        self._change_step(min(self.MAX_FACTOR, safety * factors.max()))
+
+    def _newton(self, t, y_predict, c, psi, tol):
+        fn, solve = self.fn, self._solve
+        y = y_predict.copy()
+        d = np.zeros_like(y)
+        scale = self.atol + self.rtol * abs(y_predict)
+        dy_norm_old = None
+        converged = False
+
+        for k in range(self.NEWTON_MAXITER):
+            f = fn(t, y)
+            if not np.all(np.isfinite(f)):
+                break
+            dy = solve(c * f - psi - d)
+            dy_norm = np.sqrt(np.mean((dy / scale) ** 2))
+            rate = None if dy_norm_old is None else dy_norm / dy_norm_old
+            if rate is not None and (
+                    rate >= 1 or rate ** (self.NEWTON_MAXITER - k) / (1 - rate) * dy_norm > tol):
+                break
+            y += dy
+            d += dy
+            if dy_norm == 0 or rate is not None and rate / (1 - rate) * dy_norm < tol:
+                converged = True
+                break
+            dy_norm_old = dy_norm
+        return converged, k + 1, y, d
+
+
+def _bdf_step_matrix(order, factor):
+    I = np.arange(1, order + 1)[:, None]
+    J = np.arange(1, order + 1)
+    M = np.zeros((order + 1, order + 1))
+    M[1:, 1:] = (I - 1 - factor * J) / I
+    M[0] = 1
+    return np.cumprod(M, axis=0)
+
+
+def _bdf_dense_output(t, h, D):
+    order = len(D) - 1
+
+    def dense(t_eval):
+        x = (t_eval - (t - h * np.arange(order))) / (h * (1 + np.arange(order)))
+        return D[0] + np.tensordot(np.cumprod(x), D[1:], axes=1)
+
+    return dense
+
+
+def numeric_jacobian(fn, t, y, f=None) -> np.ndarray:
+    """
+    Approximate the Jacobian of fn(t, y) with forward finite differences.
+    """
+    if f is None:
+        f = fn(t, y)
+    eps = np.sqrt(np.finfo(float).eps)
+    steps = eps * np.maximum(1.0, abs(y))
+    jac = np.empty((len(f), len(y)), dtype=np.result_type(f, y))
+    for j, h in enumerate(steps):
+        y_j = y.copy()
+        y_j[j] += h
+        jac[:, j] = (fn(t, y_j) - f) / h
+    return jac
+
+
+def lu_solver(c, jac):
+    """
+    Compute the LU factorization of ``I - c * jac`` and return a function
+    that solves linear systems with this matrix.
+
+    Sparse Jacobians use scipy.sparse.linalg.splu. Dense matrices use
+    scipy.linalg.lu_factor or fall back to an inverse matrix computed with
+    numpy, if scipy is not installed.
+    """
+    n = jac.shape[0]
+    if not isinstance(jac, np.ndarray):
+        from scipy.sparse import identity
+        from scipy.sparse.linalg import splu
+        return splu((identity(n, format='csc') - c * jac).tocsc()).solve
+
+    matrix = np.eye(n) - c * jac
+    try:
+        from scipy.linalg import lu_factor, lu_solve
+    except ImportError:  # pragma: no cover
+        return np.linalg.inv(matrix).dot
+    lu = lu_factor(matrix)
+    return lambda b: lu_solve(lu, b)
+
+
+def uses_jacobian(solver_class) -> bool:
+    """
+    Return True if solver class accepts the ``jac`` argument.
+    """
+    cls = getattr(solver_class, 'func', solver_class)
+    return getattr(cls, 'uses_jacobian', False)
+
+
+def uses_split(solver_class) -> bool:
+    """
+    Return True if solver class accepts the ``split`` argument.
+    """
+    cls = getattr(solver_class, 'func', solver_class)
+    return getattr(cls, 'uses_split', False)
+
+
+def supports_ensemble(solver_class) -> bool:
+    """
+    Return True if solver class can integrate ensembles.
+    """
+    cls = getattr(solver_class, 'func', solver_class)
+    return getattr(cls, 'supports_ensemble', False)
+
+
+class ScipySolver(Solver):
+    """
+    Adapter to the integrators of :func:`scipy.integrate.solve_ivp`.
+
+    A sequence of steps is integrated with a single call to solve_ivp, which
+    evaluates the solution at the end of each step. Single steps also work,
+    but each one restarts the integrator.
+
+    As in :class:`AdaptiveSolver`, ``niter`` counts the requested output
+    steps and ``nsteps`` counts the steps taken by the scipy integrator.
+
+    Args:
+        method:
+            Any method accepted by solve_ivp: 'LSODA', 'Radau', 'BDF',
+            'DOP853', 'RK45' or 'RK23'.
+        jac:
+            Jacobian function jac(t, y). Explicit methods ignore it.
+        rtol, atol:
+            Relative and absolute tolerances.
+        options:
+            Additional arguments passed to solve_ivp, such as ``max_step``.
+    """
+    __slots__ = ('method', 'jac', 'rtol', 'atol', 'options', 'nsteps', 'njev', 'nlu')
+    fixed_step = False
+    supports_ensemble = False
+    uses_jacobian = True
+
+    #: Methods that use the Jacobian
+    IMPLICIT_METHODS = ('LSODA', 'Radau', 'BDF')
+
+    def __init__(self, fn, y0: ST, t0=0.0, method='LSODA', jac=None, rtol=1e-6,
+                 atol=1e-9, callback=None, log=True, **options):
+        self.method = method
+        self.jac = jac
+        self.rtol = rtol
+        self.atol = atol
+        self.options = options
+        self.nsteps = 0
+        self.njev = 0
+        self.nlu = 0
+        super().__init__(fn, y0, t0, callback=callback, log=log)
+        if self.y.ndim != 1:
+            raise ValueError('scipy solvers require a 1-D state')
+
+    def step_function(self, t, y, dt):
+        return self.integrate(t, y, [t + dt])[:, -1]
+
+    def steps(self, dt: T) -> 'Solver':
+        dt = np.asarray(list(dt), dtype=float)
+        times = self.t + np.cumsum(dt)
+        ys = self.integrate(self.t, self.y, times)
+        cb = self.callback
+        for t, y in zip(times, ys.T):
+            self.t = t
+            self.y[:] = y
+            if cb is not None:
+                cb(t, self.y)
+        return self
+
+    def solve_into(self, dt, data) -> np.ndarray:
+        dt = np.asarray(dt, dtype=float)
+        n = len(dt)
+        if n == 0:
+            return data
+        times = self.t + np.cumsum(dt)
+        data[1:n + 1] = self.integrate(self.t, self.y, times).T
+        self.t = times[-1]
+        self.y[:] = data[n]
+        if self.log:
+            self.niter += n
+        return data
+
+    def integrate(self, t, y, times) -> np.ndarray:
+        """
+        Integrate from state y at time t and return a (size, len(times))
+        array with the solution evaluated at the given times.
+        """
+        from scipy.integrate import solve_ivp
+
+        options = dict(self.options)
+        if self.jac is not None and self.method in self.IMPLICIT_METHODS:
+            options['jac'] = self.jac if self.method != 'LSODA' else _dense_fn(self.jac)
+        fn = self._raw_fns[0]
+        steps = []
+        method = _counting_method(self.method, steps) if self.log else self.method
+        sol = solve_ivp(fn, (t, times[-1]), y, method=method, t_eval=times,
+                        rtol=self.rtol, atol=self.atol, **options)
+        if not sol.success:
+            raise RuntimeError(f'{self.method} failed at t={sol.t[-1]}: {sol.message}')
+        if self.log:
+            self.nsteps += len(steps)
+            self.ncalls += sol.nfev
+            self.njev += sol.njev
+            self.nlu += sol.nlu
+        return sol.y
+
+
+def _counting_method(method, steps):
+    """
+    Subclass the given solve_ivp method to append each successful step to
+    the steps list.
+    """
+    import scipy.integrate
+
+    base = getattr(scipy.integrate, method, None) if isinstance(method, str) else method
+    if not (isinstance(base, type) and issubclass(base, scipy.integrate.OdeSolver)):
+        return method
+
+    class Method(base):
+        def step(self):
+            message = super().step()
+            if message is None:
+                steps.append(self.t)
+            return message
+
+    Method.__name__ = Method.__qualname__ = base.__name__
+    return Method
+
+
+def _dense_fn(fn):
+    def dense(t, y):
+        result = fn(t, y)
+        return result.toarray() if hasattr(result, 'toarray') else result
+
+    return dense
+
+
+class EnsembleSolver:
+    """
+    Integrate an ensemble of trajectories of the same system at once.
+
+    The state is a (members, size) matrix and ``fn(t, y, out=None)`` must
+    evaluate the derivatives of all members in a single call, like the
+    functions created by ``compile_diff_fn(batch=True)``. Each stage of the
+    fixed step solver is then a vectorized operation over the whole ensemble.
+
+    Args:
+        solver_class:
+            A solver class that supports ensembles, such as Euler, RK4 or
+            the multistep and symplectic solvers. Adaptive solvers are not
+            accepted.
+        fn:
+            Batched derivative function.
+        y0:
+            Matrix with the initial state of each member in a row.
+        t0:
+            Initial time.
+        options:
+            Additional arguments passed to the solver class.
+    """
+
+    t = property(lambda self: self.solver.t)
+    y = property(lambda self: self.solver.y)
+    members = property(lambda self: self.solver.y.shape[0])
+    size = property(lambda self: self.solver.y.shape[1])
+
+    def __init__(self, solver_class, fn, y0, t0=0.0, log=True, **options):
+        if np.ndim(y0) != 2:
+            raise ValueError('ensemble state must be a 2-D array')
+        if not supports_ensemble(solver_class):
+            name = getattr(solver_class, '__name__', solver_class)
+            raise ValueError(f'solver does not support ensembles: {name}. '
+                             f'Use a fixed step method such as rk4.')
+        self.solver = solver_class(fn, y0, t0, log=log, **options)
+
+    def solve(self, times, out=None) -> np.ndarray:
+        """
+        Simulate ensemble over all given times and return a
+        (members, len(times), size) array with the trajectories of all
+        members. The resulting array **includes** the initial state.
+        """
+        times = np.asarray(times, dtype=float)
+        solver = self.solver
+        y = solver.y
+        if out is None:
+            out = np.empty((self.members, len(times), self.size), dtype=y.dtype)
+
+        step_into = solver.step_into
+        solver.t = times[0]
+        out[:, 0] = y
+        for i, dt in enumerate(np.diff(times), 1):
+            step_into(solver.t, y, dt, y)
+            solver.t += dt
+            out[:, i] = y
+        if solver.log:
+            solver.niter += len(times) - 1
+        return out
+
+
+def accepts_out(fn) -> bool:
+    """
+    Return True if function accepts an ``out`` argument.
+    """
+    try:
+        return 'out' in inspect.signature(fn).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _fn_into(fn, has_out):
+    """
+    Wrap derivative function into a function with the signature
+    ``fn_into(t, y, out)`` that writes results into out.
+    """
+    if has_out:
+        return fn
+
+    def fn_into(t, y, out):
+        out[...] = fn(t, y)
+
+    return fn_into
+
 
 def compute_to_diff_cb(size, compute, diff_y, cb):
     y = None
@@ -288,4 +1559,16 @@ SOLVERS = {
     'ralston': partial(RK2, alpha=2 / 3),
     'heun': partial(RK2, alpha=1.0),
     'rk4': RK4,
+    'ab': AdamsBashforth,
+    'abm': AdamsBashforthMoulton,
+    'leapfrog': Leapfrog,
+    'verlet': VelocityVerlet,
+    'yoshida4': Yoshida4,
+    'dopri5': DormandPrince,
+    'rk45': DormandPrince,
+    'rosenbrock': Rosenbrock,
+    'bdf': BDF,
+    'lsoda': partial(ScipySolver, method='LSODA'),
+    'radau': partial(ScipySolver, method='Radau'),
+    'dop853': partial(ScipySolver, method='DOP853'),
 }
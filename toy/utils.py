@@ -1,3 +1,4 @@
+from collections.abc import Mapping
 from numbers import Number
 
 import numpy as np
@@ -65,3 +66,36 @@ def substitute(expr, vars):
     if isinstance(value, SymbNumber) and value == int(value):
         return int(value)
     return value
+
+
+class LazyMap(Mapping):
+    """
+    A read-only mapping with a fixed sequence of keys whose values are
+    computed by fn(key) on first access.
+    """
+
+    def __init__(self, keys, fn):
+        self._keys = dict.fromkeys(keys)
+        self._fn = fn
+        self._data = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._data[key]
+        except KeyError:
+            if key not in self._keys:
+                raise
+        value = self._data[key] = self._fn(key)
+        return value
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __repr__(self):
+        return repr(dict(self))